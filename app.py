@@ -1,12 +1,36 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file, stream_with_context
 from flask_cors import CORS, cross_origin
 from storage import Storage
-from stream import Stream
-from youtube import Youtube
+from stream import (
+    COLLECTION_VIEWS, TITLE_SEARCH_MAX_PER_PAGE, VIDEO_VIEWS, Stream, get_video, play_url, proxy_request_headers, proxy_response_headers,
+    relay_chunk_size, thumbnail_url, video_headers, video_problem, video_url,
+)
+from youtube import CHANNELS, channel_key
+import upstream
+from config import (
+    BULK_MAX_ITEMS, BULK_WORKERS, CORS_HEADERS, CORS_METHODS, CORS_ORIGINS, RATE_LIMIT_PER_MINUTE, SECURITY_HEADERS,
+    PLAYLIST_SEARCH_MAX_RESULTS, VIDEO_URLS_WORKERS,
+)
+from ratelimit import RateLimiter
+from playlist_index import PlaylistIndex
+from segments import SEGMENT_SIZE, SegmentCache, request_window, response_headers
+from uploads import MultipartFiles, MultipartUpload
+import conditional
+import response_encoding
+from route_helpers import (
+    bulk_delete_params, bulk_error, bulk_line, bulk_summary, json_headers, not_modified_headers, video_urls_params,
+)
+from projection import parse_fields
+from warming import WARM_ENABLED, Warmer
+from images import derive_later, group_variants, tee, variants_of, wants_variants
+from requests.exceptions import RequestException
 import os
 import logging
 import json
+import tempfile
 from dotenv import load_dotenv
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from werkzeug.http import parse_date
 from werkzeug.middleware.proxy_fix import ProxyFix
 import time
 
@@ -25,18 +49,9 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 # Configure CORS properly
 CORS(app, resources={
     r"/*": {
-        "origins": [
-            "http://localhost:3000",
-            "http://localhost:3002", 
-            "https://backoffice.tnonetwork.com",
-            "https://sistema.tnoradio.com",
-            "https://sistema.tnonetwork.com",
-            "https://tnoradio.com",
-            "https://tnonetwork.com",
-            "http://82.25.79.43"
-        ],
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
+        "origins": CORS_ORIGINS,
+        "methods": CORS_METHODS,
+        "allow_headers": CORS_HEADERS,
         "supports_credentials": True
     }
 })
@@ -51,29 +66,28 @@ logger = logging.getLogger(__name__)
 app.app_context().push()
 
 STORAGE_API_KEY = os.environ.get("BUNNY_STORAGE_API_KEY")
+UPLOAD_SPOOL_MAX_MEMORY = 1024 * 1024
+
+# Local disk copy of proxied videos and thumbnails
+segment_cache = SegmentCache()
+
+# Local index of the YouTube playlists
+playlist_index = PlaylistIndex()
+
+# Listings kept warm in the background, shared with the other workers through a snapshot
+warmer = Warmer(playlist_index=playlist_index)
 
 # Rate limiting middleware
+rate_limiter = RateLimiter(limit=RATE_LIMIT_PER_MINUTE, window=60)
+
+if WARM_ENABLED:
+    warmer.start()
+
 @app.before_request
 def rate_limit():
-    # Simple rate limiting - 100 requests per minute per IP
-    client_ip = request.remote_addr
-    current_time = time.time()
-    
-    # This is a simple in-memory rate limiter
-    # In production, you might want to use Redis or a more sophisticated solution
-    if not hasattr(app, 'rate_limit_data'):
-        app.rate_limit_data = {}
-    
-    if client_ip in app.rate_limit_data:
-        last_request_time, request_count = app.rate_limit_data[client_ip]
-        if current_time - last_request_time < 60:  # 1 minute window
-            if request_count >= 100:
-                return jsonify({"error": "Rate limit exceeded"}), 429
-            app.rate_limit_data[client_ip] = (last_request_time, request_count + 1)
-        else:
-            app.rate_limit_data[client_ip] = (current_time, 1)
-    else:
-        app.rate_limit_data[client_ip] = (current_time, 1)
+    # Simple rate limiting - RATE_LIMIT_PER_MINUTE requests per minute per IP
+    if not rate_limiter.allow(request.remote_addr, time.time()):
+        return jsonify({"error": "Rate limit exceeded"}), 429
 
 # Request timeout middleware
 @app.before_request
@@ -83,10 +97,7 @@ def timeout_middleware():
 @app.after_request
 def after_request(response):
     # Add security headers
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
+    response.headers.update(SECURITY_HEADERS)
     
     # Log request time
     if hasattr(request, 'start_time'):
@@ -101,7 +112,8 @@ def health_check():
         "status": "healthy", 
         "message": "CDN Service is running",
         "timestamp": time.time(),
-        "service": "tnoradio-cdn-service"
+        "service": "tnoradio-cdn-service",
+        "upstream": upstream.coalescing_stats(),
     })
 
 @app.route("/")
@@ -116,39 +128,67 @@ def root():
 @app.route('/upload_file', methods=['POST'])
 def upload_file():
     try:
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, file"}), 400
+
+        # Leer el multipart a medida que llega: el archivo va directo a Bunny.net, sin /tmp
+        upload = MultipartUpload(boundary)
+        fields = upload.read_until_file(request.stream)
+        
         # Obtener parámetros del request
-        show_slug = request.form.get('show_slug')
-        image_type = request.form.get('image_type')
-        file = request.files.get('file')
+        show_slug = fields.get('show_slug') or request.args.get('show_slug')
+        image_type = fields.get('image_type') or request.args.get('image_type')
         
-        if not all([show_slug, image_type, file]):
+        # a file input left empty sends a file part with an empty name
+        if not upload.filename:
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, file"}), 400
+
+        if show_slug and image_type:
+            data = upload.iter_file(request.stream)
+        else:
+            # Campos enviados después del archivo: guardarlo en un spool acotado en memoria
+            spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+            for chunk in upload.iter_file(request.stream):
+                spool.write(chunk)
+            fields = upload.read_to_end(request.stream)
+            show_slug = fields.get('show_slug')
+            image_type = fields.get('image_type')
+            spool.seek(0)
+            data = iter(lambda: spool.read(upload.chunk_size), b"")
+
+        if not all([show_slug, image_type]):
             return jsonify({"error": "Missing required parameters: show_slug, image_type, file"}), 400
         
         # Crear instancia de Storage
         myStorage = Storage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
         
         # Construir la ruta de almacenamiento
-        storage_path = f"{image_type}/{file.filename}"
-        
-        # Guardar archivo temporalmente
-        temp_path = f"/tmp/{file.filename}"
-        file.save(temp_path)
-        
-        # Subir a Bunny.net
-        result = myStorage.PutFile(
-            file_name=file.filename,
-            storage_path=storage_path,
-            local_upload_file_path="/tmp"
-        )
-        
-        # Limpiar archivo temporal
-        os.remove(temp_path)
+        storage_path = f"{image_type}/{upload.filename}"
+        
+        # Las imagenes se copian a disco mientras se suben, para generar sus variantes
+        source = tempfile.NamedTemporaryFile(prefix="tnoradio-upload-", delete=False) if wants_variants(upload.filename) else None
+        try:
+            # Subir a Bunny.net
+            result = myStorage.PutStream(data if source is None else tee(data, source), storage_path)
+            upload.read_to_end(request.stream)
+            variants = []
+            if source is not None and result.get("status") == "success":
+                source.close()
+                # Las variantes se generan en segundo plano, que borra la copia al terminar
+                derive_later(myStorage, storage_path, source.name)
+                source, variants = None, "pending"
+        finally:
+            if source is not None:
+                source.close()
+                os.remove(source.name)
         
         if result.get("status") == "success":
             return jsonify({
                 "status": "success",
                 "message": "File uploaded successfully to Bunny.net",
-                "file_path": storage_path
+                "file_path": storage_path,
+                "variants": variants
             }), 200
         else:
             return jsonify({
@@ -180,6 +220,11 @@ def delete_file():
         result = myStorage.DeleteFile(storage_path)
         
         if result.get("status") == "success":
+            # y sus variantes
+            listing = myStorage.GetStoragedObjectsList(image_type) if wants_variants(filename) else []
+            if isinstance(listing, list):
+                for _ in myStorage.DeleteFiles([f"{image_type}/{name}" for name in variants_of(listing, filename)]):
+                    pass
             return jsonify({
                 "status": "success",
                 "message": "File deleted successfully from Bunny.net"
@@ -194,6 +239,106 @@ def delete_file():
         logger.error(f"Error deleting file: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/upload_files', methods=['POST'])
+def upload_files():
+    try:
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, files"}), 400
+
+        # Cada archivo se sube apenas termina de llegar, mientras se lee el resto del body
+        upload = MultipartFiles(boundary, UPLOAD_SPOOL_MAX_MEMORY)
+        part = upload.read_next_file(request.stream)
+        show_slug = upload.fields.get('show_slug') or request.args.get('show_slug')
+        image_type = upload.fields.get('image_type') or request.args.get('image_type')
+
+        # show_slug e image_type tienen que llegar antes que los archivos
+        if part is None or not all([show_slug, image_type]):
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, files"}), 400
+
+        myStorage = Storage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
+
+        def put(filename, spool):
+            storage_path = f"{image_type}/{filename}"
+            try:
+                return storage_path, myStorage.PutFileObject(spool, storage_path)
+            except Exception as e:
+                return storage_path, {"status": "error", "msg": str(e)}
+            finally:
+                spool.close()
+
+        def generate():
+            counts = {}
+            received = 0
+            with ThreadPoolExecutor(max_workers=BULK_WORKERS) as pool:
+                pending = set()
+                current = part
+                while current is not None:
+                    received += 1
+                    if not current[0]:
+                        # a file input left empty sends a file part with an empty name
+                        current[1].close()
+                        yield bulk_error(counts, f"{image_type}/", "Missing file")
+                    elif received > BULK_MAX_ITEMS:
+                        current[1].close()
+                        yield bulk_error(counts, f"{image_type}/{current[0]}", f"At most {BULK_MAX_ITEMS} files per request")
+                    else:
+                        pending.add(pool.submit(put, *current))
+                    # at most two spooled files per worker waiting
+                    done, pending = wait(pending, timeout=0 if len(pending) < 2 * BULK_WORKERS else None, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield bulk_line(counts, *future.result())
+                    current = upload.read_next_file(request.stream)
+                for future in as_completed(pending):
+                    yield bulk_line(counts, *future.result())
+            yield bulk_summary(counts)
+
+        return Response(stream_with_context(generate()), content_type='application/x-ndjson')
+
+    except Exception as e:
+        logger.error(f"Error uploading files: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/delete_files', methods=['POST', 'DELETE'])
+def delete_files():
+    try:
+        params = request.get_json(silent=True) or {}
+        bulk, problem = bulk_delete_params(params, request.args)
+        if problem:
+            return jsonify(problem[0]), problem[1]
+        show_slug, paths, invalid = bulk
+
+        myStorage = Storage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
+
+        def generate():
+            counts = {}
+            for path in invalid:
+                yield bulk_error(counts, path, "Invalid path")
+            # Una linea por archivo a medida que Bunny.net responde
+            for path, result in myStorage.DeleteFiles(paths, BULK_WORKERS):
+                yield bulk_line(counts, path, result)
+            yield bulk_summary(counts)
+
+        return Response(stream_with_context(generate()), content_type='application/x-ndjson')
+
+    except Exception as e:
+        logger.error(f"Error deleting files: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def _conditional_json(payload, validators):
+    """
+    Response with the JSON of payload, compressed for the client, with an ETag
+    and Last-Modified derived from the cached sources it was built from, or a
+    304 when the client's copy is current. Bodies with an ETag are encoded
+    and compressed once.
+    """
+    validator = conditional.combine(request.full_path, validators)
+    headers = not_modified_headers(request.headers, validator)
+    if headers is not None:
+        return Response(status=304, headers=headers)
+    body, coding = response_encoding.encode(payload, request.headers.get('Accept-Encoding'), validator[0] if validator else None)
+    return Response(body, headers=json_headers(validator, coding))
+
 @app.route('/list_files', methods=['GET'])
 def list_files():
     try:
@@ -207,15 +352,24 @@ def list_files():
         myStorage = Storage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
         
         # Listar archivos
-        if image_type:
+        recursive = request.args.get('recursive', '').lower() in ('1', 'true', 'yes')
+        if recursive:
+            # Todo el arbol de la carpeta (o del show) en una sola lista
+            result = myStorage.GetStoragedObjectsTree(image_type)
+        elif image_type:
             result = myStorage.GetStoragedObjectsList(image_type)
         else:
             result = myStorage.GetStoragedObjectsList()
+        if not isinstance(result, list):
+            return jsonify({"status": "success", "files": result}), 200
+        # Las variantes de cada imagen van dentro de su original
+        validators = myStorage.ListingValidators(image_type, result if recursive else None)
+        result = group_variants(result)
         
-        return jsonify({
+        return _conditional_json({
             "status": "success",
             "files": result
-        }), 200
+        }, validators)
         
     except Exception as e:
         logger.error(f"Error listing files: {e}")
@@ -226,7 +380,7 @@ def get_stream():
     try:
         myStream = Stream()
         theList = myStream.GetVideoLibraryList()
-        return jsonify(theList)
+        return _conditional_json(theList, [myStream.LibraryValidator(theList)])
     except Exception as e:
         logger.error(f"Error in get_stream: {str(e)}")
         return jsonify({"error": "Internal server error", "message": str(e)}), 500
@@ -236,8 +390,24 @@ def get_videos():
     try:
         stream = request.args.get('collection')
         logger.info(f"Fetching videos for collection: {stream}")
+        try:
+            # Solo algunos campos de cada video (fields=guid,title o view=compact)
+            fields = parse_fields(request.args.get('fields'), request.args.get('view'), VIDEO_VIEWS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         myStream = Stream()
+        if not fields and not myStream.IsVideosListCached(stream):
+            # Paginas en paralelo, enviadas al cliente a medida que llegan
+            try:
+                chunks = myStream.StreamVideosList(stream)
+            except RequestException as e:
+                logger.error(f"Stream API error: {e}")
+                return jsonify({"error": str(e), "items": [], "totalItems": 0}), 500
+            if chunks is not None:
+                return Response(stream_with_context(chunks), content_type='application/json')
+            # otherwise another request is loading it: GetVideosList waits for it
+
         theList = myStream.GetVideosList(stream)
         
         # The Stream class now returns JSON, so we can return it directly
@@ -245,7 +415,8 @@ def get_videos():
             logger.error(f"Stream API error: {theList['error']}")
             return jsonify(theList), 500
         
-        return jsonify(theList)
+        payload = myStream.ProjectVideosList(theList, stream, fields).to_json if fields else theList
+        return _conditional_json(payload, [myStream.VideosValidator(stream, theList)])
             
     except Exception as e:
         logger.error(f"Error in get_videos: {str(e)}")
@@ -256,8 +427,10 @@ def get_video_by_title():
     try:
         title = request.args.get('title')
         libraryId = request.args.get('libraryId')
+        page = max(request.args.get('page', 1, type=int), 1)
+        itemsPerPage = min(max(request.args.get('itemsPerPage', 10, type=int), 1), TITLE_SEARCH_MAX_PER_PAGE)
         myStream = Stream()
-        theVideo = myStream.GetVideoByTitle(libraryId,title)
+        theVideo = myStream.GetVideoByTitle(libraryId, title, page, itemsPerPage)
         return jsonify(theVideo)
     except Exception as e:
         logger.error(f"Error in get_video_by_title: {str(e)}")
@@ -267,8 +440,16 @@ def get_video_by_title():
 def get_collections_list():
     try:
         myStream = Stream()
+        try:
+            fields = parse_fields(request.args.get('fields'), request.args.get('view'), COLLECTION_VIEWS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         theList = myStream.GetColletcionsList()
-        return jsonify(theList)
+        if fields and "error" not in theList:
+            payload = myStream.ProjectColletcionsList(theList, fields).to_json
+        else:
+            payload = theList
+        return _conditional_json(payload, [myStream.CollectionsValidator(theList)])
     except Exception as e:
         logger.error(f"Error in get_collections_list: {str(e)}")
         return jsonify({"error": "Internal server error", "message": str(e)}), 500
@@ -289,13 +470,49 @@ def get_shows():
 def get_youtube_playlists():
     try:
         channel = request.args.get('channel', 'tnoradio')  # Default to 'tnoradio'
-        myYoutube = Youtube(channel)
-        playlists = myYoutube.get_playlists()
-        return jsonify(playlists)
+        # Answered from the local index, synced in the background
+        playlist_index.start()
+        playlist_index.ensure_synced(channel)
+        return jsonify(playlist_index.playlists(channel))
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/search_youtube_playlists', methods=['GET'])
+def search_youtube_playlists():
+    try:
+        query = request.args.get('q', '').strip()
+        channel = request.args.get('channel')
+        limit = min(request.args.get('limit', 10, type=int), PLAYLIST_SEARCH_MAX_RESULTS)
+        if not query:
+            return jsonify({"error": "Missing required parameter: q"}), 400
+
+        # Autocomplete over the playlist titles of the local index, both channels by default
+        channels = (channel_key(channel),) if channel else CHANNELS
+        playlist_index.start()
+        for name in channels:
+            playlist_index.ensure_synced(name)
+        return jsonify(playlist_index.search(query, channels, limit))
+    except Exception as e:
+        logger.error(f"Error in search_youtube_playlists: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def _video_problem(guid, api_key, resolution=None):
+    """Looks the video up in the guid index; returns (error payload, status) or None"""
+    try:
+        video = get_video(guid, api_key)
+    except RequestException as e:
+        logger.error(f"Error getting video info: {e}")
+        video = None
+    return video_problem(video, resolution)
+
+def _check_video(guid, api_key, resolution=None):
+    """Checks the video exists (and has the resolution); returns an error response or None"""
+    problem = _video_problem(guid, api_key, resolution)
+    if problem:
+        return jsonify(problem[0]), problem[1]
+    return None
+
 @app.route('/get_video_stream', methods=['GET'])
 def get_video_stream():
     try:
@@ -306,59 +523,18 @@ def get_video_stream():
         if not guid:
             return jsonify({"error": "Missing required parameter: guid"}), 400
         
-        video_library_id = os.environ.get("BUNNY_VIDEO_LIBRARY_ID", "286671")
         api_key = os.environ.get("BUNNY_API_KEY")
         
-        if format_type == 'hls':
-            # For HLS, we need to use the API to get the playlist URL
-            if api_key:
-                # Use BunnyCDN API to get the video info and generate proper URL
-                import requests
-                headers = {
-                    'AccessKey': api_key,
-                    'Content-Type': 'application/json'
-                }
-                
-                # Get video info
-                video_url = f"https://video.bunnycdn.com/library/{video_library_id}/videos/{guid}"
-                response = requests.get(video_url, headers=headers)
-                
-                if response.status_code == 200:
-                    video_data = response.json()
-                    # Return the HLS playlist URL
-                    hls_url = f"https://video.bunnycdn.com/stream/{video_library_id}/{guid}/playlist.m3u8"
-                    return jsonify({"url": hls_url}), 200
-                else:
-                    return jsonify({"error": "Failed to get video info"}), 500
-            else:
-                # Fallback to direct URL (may not work for private videos)
-                hls_url = f"https://video.bunnycdn.com/stream/{video_library_id}/{guid}/playlist.m3u8"
-                return jsonify({"url": hls_url}), 200
-        else:
-            # For MP4, try to get the direct URL
-            if api_key:
-                # Use BunnyCDN API to get the video info
-                import requests
-                headers = {
-                    'AccessKey': api_key,
-                    'Content-Type': 'application/json'
-                }
-                
-                # Get video info
-                video_url = f"https://video.bunnycdn.com/library/{video_library_id}/videos/{guid}"
-                response = requests.get(video_url, headers=headers)
-                
-                if response.status_code == 200:
-                    video_data = response.json()
-                    # Return the MP4 URL with specified resolution
-                    mp4_url = f"https://video.bunnycdn.com/stream/{video_library_id}/{guid}/play_{resolution}.mp4"
-                    return jsonify({"url": mp4_url}), 200
-                else:
-                    return jsonify({"error": "Failed to get video info"}), 500
-            else:
-                # Fallback to direct URL (may not work for private videos)
-                mp4_url = f"https://video.bunnycdn.com/stream/{video_library_id}/{guid}/play_{resolution}.mp4"
-                return jsonify({"url": mp4_url}), 200
+        # HLS playlist URL, or the MP4 URL with the specified resolution
+        url = video_url(guid, resolution, format_type)
+
+        if api_key:
+            # Check the video exists before returning its URL
+            error = _check_video(guid, api_key, None if format_type == 'hls' else resolution)
+            if error:
+                return error
+        # Without API key fall back to the direct URL (may not work for private videos)
+        return jsonify({"url": url}), 200
             
     except Exception as e:
         logger.error(f"Error getting video stream: {e}")
@@ -372,37 +548,47 @@ def get_video_thumbnail():
         if not guid:
             return jsonify({"error": "Missing required parameter: guid"}), 400
         
-        video_library_id = os.environ.get("BUNNY_VIDEO_LIBRARY_ID", "286671")
         api_key = os.environ.get("BUNNY_API_KEY")
         
         if api_key:
-            # Use BunnyCDN API to get the video info and thumbnail
-            import requests
-            headers = {
-                'AccessKey': api_key,
-                'Content-Type': 'application/json'
-            }
-            
-            # Get video info
-            video_url = f"https://video.bunnycdn.com/library/{video_library_id}/videos/{guid}"
-            response = requests.get(video_url, headers=headers)
-            
-            if response.status_code == 200:
-                video_data = response.json()
-                # Return the thumbnail URL
-                thumbnail_url = f"https://video.bunnycdn.com/stream/{video_library_id}/{guid}/thumbnail.jpg"
-                return jsonify({"url": thumbnail_url}), 200
-            else:
-                return jsonify({"error": "Failed to get video info"}), 500
-        else:
-            # Fallback to direct URL
-            thumbnail_url = f"https://video.bunnycdn.com/stream/{video_library_id}/{guid}/thumbnail.jpg"
-            return jsonify({"url": thumbnail_url}), 200
+            # Check the video exists before returning its thumbnail
+            error = _check_video(guid, api_key)
+            if error:
+                return error
+        return jsonify({"url": thumbnail_url(guid)}), 200
             
     except Exception as e:
         logger.error(f"Error getting video thumbnail: {e}")
         return jsonify({"error": str(e)}), 500
 
+def _resolve_video(guid, api_key, resolution, format_type):
+    """Entry of /get_video_urls for one guid: its stream and thumbnail URLs, or why it has none"""
+    if api_key:
+        problem = _video_problem(guid, api_key, None if format_type == 'hls' else resolution)
+        if problem:
+            return problem[0]
+    return {"url": video_url(guid, resolution, format_type), "thumbnail": thumbnail_url(guid)}
+
+@app.route('/get_video_urls', methods=['GET', 'POST'])
+def get_video_urls():
+    try:
+        params = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+        batch, problem = video_urls_params(params)
+        if problem:
+            return jsonify(problem[0]), problem[1]
+        guids, resolution, format_type = batch
+        
+        api_key = os.environ.get("BUNNY_API_KEY")
+        
+        # guids missing from the index are looked up upstream concurrently
+        with ThreadPoolExecutor(max_workers=min(VIDEO_URLS_WORKERS, len(guids))) as pool:
+            entries = pool.map(lambda guid: _resolve_video(guid, api_key, resolution, format_type), guids)
+            return jsonify({"videos": dict(zip(guids, entries))}), 200
+            
+    except Exception as e:
+        logger.error(f"Error getting video urls: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/get_playlist_items', methods=['GET'])
 def get_youtube_playlist_items():
     try:
@@ -411,9 +597,9 @@ def get_youtube_playlist_items():
         if not playlist_name:
             return jsonify({"error": "playlist_name parameter is required"}), 400
 
-        myYoutube = Youtube(channel)
-        playlist_items = myYoutube.get_playlist_items(playlist_name)
-        return playlist_items
+        playlist_index.start()
+        playlist_index.ensure_synced(channel)
+        return jsonify(playlist_index.playlist_items(channel, playlist_name))
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
@@ -427,60 +613,137 @@ def get_all_episodes_sorted_route():
         if not playlist_name:
             return jsonify({"error": "Missing playlist_name parameter"}), 400
 
-        # Fetch the sorted episodes
-        youtube = Youtube('tnoradio')  # Initialize Youtube class with default channel
-        episodes = youtube.get_all_episodes_sorted(playlist_name)
+        # Sorted episodes of both channels, from the local index
+        playlist_index.start()
+        with ThreadPoolExecutor(max_workers=len(CHANNELS)) as pool:
+            list(pool.map(playlist_index.ensure_synced, CHANNELS))
+        # read before the episodes: a sync landing in between only costs the client one more 200
+        validators = playlist_index.validators()
+        episodes = playlist_index.all_episodes_sorted(playlist_name)
 
-        return jsonify(episodes), 200
+        return _conditional_json(episodes, validators)
     except Exception as e:
         print(f"Error fetching episodes: {e}")
         return jsonify({"error": "An error occurred while fetching episodes"}), 500
 
+def _cached_video(obj, api_key, guid, resolution):
+    """Serves /proxy_video from the segment cache, fetching the missing ranges on the way"""
+    window = request_window(obj, request.headers.get('Range'), request.headers.get('If-Range'))
+    if window is None:
+        return None
+    status, start, end = window
+    headers = response_headers(obj, status, start, end)
+    if status == 416:
+        return Response(status=416, headers=headers)
+    if segment_cache.is_complete(obj):
+        # whole file on disk: send_file answers the range itself and lets the server use sendfile
+        try:
+            if segment_cache.current(obj) is not None:
+                return send_file(
+                    obj.path, mimetype=obj.content_type, conditional=True,
+                    etag=obj.etag.strip('"') if obj.etag else False,
+                    last_modified=parse_date(obj.last_modified), max_age=3600,
+                )
+        except FileNotFoundError:
+            pass
+        # dropped by another worker: fetched again
+        return None
+    runs = segment_cache.runs(obj, start, end)
+
+    def relay():
+        for cached, run_start, run_end in runs:
+            if cached:
+                try:
+                    yield from segment_cache.read(obj, run_start, run_end)
+                except FileNotFoundError:
+                    # dropped or replaced by another worker: cut this response short
+                    logger.warning(f"Cached video {guid} dropped while relayed")
+                    return
+                continue
+            range_headers = video_headers(api_key)
+            range_headers['Range'] = f"bytes={run_start}-{run_end}"
+            fill_response = upstream.get(play_url(guid, resolution), headers=range_headers, stream=True)
+            try:
+                if fill_response.status_code != 206 or fill_response.headers.get('ETag') != obj.etag:
+                    # the video changed upstream: drop it and cut this response short
+                    segment_cache.invalidate(obj.key)
+                    logger.warning(f"Cached video {guid} changed upstream")
+                    return
+                fill = segment_cache.fill(obj, run_start, start, end)
+                try:
+                    for chunk in iter(lambda: fill_response.raw.read(SEGMENT_SIZE, decode_content=False), b""):
+                        data = fill.feed(chunk)
+                        if data:
+                            yield data
+                finally:
+                    fill.close()
+            finally:
+                fill_response.close()
+
+    return Response(relay(), status=status, headers=headers, direct_passthrough=True)
+
 @app.route('/proxy_video/<guid>', methods=['GET'])
 def proxy_video(guid):
     try:
         resolution = request.args.get('resolution', '720p')
-        video_library_id = os.environ.get("BUNNY_VIDEO_LIBRARY_ID", "286671")
         api_key = os.environ.get("BUNNY_API_KEY")
         
         if not api_key:
             return jsonify({"error": "API key not configured"}), 500
         
-        # Use BunnyCDN API to get the video info
-        import requests
-        headers = {
-            'AccessKey': api_key,
-            'Content-Type': 'application/json'
-        }
-        
-        # Get video info
-        video_url = f"https://video.bunnycdn.com/library/{video_library_id}/videos/{guid}"
-        response = requests.get(video_url, headers=headers)
-        
-        if response.status_code != 200:
-            return jsonify({"error": "Failed to get video info"}), 500
-        
-        video_data = response.json()
-        
-        # Stream the video content through our server
-        stream_url = f"https://video.bunnycdn.com/stream/{video_library_id}/{guid}/play_{resolution}.mp4"
-        
-        # Get the video stream with authentication
-        stream_response = requests.get(stream_url, headers=headers, stream=True)
+        error = _check_video(guid, api_key, resolution)
+        if error:
+            return error
+        
+        # Serve what is already on local disk
+        cached = segment_cache.lookup((guid, resolution))
+        if cached is not None:
+            cached_response = _cached_video(cached, api_key, guid, resolution)
+            if cached_response is not None:
+                return cached_response
+        
+        # Get the video stream with authentication, forwarding Range/If-Range
+        stream_response = upstream.get(
+            play_url(guid, resolution),
+            headers=proxy_request_headers(api_key, request.headers),
+            stream=True,
+        )
         
-        if stream_response.status_code != 200:
+        if stream_response.status_code == 416:
+            stream_response.close()
+            return Response(status=416, headers={
+                'Content-Range': stream_response.headers.get('content-range', '')
+            })
+        if stream_response.status_code not in (200, 206):
+            stream_response.close()
             return jsonify({"error": "Failed to get video stream"}), 500
         
-        # Return the video stream
-        from flask import Response
+        chunk_size = relay_chunk_size(stream_response.headers.get('content-length'))
+        raw = stream_response.raw
+        # keep a copy on local disk while relaying
+        fill = segment_cache.begin((guid, resolution), stream_response.status_code, stream_response.headers)
+
+        def relay():
+            # raw reads, no decoding or re-chunking: every chunk is sent as read
+            try:
+                while True:
+                    chunk = raw.read(chunk_size, decode_content=False)
+                    if not chunk:
+                        break
+                    if fill is not None:
+                        fill.feed(chunk)
+                    yield chunk
+            finally:
+                if fill is not None:
+                    fill.close()
+                stream_response.close()
+
+        # Stream the video content through our server
         return Response(
-            stream_response.iter_content(chunk_size=8192),
-            content_type=stream_response.headers.get('content-type', 'video/mp4'),
-            headers={
-                'Content-Length': stream_response.headers.get('content-length'),
-                'Accept-Ranges': 'bytes',
-                'Cache-Control': 'public, max-age=3600'
-            }
+            relay(),
+            status=stream_response.status_code,
+            headers=proxy_response_headers(stream_response.headers),
+            direct_passthrough=True,
         )
         
     except Exception as e:
@@ -490,40 +753,41 @@ def proxy_video(guid):
 @app.route('/proxy_thumbnail/<guid>', methods=['GET'])
 def proxy_thumbnail(guid):
     try:
-        video_library_id = os.environ.get("BUNNY_VIDEO_LIBRARY_ID", "286671")
         api_key = os.environ.get("BUNNY_API_KEY")
         
         if not api_key:
             return jsonify({"error": "API key not configured"}), 500
         
-        # Use BunnyCDN API to get the video info
-        import requests
-        headers = {
-            'AccessKey': api_key,
-            'Content-Type': 'application/json'
-        }
+        headers = video_headers(api_key)
         
-        # Get video info
-        video_url = f"https://video.bunnycdn.com/library/{video_library_id}/videos/{guid}"
-        response = requests.get(video_url, headers=headers)
+        error = _check_video(guid, api_key)
+        if error:
+            return error
         
-        if response.status_code != 200:
-            return jsonify({"error": "Failed to get video info"}), 500
-        
-        video_data = response.json()
+        cached = segment_cache.lookup((guid, 'thumbnail'))
+        if cached is not None and segment_cache.is_complete(cached):
+            try:
+                return send_file(cached.path, mimetype=cached.content_type, etag=False, max_age=3600)
+            except FileNotFoundError:
+                # dropped by another worker meanwhile
+                pass
         
         # Get the thumbnail with authentication
-        thumbnail_url = f"https://video.bunnycdn.com/stream/{video_library_id}/{guid}/thumbnail.jpg"
-        thumbnail_response = requests.get(thumbnail_url, headers=headers)
+        thumbnail_response = upstream.get(thumbnail_url(guid), headers=headers)
         
         if thumbnail_response.status_code != 200:
             return jsonify({"error": "Failed to get thumbnail"}), 500
         
+        content_type = thumbnail_response.headers.get('content-type', 'image/jpeg')
+        # requests coalesced on the same fetch store it once
+        stored = segment_cache.lookup((guid, 'thumbnail'))
+        if thumbnail_response.content and (stored is None or not segment_cache.is_complete(stored)):
+            segment_cache.store((guid, 'thumbnail'), thumbnail_response.content, content_type)
+        
         # Return the thumbnail
-        from flask import Response
         return Response(
             thumbnail_response.content,
-            content_type=thumbnail_response.headers.get('content-type', 'image/jpeg'),
+            content_type=content_type,
             headers={
                 'Cache-Control': 'public, max-age=3600'
             }
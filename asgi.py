@@ -0,0 +1,779 @@
+"""
+Async (ASGI) serving mode for the CDN service.
+
+Same endpoints and responses as the Flask app in app.py, served on one event
+loop so a worker can keep thousands of upstream calls in flight. Run with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 19000
+
+app.py stays the sync (gunicorn) fallback.
+"""
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+from storage import AsyncStorage
+from stream import (
+    COLLECTION_VIEWS, TITLE_SEARCH_MAX_PER_PAGE, VIDEO_VIEWS, AsyncStream, aget_video, play_url, proxy_request_headers, proxy_response_headers,
+    thumbnail_url, video_headers, video_problem, video_url,
+)
+from youtube import CHANNELS, channel_key
+import aiohttp
+import upstream
+from config import (
+    BULK_MAX_ITEMS, BULK_WORKERS, CORS_HEADERS, CORS_METHODS, CORS_ORIGINS, RATE_LIMIT_PER_MINUTE, SECURITY_HEADERS,
+    PLAYLIST_SEARCH_MAX_RESULTS, VIDEO_URLS_WORKERS,
+)
+from ratelimit import RateLimiter
+from playlist_index import PlaylistIndex
+from segments import SegmentCache, request_window, response_headers
+from uploads import MultipartFiles, MultipartUpload
+import conditional
+import response_encoding
+from route_helpers import (
+    bulk_delete_params, bulk_error, bulk_line, bulk_summary, json_headers, not_modified_headers, video_urls_params,
+)
+from projection import parse_fields
+from warming import WARM_ENABLED, Warmer
+from images import aderive_later, atee, await_pending, group_variants, variants_of, wants_variants
+import os
+import asyncio
+import logging
+import tempfile
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+app = Quart(__name__)
+
+# Production configuration
+app.config['PROPAGATE_EXCEPTIONS'] = True
+app.json.sort_keys = False
+# Uploads are streamed to Bunny, so the body size is not limited here
+app.config['MAX_CONTENT_LENGTH'] = None
+
+# Configure CORS properly
+app = cors(
+    app,
+    allow_origin=CORS_ORIGINS,
+    allow_methods=CORS_METHODS,
+    allow_headers=CORS_HEADERS,
+    allow_credentials=True,
+)
+
+logger = logging.getLogger(__name__)
+
+STORAGE_API_KEY = os.environ.get("BUNNY_STORAGE_API_KEY")
+UPLOAD_SPOOL_MAX_MEMORY = 1024 * 1024
+
+# Local disk copy of proxied videos and thumbnails
+segment_cache = SegmentCache()
+
+# Local index of the YouTube playlists
+playlist_index = PlaylistIndex()
+
+# Listings kept warm in the background, shared with the other workers through a snapshot
+warmer = Warmer(playlist_index=playlist_index)
+
+# Rate limiting middleware
+rate_limiter = RateLimiter(limit=RATE_LIMIT_PER_MINUTE, window=60)
+
+@app.before_request
+async def rate_limit():
+    # Simple rate limiting - RATE_LIMIT_PER_MINUTE requests per minute per IP
+    if not rate_limiter.allow(request.remote_addr, time.time()):
+        return jsonify({"error": "Rate limit exceeded"}), 429
+
+@app.before_request
+async def timeout_middleware():
+    request.start_time = time.time()
+
+@app.after_request
+async def after_request(response):
+    # Add security headers
+    response.headers.update(SECURITY_HEADERS)
+
+    # Log request time
+    if hasattr(request, 'start_time'):
+        duration = time.time() - request.start_time
+        logger.info(f"{request.method} {request.path} - {response.status_code} - {duration:.3f}s")
+
+    return response
+
+@app.before_serving
+async def start_warming():
+    if WARM_ENABLED:
+        warmer.start()
+
+@app.after_serving
+async def close_upstream():
+    warmer.stop()
+    await await_pending()
+    await upstream.aclose_async_client()
+
+@app.route("/health")
+async def health_check():
+    return jsonify({
+        "status": "healthy",
+        "message": "CDN Service is running",
+        "timestamp": time.time(),
+        "service": "tnoradio-cdn-service",
+        "upstream": upstream.coalescing_stats(),
+    })
+
+@app.route("/")
+async def root():
+    return jsonify({
+        "service": "tnoradio-cdn-service",
+        "version": "1.0.0",
+        "status": "running"
+    })
+
+@app.route('/upload_file', methods=['POST'])
+async def upload_file():
+    try:
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, file"}), 400
+
+        # Leer el multipart a medida que llega: el archivo va directo a Bunny.net, sin /tmp
+        chunks = request.body.__aiter__()
+        upload = MultipartUpload(boundary)
+        fields = await upload.aread_until_file(chunks)
+        show_slug = fields.get('show_slug') or request.args.get('show_slug')
+        image_type = fields.get('image_type') or request.args.get('image_type')
+
+        # a file input left empty sends a file part with an empty name
+        if not upload.filename:
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, file"}), 400
+
+        if show_slug and image_type:
+            data = upload.aiter_file(chunks)
+        else:
+            # Campos enviados después del archivo: guardarlo en un spool acotado en memoria
+            spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY)
+            async for chunk in upload.aiter_file(chunks):
+                spool.write(chunk)
+            fields = await upload.aread_to_end(chunks)
+            show_slug = fields.get('show_slug')
+            image_type = fields.get('image_type')
+            spool.seek(0)
+
+            async def data_from_spool():
+                while chunk := spool.read(upload.chunk_size):
+                    yield chunk
+
+            data = data_from_spool()
+
+        if not all([show_slug, image_type]):
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, file"}), 400
+
+        myStorage = AsyncStorage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
+        storage_path = f"{image_type}/{upload.filename}"
+
+        # Las imagenes se copian a disco mientras se suben, para generar sus variantes
+        source = None
+        if wants_variants(upload.filename):
+            source = await asyncio.to_thread(tempfile.NamedTemporaryFile, prefix="tnoradio-upload-", delete=False)
+        try:
+            result = await myStorage.PutStream(data if source is None else atee(data, source), storage_path)
+            await upload.aread_to_end(chunks)
+            variants = []
+            if source is not None and result.get("status") == "success":
+                source.close()
+                # Las variantes se generan en segundo plano, que borra la copia al terminar
+                aderive_later(myStorage, storage_path, source.name)
+                source, variants = None, "pending"
+        finally:
+            if source is not None:
+                source.close()
+                await asyncio.to_thread(os.remove, source.name)
+
+        if result.get("status") == "success":
+            return jsonify({
+                "status": "success",
+                "message": "File uploaded successfully to Bunny.net",
+                "file_path": storage_path,
+                "variants": variants
+            }), 200
+        return jsonify({
+            "status": "error",
+            "message": result.get("msg", "Upload failed")
+        }), 500
+
+    except Exception as e:
+        logger.error(f"Error uploading file: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/delete_file', methods=['DELETE'])
+async def delete_file():
+    try:
+        show_slug = request.args.get('show_slug')
+        image_type = request.args.get('image_type')
+        filename = request.args.get('filename')
+
+        if not all([show_slug, image_type, filename]):
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, filename"}), 400
+
+        myStorage = AsyncStorage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
+        result = await myStorage.DeleteFile(f"{image_type}/{filename}")
+
+        if result.get("status") == "success":
+            # y sus variantes
+            listing = await myStorage.GetStoragedObjectsList(image_type) if wants_variants(filename) else []
+            if isinstance(listing, list):
+                async for _ in myStorage.DeleteFiles([f"{image_type}/{name}" for name in variants_of(listing, filename)]):
+                    pass
+            return jsonify({
+                "status": "success",
+                "message": "File deleted successfully from Bunny.net"
+            }), 200
+        return jsonify({
+            "status": "error",
+            "message": result.get("msg", "Delete failed")
+        }), 500
+
+    except Exception as e:
+        logger.error(f"Error deleting file: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/upload_files', methods=['POST'])
+async def upload_files():
+    try:
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, files"}), 400
+
+        # Cada archivo se sube apenas termina de llegar, mientras se lee el resto del body
+        chunks = request.body.__aiter__()
+        upload = MultipartFiles(boundary, UPLOAD_SPOOL_MAX_MEMORY)
+        part = await upload.aread_next_file(chunks)
+        show_slug = upload.fields.get('show_slug') or request.args.get('show_slug')
+        image_type = upload.fields.get('image_type') or request.args.get('image_type')
+
+        # show_slug e image_type tienen que llegar antes que los archivos
+        if part is None or not all([show_slug, image_type]):
+            return jsonify({"error": "Missing required parameters: show_slug, image_type, files"}), 400
+
+        myStorage = AsyncStorage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
+        limit = asyncio.Semaphore(BULK_WORKERS)
+
+        async def put(filename, spool):
+            storage_path = f"{image_type}/{filename}"
+            try:
+                async with limit:
+                    return storage_path, await myStorage.PutFileObject(spool, storage_path)
+            except Exception as e:
+                return storage_path, {"status": "error", "msg": str(e)}
+            finally:
+                spool.close()
+
+        async def generate():
+            counts = {}
+            received = 0
+            pending = set()
+            current = part
+            while current is not None:
+                received += 1
+                if not current[0]:
+                    # a file input left empty sends a file part with an empty name
+                    current[1].close()
+                    yield bulk_error(counts, f"{image_type}/", "Missing file")
+                elif received > BULK_MAX_ITEMS:
+                    current[1].close()
+                    yield bulk_error(counts, f"{image_type}/{current[0]}", f"At most {BULK_MAX_ITEMS} files per request")
+                else:
+                    pending.add(asyncio.ensure_future(put(*current)))
+                # at most two spooled files per worker waiting
+                done, pending = await asyncio.wait(pending, timeout=0 if len(pending) < 2 * BULK_WORKERS else None, return_when=asyncio.FIRST_COMPLETED) if pending else (set(), pending)
+                for task in done:
+                    yield bulk_line(counts, *task.result())
+                current = await upload.aread_next_file(chunks)
+            for task in asyncio.as_completed(pending):
+                yield bulk_line(counts, *await task)
+            yield bulk_summary(counts)
+
+        return Response(generate(), content_type='application/x-ndjson')
+
+    except Exception as e:
+        logger.error(f"Error uploading files: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/delete_files', methods=['POST', 'DELETE'])
+async def delete_files():
+    try:
+        params = await request.get_json(silent=True) or {}
+        bulk, problem = bulk_delete_params(params, request.args)
+        if problem:
+            return jsonify(problem[0]), problem[1]
+        show_slug, paths, invalid = bulk
+
+        myStorage = AsyncStorage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
+
+        async def generate():
+            counts = {}
+            for path in invalid:
+                yield bulk_error(counts, path, "Invalid path")
+            # Una linea por archivo a medida que Bunny.net responde
+            async for path, result in myStorage.DeleteFiles(paths, BULK_WORKERS):
+                yield bulk_line(counts, path, result)
+            yield bulk_summary(counts)
+
+        return Response(generate(), content_type='application/x-ndjson')
+
+    except Exception as e:
+        logger.error(f"Error deleting files: {e}")
+        return jsonify({"error": str(e)}), 500
+
+async def _conditional_json(payload, validators):
+    """
+    Response with the JSON of payload, compressed for the client, with an ETag
+    and Last-Modified derived from the cached sources it was built from, or a
+    304 when the client's copy is current. Bodies with an ETag are encoded
+    and compressed once.
+    """
+    accept_encoding = request.headers.get('Accept-Encoding')
+    validator = conditional.combine(request.full_path, validators)
+    headers = not_modified_headers(request.headers, validator)
+    if headers is not None:
+        return Response(b"", status=304, headers=headers)
+    etag = validator[0] if validator else None
+    found = response_encoding.cached(etag, accept_encoding)
+    if found is None:
+        # encoding and compressing a large listing would hold up the event loop
+        found = await asyncio.to_thread(response_encoding.encode, payload, accept_encoding, etag)
+    body, coding = found
+    return Response(body, headers=json_headers(validator, coding))
+
+@app.route('/list_files', methods=['GET'])
+async def list_files():
+    try:
+        show_slug = request.args.get('show_slug')
+        image_type = request.args.get('image_type')
+
+        if not show_slug:
+            return jsonify({"error": "Missing required parameter: show_slug"}), 400
+
+        myStorage = AsyncStorage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
+        recursive = request.args.get('recursive', '').lower() in ('1', 'true', 'yes')
+        if recursive:
+            # Todo el arbol de la carpeta (o del show) en una sola lista
+            result = await myStorage.GetStoragedObjectsTree(image_type or None)
+        else:
+            result = await myStorage.GetStoragedObjectsList(image_type or None)
+        if not isinstance(result, list):
+            return jsonify({"status": "success", "files": result}), 200
+        # Las variantes de cada imagen van dentro de su original
+        validators = myStorage.ListingValidators(image_type, result if recursive else None)
+        result = group_variants(result)
+
+        return await _conditional_json({
+            "status": "success",
+            "files": result
+        }, validators)
+
+    except Exception as e:
+        logger.error(f"Error listing files: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/get_stream', methods=['GET'])
+async def get_stream():
+    try:
+        myStream = AsyncStream()
+        theList = await myStream.GetVideoLibraryList()
+        return await _conditional_json(theList, [myStream.LibraryValidator(theList)])
+    except Exception as e:
+        logger.error(f"Error in get_stream: {str(e)}")
+        return jsonify({"error": "Internal server error", "message": str(e)}), 500
+
+@app.route('/get_videos', methods=['GET'])
+async def get_videos():
+    try:
+        stream = request.args.get('collection')
+        logger.info(f"Fetching videos for collection: {stream}")
+        try:
+            # Solo algunos campos de cada video (fields=guid,title o view=compact)
+            fields = parse_fields(request.args.get('fields'), request.args.get('view'), VIDEO_VIEWS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        myStream = AsyncStream()
+        if not fields and not myStream.IsVideosListCached(stream):
+            # Paginas en paralelo, enviadas al cliente a medida que llegan
+            try:
+                chunks = await myStream.StreamVideosList(stream)
+            except aiohttp.ClientError as e:
+                logger.error(f"Stream API error: {e}")
+                return jsonify({"error": str(e), "items": [], "totalItems": 0}), 500
+            if chunks is not None:
+                return Response(chunks, content_type='application/json')
+            # otherwise another request is loading it: GetVideosList waits for it
+
+        theList = await myStream.GetVideosList(stream)
+        if isinstance(theList, dict) and "error" in theList:
+            logger.error(f"Stream API error: {theList['error']}")
+            return jsonify(theList), 500
+
+        payload = myStream.ProjectVideosList(theList, stream, fields).to_json if fields else theList
+        return await _conditional_json(payload, [myStream.VideosValidator(stream, theList)])
+
+    except Exception as e:
+        logger.error(f"Error in get_videos: {str(e)}")
+        return jsonify({"error": "Internal server error", "message": str(e)}), 500
+
+@app.route('/get_video_by_title', methods=['GET'])
+async def get_video_by_title():
+    try:
+        title = request.args.get('title')
+        libraryId = request.args.get('libraryId')
+        page = max(request.args.get('page', 1, type=int), 1)
+        itemsPerPage = min(max(request.args.get('itemsPerPage', 10, type=int), 1), TITLE_SEARCH_MAX_PER_PAGE)
+        return jsonify(await AsyncStream().GetVideoByTitle(libraryId, title, page, itemsPerPage))
+    except Exception as e:
+        logger.error(f"Error in get_video_by_title: {str(e)}")
+        return jsonify({"error": "Internal server error", "message": str(e)}), 500
+
+@app.route('/get_stream_collections', methods=['GET'])
+async def get_collections_list():
+    try:
+        myStream = AsyncStream()
+        try:
+            fields = parse_fields(request.args.get('fields'), request.args.get('view'), COLLECTION_VIEWS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        theList = await myStream.GetColletcionsList()
+        if fields and "error" not in theList:
+            payload = myStream.ProjectColletcionsList(theList, fields).to_json
+        else:
+            payload = theList
+        return await _conditional_json(payload, [myStream.CollectionsValidator(theList)])
+    except Exception as e:
+        logger.error(f"Error in get_collections_list: {str(e)}")
+        return jsonify({"error": "Internal server error", "message": str(e)}), 500
+
+@app.route('/get_shows', methods=['GET'])
+async def get_shows():
+    show_slug = request.args.get('show_slug')
+    try:
+        myStorage = AsyncStorage(STORAGE_API_KEY, "shows-tnoradio", show_slug)
+        return jsonify(await myStorage.GetStoragedObjectsList())
+    except Exception as e:
+        logger.error(f"Error in get_shows: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/get_youtube_playlists', methods=['GET'])
+async def get_youtube_playlists():
+    try:
+        channel = request.args.get('channel', 'tnoradio')  # Default to 'tnoradio'
+        # Answered from the local index, synced in the background
+        playlist_index.start()
+        await asyncio.to_thread(playlist_index.ensure_synced, channel)
+        return jsonify(playlist_index.playlists(channel))
+    except Exception as e:
+        logger.error(f"Error in get_youtube_playlists: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/search_youtube_playlists', methods=['GET'])
+async def search_youtube_playlists():
+    try:
+        query = request.args.get('q', '').strip()
+        channel = request.args.get('channel')
+        limit = min(request.args.get('limit', 10, type=int), PLAYLIST_SEARCH_MAX_RESULTS)
+        if not query:
+            return jsonify({"error": "Missing required parameter: q"}), 400
+
+        # Autocomplete over the playlist titles of the local index, both channels by default
+        channels = (channel_key(channel),) if channel else CHANNELS
+        playlist_index.start()
+        await asyncio.gather(*(asyncio.to_thread(playlist_index.ensure_synced, name) for name in channels))
+        return jsonify(playlist_index.search(query, channels, limit))
+    except Exception as e:
+        logger.error(f"Error in search_youtube_playlists: {e}")
+        return jsonify({"error": str(e)}), 500
+
+async def _video_problem(guid, api_key, resolution=None):
+    """Looks the video up in the guid index; returns (error payload, status) or None"""
+    try:
+        video = await aget_video(guid, api_key)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Error getting video info: {e}")
+        video = None
+    return video_problem(video, resolution)
+
+async def _check_video(guid, api_key, resolution=None):
+    """Checks the video exists (and has the resolution); returns an error response or None"""
+    problem = await _video_problem(guid, api_key, resolution)
+    if problem:
+        return jsonify(problem[0]), problem[1]
+    return None
+
+@app.route('/get_video_stream', methods=['GET'])
+async def get_video_stream():
+    try:
+        guid = request.args.get('guid')
+        resolution = request.args.get('resolution', '720p')
+        format_type = request.args.get('format', 'mp4')
+
+        if not guid:
+            return jsonify({"error": "Missing required parameter: guid"}), 400
+
+        api_key = os.environ.get("BUNNY_API_KEY")
+        url = video_url(guid, resolution, format_type)
+
+        if api_key:
+            error = await _check_video(guid, api_key, None if format_type == 'hls' else resolution)
+            if error:
+                return error
+        return jsonify({"url": url}), 200
+
+    except Exception as e:
+        logger.error(f"Error getting video stream: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/get_video_thumbnail', methods=['GET'])
+async def get_video_thumbnail():
+    try:
+        guid = request.args.get('guid')
+
+        if not guid:
+            return jsonify({"error": "Missing required parameter: guid"}), 400
+
+        api_key = os.environ.get("BUNNY_API_KEY")
+        if api_key:
+            error = await _check_video(guid, api_key)
+            if error:
+                return error
+        return jsonify({"url": thumbnail_url(guid)}), 200
+
+    except Exception as e:
+        logger.error(f"Error getting video thumbnail: {e}")
+        return jsonify({"error": str(e)}), 500
+
+async def _resolve_video(guid, api_key, resolution, format_type):
+    """Entry of /get_video_urls for one guid: its stream and thumbnail URLs, or why it has none"""
+    if api_key:
+        problem = await _video_problem(guid, api_key, None if format_type == 'hls' else resolution)
+        if problem:
+            return problem[0]
+    return {"url": video_url(guid, resolution, format_type), "thumbnail": thumbnail_url(guid)}
+
+@app.route('/get_video_urls', methods=['GET', 'POST'])
+async def get_video_urls():
+    try:
+        params = (await request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+        batch, problem = video_urls_params(params)
+        if problem:
+            return jsonify(problem[0]), problem[1]
+        guids, resolution, format_type = batch
+
+        api_key = os.environ.get("BUNNY_API_KEY")
+        limit = asyncio.Semaphore(VIDEO_URLS_WORKERS)
+
+        async def resolve(guid):
+            async with limit:
+                return await _resolve_video(guid, api_key, resolution, format_type)
+
+        # guids missing from the index are looked up upstream concurrently
+        entries = await asyncio.gather(*(resolve(guid) for guid in guids))
+        return jsonify({"videos": dict(zip(guids, entries))}), 200
+
+    except Exception as e:
+        logger.error(f"Error getting video urls: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/get_playlist_items', methods=['GET'])
+async def get_youtube_playlist_items():
+    try:
+        channel = request.args.get('channel', 'tnoradio')  # Default to 'tnoradio'
+        playlist_name = request.args.get('playlist_name')
+        if not playlist_name:
+            return jsonify({"error": "playlist_name parameter is required"}), 400
+
+        playlist_index.start()
+        await asyncio.to_thread(playlist_index.ensure_synced, channel)
+        return jsonify(playlist_index.playlist_items(channel, playlist_name))
+    except Exception as e:
+        logger.error(f"Error in get_playlist_items: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/get_all_episodes_sorted', methods=['GET'])
+async def get_all_episodes_sorted_route():
+    try:
+        playlist_name = request.args.get('playlist_name')
+
+        if not playlist_name:
+            return jsonify({"error": "Missing playlist_name parameter"}), 400
+
+        # Sorted episodes of both channels, from the local index
+        playlist_index.start()
+        await asyncio.gather(*(asyncio.to_thread(playlist_index.ensure_synced, channel) for channel in CHANNELS))
+        # read before the episodes: a sync landing in between only costs the client one more 200
+        validators = playlist_index.validators()
+        return await _conditional_json(playlist_index.all_episodes_sorted(playlist_name), validators)
+    except Exception as e:
+        logger.error(f"Error fetching episodes: {e}")
+        return jsonify({"error": "An error occurred while fetching episodes"}), 500
+
+async def _read(obj, start, end):
+    """segment_cache.read() off the event loop: touching pages of the mapped file that aren't in memory blocks on the disk"""
+    chunks = segment_cache.read(obj, start, end)
+    try:
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+    finally:
+        chunks.close()
+
+def _read_whole(obj):
+    return b"".join(segment_cache.read(obj, 0, obj.total - 1))
+
+def _cached_video(obj, api_key, guid, resolution):
+    """Serves /proxy_video from the segment cache, fetching the missing ranges on the way"""
+    window = request_window(obj, request.headers.get('Range'), request.headers.get('If-Range'))
+    if window is None:
+        return None
+    status, start, end = window
+    headers = response_headers(obj, status, start, end)
+    if status == 416:
+        return Response(b"", status=416, headers=headers)
+    runs = segment_cache.runs(obj, start, end)
+
+    async def relay():
+        for cached, run_start, run_end in runs:
+            if cached:
+                try:
+                    async for chunk in _read(obj, run_start, run_end):
+                        yield chunk
+                except FileNotFoundError:
+                    # dropped or replaced by another worker: cut this response short
+                    logger.warning(f"Cached video {guid} dropped while relayed")
+                    return
+                continue
+            range_headers = video_headers(api_key)
+            range_headers['Range'] = f"bytes={run_start}-{run_end}"
+            fill_response = await upstream.aget(play_url(guid, resolution), headers=range_headers, stream=True)
+            try:
+                if fill_response.status != 206 or fill_response.headers.get('ETag') != obj.etag:
+                    # the video changed upstream: drop it and cut this response short
+                    segment_cache.invalidate(obj.key)
+                    logger.warning(f"Cached video {guid} changed upstream")
+                    return
+                fill = segment_cache.fill(obj, run_start, start, end)
+                try:
+                    async for chunk in fill_response.content.iter_any():
+                        data = fill.feed(chunk)
+                        if data:
+                            yield data
+                finally:
+                    fill.close()
+            finally:
+                fill_response.release()
+
+    return Response(relay(), status=status, headers=headers)
+
+@app.route('/proxy_video/<guid>', methods=['GET'])
+async def proxy_video(guid):
+    try:
+        resolution = request.args.get('resolution', '720p')
+        api_key = os.environ.get("BUNNY_API_KEY")
+
+        if not api_key:
+            return jsonify({"error": "API key not configured"}), 500
+
+        error = await _check_video(guid, api_key, resolution)
+        if error:
+            return error
+
+        # Serve what is already on local disk
+        cached = segment_cache.lookup((guid, resolution))
+        if cached is not None:
+            cached_response = _cached_video(cached, api_key, guid, resolution)
+            if cached_response is not None:
+                return cached_response
+
+        # Forward Range/If-Range so seeks only fetch the requested bytes
+        stream_response = await upstream.aget(
+            play_url(guid, resolution),
+            headers=proxy_request_headers(api_key, request.headers),
+            stream=True,
+        )
+        if stream_response.status == 416:
+            stream_response.release()
+            return Response(b"", status=416, headers={
+                'Content-Range': stream_response.headers.get('content-range', '')
+            })
+        if stream_response.status not in (200, 206):
+            stream_response.release()
+            return jsonify({"error": "Failed to get video stream"}), 500
+        # keep a copy on local disk while relaying
+        fill = segment_cache.begin((guid, resolution), stream_response.status, stream_response.headers)
+
+        async def relay():
+            # chunks are relayed as they arrive from the socket, without re-chunking
+            try:
+                async for chunk in stream_response.content.iter_any():
+                    if fill is not None:
+                        fill.feed(chunk)
+                    yield chunk
+            finally:
+                if fill is not None:
+                    fill.close()
+                stream_response.release()
+
+        return Response(
+            relay(),
+            status=stream_response.status,
+            headers=proxy_response_headers(stream_response.headers),
+        )
+
+    except Exception as e:
+        logger.error(f"Error proxying video: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/proxy_thumbnail/<guid>', methods=['GET'])
+async def proxy_thumbnail(guid):
+    try:
+        api_key = os.environ.get("BUNNY_API_KEY")
+
+        if not api_key:
+            return jsonify({"error": "API key not configured"}), 500
+
+        error = await _check_video(guid, api_key)
+        if error:
+            return error
+
+        cached = segment_cache.lookup((guid, 'thumbnail'))
+        if cached is not None and segment_cache.is_complete(cached):
+            try:
+                return Response(
+                    await asyncio.to_thread(_read_whole, cached),
+                    content_type=cached.content_type,
+                    headers={
+                        'Cache-Control': 'public, max-age=3600'
+                    }
+                )
+            except FileNotFoundError:
+                # dropped by another worker meanwhile
+                pass
+
+        thumbnail_response = await upstream.aget(thumbnail_url(guid), headers=video_headers(api_key))
+        if thumbnail_response.status != 200:
+            return jsonify({"error": "Failed to get thumbnail"}), 500
+
+        content = await thumbnail_response.read()
+        content_type = thumbnail_response.headers.get('content-type', 'image/jpeg')
+        # requests coalesced on the same fetch store it once
+        stored = segment_cache.lookup((guid, 'thumbnail'))
+        if content and (stored is None or not segment_cache.is_complete(stored)):
+            await asyncio.to_thread(segment_cache.store, (guid, 'thumbnail'), content, content_type)
+
+        return Response(
+            content,
+            content_type=content_type,
+            headers={
+                'Cache-Control': 'public, max-age=3600'
+            }
+        )
+
+    except Exception as e:
+        logger.error(f"Error proxying thumbnail: {e}")
+        return jsonify({"error": str(e)}), 500
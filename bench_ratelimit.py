@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Throughput of the rate limiter backends.
+
+Every process calls allow() for a stream of client addresses drawn from a
+fixed pool, the way a busy worker would. The memory backend is measured in
+one process; the shared-memory backend with one and with several processes
+hitting the same table.
+
+    python bench_ratelimit.py --calls 200000 --clients 50000 --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from ratelimit import MemoryBackend, RateLimiter, SharedMemoryBackend
+
+
+def _run(backend, calls, clients, seed):
+    limiter = RateLimiter(limit=100, window=60, backend=backend)
+    rng = random.Random(seed)
+    addresses = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(clients)]
+    picks = [rng.choice(addresses) for _ in range(calls)]
+    start = time.perf_counter()
+    for address in picks:
+        limiter.allow(address, time.time())
+    return time.perf_counter() - start
+
+
+def _worker(path, slots, calls, clients, seed, results):
+    results.put(_run(SharedMemoryBackend(path, slots), calls, clients, seed))
+
+
+def report(name, calls, elapsed):
+    print(f"{name:<28} {calls / elapsed:>12,.0f} calls/s   {elapsed / calls * 1e6:>6.2f} us/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200000, help="allow() calls per process")
+    parser.add_argument("--clients", type=int, default=50000, help="distinct client addresses")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=65536)
+    args = parser.parse_args()
+
+    print(f"{args.calls} calls per process, {args.clients} clients")
+    report("memory (1 process)", args.calls, _run(MemoryBackend(), args.calls, args.clients, 0))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "buckets")
+        backend = SharedMemoryBackend(path, args.slots)
+        report("shared (1 process)", args.calls, _run(backend, args.calls, args.clients, 0))
+        backend.close()
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        workers = [
+            context.Process(target=_worker, args=(path, args.slots, args.calls, args.clients, seed, results))
+            for seed in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        # the processes run side by side: the slowest one sets the aggregate rate
+        elapsed = max(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        report(f"shared ({args.processes} processes)", args.calls * args.processes, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Latency of SearchIndex lookups over many names.
+
+Names are made of random Spanish-looking syllables, and the queries are
+prefixes of their words, as typed in the backoffice search box. Plain and
+fuzzy lookups are timed separately.
+
+    python bench_search.py --names 5000 --queries 2000
+"""
+import argparse
+import random
+import statistics
+import time
+from search import SearchIndex
+
+SYLLABLES = ["ma", "ña", "no", "ti", "cias", "de", "por", "tes", "ca", "fé", "lo", "ra"]
+
+
+def _names(count, rng):
+    return [" ".join("".join(rng.choice(SYLLABLES) for _ in range(3)) for _ in range(4)) for _ in range(count)]
+
+
+def _timed(index, queries, fuzzy):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, limit=10, fuzzy=fuzzy)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    times = sorted(times)
+    p50 = statistics.median(times) * 1e3
+    p99 = times[int(len(times) * 0.99)] * 1e3
+    print(f"{name:<16} p50 {p50:>7.3f} ms   p99 {p99:>7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--names", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    names = _names(args.names, rng)
+    start = time.perf_counter()
+    index = SearchIndex()
+    for position, name in enumerate(names):
+        index.add(f"PL{position}", name, position, name)
+    print(f"{args.names} names indexed in {(time.perf_counter() - start) * 1e3:.0f} ms")
+
+    queries = [rng.choice(names).split()[rng.randrange(4)][:rng.randint(3, 6)] for _ in range(args.queries)]
+    report("search", _timed(index, queries, False))
+    report("fuzzy search", _timed(index, queries, True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Side-by-side benchmark of the sync (gunicorn + Flask) and async (uvicorn + Quart)
+serving modes.
+
+Both apps are pointed at a local stand-in for Bunny that answers every call
+after a fixed delay, and the same number of concurrent clients hit an
+I/O-bound route on each one.
+
+    python bench_serving.py --requests 2000 --concurrency 200 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import aiohttp
+import urllib.request
+from fake_upstream import FakeUpstream
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health") as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def _load(url, path, requests, concurrency):
+    latencies = []
+    errors = 0
+    limit = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(url, connector=connector) as client:
+
+        async def one(i):
+            nonlocal errors
+            async with limit:
+                start = time.perf_counter()
+                try:
+                    async with client.get(path.format(i=i)) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    return elapsed, latencies, errors
+
+
+def run_mode(name, command, env, args):
+    port = _free_port()
+    command = [arg.format(port=port) for arg in command]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_until_up(url)
+        elapsed, latencies, errors = asyncio.run(_load(url, args.path, args.requests, args.concurrency))
+    finally:
+        process.terminate()
+        process.wait()
+    latencies.sort()
+    print(
+        f"{name:<28} {args.requests / elapsed:>8.1f} req/s"
+        f"   p50 {statistics.median(latencies) * 1000:>7.1f} ms"
+        f"   p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:>7.1f} ms"
+        f"   errors {errors}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="upstream delay in seconds")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn sync workers")
+    parser.add_argument("--path", default="/get_video_thumbnail?guid=video-{i}")
+    args = parser.parse_args()
+
+    def video(handler):
+        time.sleep(args.latency)
+        return 200, {"guid": handler.path.rsplit("/", 1)[-1]}
+
+    with FakeUpstream({("GET", "*"): video}) as fake:
+        env = dict(
+            os.environ,
+            BUNNY_VIDEO_HOST=fake.url,
+            BUNNY_API_KEY="bench",
+            RATE_LIMIT_PER_MINUTE=str(10 ** 9),
+        )
+        print(f"{args.requests} requests, {args.concurrency} concurrent, upstream latency {args.latency * 1000:.0f} ms")
+        run_mode(
+            f"sync  (gunicorn x{args.workers})",
+            [sys.executable, "-m", "gunicorn", "--bind", "127.0.0.1:{port}",
+             "--workers", str(args.workers), "--worker-class", "sync", "app:app"],
+            env, args,
+        )
+        run_mode(
+            "async (uvicorn x1)",
+            [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+             "--port", "{port}", "--log-level", "warning", "--no-access-log"],
+            env, args,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""In-process cache for upstream listings: TTL, stale-while-revalidate and single-flight loads"""
+
+import json
+import asyncio
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+_ABANDONED = object()
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution.
+    The first caller runs the function, the others wait and share its result
+    (or its exception). stats counts the executions ("calls") and the calls
+    answered by another's execution ("shared").
+    """
+
+    class _Call:
+        __slots__ = ("event", "result", "error")
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = _ABANDONED
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"calls": 0, "shared": 0}
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def lead(self, key):
+        """
+        Makes the caller the execution of key, for executions that aren't
+        one function call. Returns finish, to be called once when done:
+        finish(result) shares result with the waiting callers, finish(error=err)
+        raises err in them, and finish() abandons the execution to one of them.
+        Returns None when key is already in flight.
+        """
+        with self._lock:
+            if key in self._calls:
+                return None
+            call = self._calls[key] = self._Call()
+            self.stats["calls"] += 1
+
+        def finish(result=_ABANDONED, error=None):
+            call.result = result
+            call.error = error
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return finish
+
+    def do(self, key, fn):
+        while True:
+            finish = self.lead(key)
+            if finish is not None:
+                break
+            with self._lock:
+                call = self._calls.get(key)
+            if call is None:
+                continue
+            call.event.wait()
+            if call.error is None and call.result is _ABANDONED:
+                continue
+            with self._lock:
+                self.stats["shared"] += 1
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            result = fn()
+        except BaseException as err:
+            finish(error=err)
+            raise
+        finish(result)
+        return result
+
+
+def _encode(value):
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def json_size(value):
+    """Approximate footprint of a JSON-able value: the length of its compact encoding"""
+    return len(_encode(value))
+
+
+def leader_cancelled(future):
+    """
+    Whether a follower awaiting shield(future) got CancelledError because the
+    leader cancelled the shared future, rather than because the follower
+    itself was cancelled
+    """
+    return future.cancelled() and not asyncio.current_task().cancelling()
+
+
+class _Entry:
+    __slots__ = ("value", "size", "digest", "stored_at", "changed_at", "fresh_until", "stale_until")
+
+    def __init__(self, value, size, digest, ttl, stale_ttl):
+        self.value = value
+        self.size = size
+        self.digest = digest
+        self.stored_at = self.changed_at = time.time()
+        self.fresh_until = time.monotonic() + ttl
+        self.stale_until = self.fresh_until + stale_ttl
+
+
+class Cache:
+    """
+    LRU cache bounded by the total (estimated) size of its values in bytes.
+    Every entry has a TTL during which it is fresh, followed by a stale window
+    during which it is still served while one background refresh runs.
+    Parameters
+    ----------
+    max_bytes : Int
+                Upper bound for the sum of the entry sizes
+    sizeof    : Callable
+                Returns the size in bytes of a value (defaults to json_size)
+    on_change : Callable
+                Called as on_change(key, value) after a value is stored, and
+                as on_change(key, None) after key is evicted or dropped (e.g.
+                to keep data derived from the values in step with them)
+    """
+
+    def __init__(self, max_bytes, sizeof=json_size, on_change=None):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_change = on_change
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._aflight = {}
+        self._tasks = set()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "loads": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def peek(self, key):
+        """Returns the fresh or stale value for key without loading it, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() >= entry.stale_until:
+                return None
+            return entry.value
+
+    def get(self, key):
+        """Returns the fresh or stale value for key (most recently used from now on), or None"""
+        return self._lookup(key)[0]
+
+    def stored_at(self, key):
+        """Wall-clock time at which the current value for key was stored, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.stored_at if entry is not None else None
+
+    def validator(self, key, value=None):
+        """
+        (digest, changed_at) of the value stored for key: a hash of its JSON
+        encoding, and the wall-clock time at which a value with that content
+        was first stored (refreshes that bring the same content keep it).
+        None when key is not cached, when the cache doesn't size values as
+        JSON (json_size), or when value is given and is not the cached object
+        (it was replaced meanwhile).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.digest is None or (value is not None and entry.value is not value):
+                return None
+            return entry.digest, entry.changed_at
+
+    def set(self, key, value, ttl, stale_ttl=0, changed_at=None):
+        """
+        Stores value under key. Returns False if it is larger than the whole
+        cache. changed_at overrides the time its content last changed (for
+        values copied from elsewhere, e.g. a snapshot).
+        """
+        if self.sizeof is json_size:
+            # the encoding that sizes the value also gives its digest
+            encoded = _encode(value)
+            size = len(encoded)
+            digest = hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest()
+        else:
+            # values that aren't JSON listings (e.g. encoded bodies) get no validator
+            size = self.sizeof(value)
+            digest = None
+        if size > self.max_bytes:
+            return False
+        changes = [(key, value)]
+        with self._lock:
+            old = self._entries.pop(key, None)
+            entry = self._entries[key] = _Entry(value, size, digest, ttl, stale_ttl)
+            if changed_at is not None:
+                entry.changed_at = changed_at
+            if old is not None:
+                self._bytes -= old.size
+                if digest is not None and old.digest == digest:
+                    entry.changed_at = min(old.changed_at, entry.changed_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.stats["evictions"] += 1
+                changes.append((evicted_key, None))
+        self._changed(changes)
+        return True
+
+    def snapshot(self, predicate=None):
+        """
+        The servable entries (whose key satisfies predicate(key), if given)
+        as JSON-able dicts for restore() in another process: key, value, when
+        its content changed, and the seconds it has left fresh and stale.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = [(key, entry) for key, entry in self._entries.items() if now < entry.stale_until]
+        return [
+            {
+                "key": key, "value": entry.value, "stored_at": entry.stored_at, "changed_at": entry.changed_at,
+                "fresh_for": max(0.0, entry.fresh_until - now), "stale_for": entry.stale_until - max(now, entry.fresh_until),
+            }
+            for key, entry in entries if predicate is None or predicate(key)
+        ]
+
+    def restore(self, entries, elapsed=0.0):
+        """
+        Stores the entries of a snapshot() taken elapsed seconds ago, keeping
+        the ones this cache has stored more recently. Tuple keys come back
+        from JSON as lists and are turned back into tuples. Returns the keys
+        stored.
+        """
+        restored = []
+        for item in entries:
+            key = item["key"]
+            if isinstance(key, list):
+                key = tuple(key)
+            stale_for = item["stale_for"] - max(0.0, elapsed - item["fresh_for"])
+            fresh_for = max(0.0, item["fresh_for"] - elapsed)
+            if stale_for <= 0:
+                continue
+            stored_at = self.stored_at(key)
+            if stored_at is not None and stored_at >= item["stored_at"]:
+                continue
+            if self.set(key, item["value"], fresh_for, stale_for, changed_at=item["changed_at"]):
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None:
+                        entry.stored_at = item["stored_at"]
+                restored.append(key)
+        return restored
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+        if entry is not None:
+            self._changed([(key, None)])
+
+    def invalidate_matching(self, predicate):
+        """Drops every entry whose key satisfies predicate(key)"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._bytes -= self._entries.pop(key).size
+        self._changed([(key, None) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+        self._changed([(key, None) for key in keys])
+
+    def _changed(self, changes):
+        if self.on_change is not None:
+            for key, value in changes:
+                self.on_change(key, value)
+
+    def get_or_load(self, key, loader, ttl, stale_ttl=0, cacheable=None):
+        """
+        Returns the value for key, calling loader() on a miss.
+        Concurrent misses for the same key share one loader() call; a stale hit
+        is answered immediately and refreshed in the background.
+        Parameters
+        ----------
+        key       : Hashable
+        loader    : Callable returning the upstream value
+        ttl       : Float, seconds the value stays fresh
+        stale_ttl : Float, seconds a stale value may still be served
+        cacheable : Callable deciding whether a loaded value is stored
+                    (e.g. to skip upstream error payloads)
+        """
+        value, stale = self._lookup(key)
+        if value is not None:
+            if stale:
+                self._refresh_in_background(key, loader, ttl, stale_ttl, cacheable)
+            return value
+        return self._flight.do(key, lambda: self._load(key, loader, ttl, stale_ttl, cacheable))
+
+    def refresh(self, key, loader, ttl, stale_ttl=0, cacheable=None):
+        """
+        Calls loader() and stores its value whether or not key is still
+        fresh (to renew entries before they expire); shares the call with
+        concurrent misses of key, like get_or_load().
+        """
+        return self._flight.do(key, lambda: self._load(key, loader, ttl, stale_ttl, cacheable))
+
+    def _lookup(self, key):
+        """Returns (value, is_stale) for a servable entry, or (None, False) on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.stale_until:
+                self._entries.move_to_end(key)
+                if now < entry.fresh_until:
+                    self.stats["hits"] += 1
+                    return entry.value, False
+                self.stats["stale_hits"] += 1
+                return entry.value, True
+            self.stats["misses"] += 1
+            return None, False
+
+    async def aget_or_load(self, key, loader, ttl, stale_ttl=0, cacheable=None):
+        """
+        Async counterpart of get_or_load() for the ASGI app: loader is a
+        coroutine function, and concurrent misses on the event loop share one
+        awaited load.
+        """
+        value, stale = self._lookup(key)
+        if value is not None:
+            if stale and key not in self._aflight:
+                task = asyncio.ensure_future(self._aload(key, loader, ttl, stale_ttl, cacheable))
+                self._tasks.add(task)
+                task.add_done_callback(self._refresh_done)
+            return value
+        return await self._aload(key, loader, ttl, stale_ttl, cacheable)
+
+    async def _aload(self, key, loader, ttl, stale_ttl, cacheable):
+        while True:
+            future = self._aflight.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if leader_cancelled(future):
+                    # the leader's request was cancelled, not ours: a follower takes over the load
+                    continue
+                raise
+        finish = self.alead(key, ttl, stale_ttl, cacheable)
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            finish()
+            raise
+        except Exception as err:
+            finish(error=err)
+            raise
+        finish(value)
+        return value
+
+    def _refresh_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background refresh failed: {task.exception()}")
+
+    def _load(self, key, loader, ttl, stale_ttl, cacheable):
+        value = loader()
+        self._loaded(key, value, ttl, stale_ttl, cacheable)
+        return value
+
+    def lead(self, key, ttl, stale_ttl=0, cacheable=None):
+        """
+        Makes the caller the load of key that concurrent misses of
+        get_or_load() and refresh() wait for, for loads that aren't one
+        loader() call (e.g. a listing sent to the client as its pages arrive).
+        Returns finish, to be called once when done: finish(value) stores value
+        (if cacheable) and shares it, finish(error=err) raises err in the
+        waiting callers, and finish() gives the load up to one of them.
+        Returns None when a load of key is in flight.
+        """
+        done = self._flight.lead(key)
+        if done is None:
+            return None
+
+        def finish(value=_ABANDONED, error=None):
+            if error is None and value is not _ABANDONED:
+                self._loaded(key, value, ttl, stale_ttl, cacheable)
+            done(value, error)
+
+        return finish
+
+    def alead(self, key, ttl, stale_ttl=0, cacheable=None):
+        """Async counterpart of lead(): the load that misses of aget_or_load() on the event loop wait for"""
+        if key in self._aflight:
+            return None
+        future = self._aflight[key] = asyncio.get_running_loop().create_future()
+
+        def finish(value=_ABANDONED, error=None):
+            del self._aflight[key]
+            if error is not None:
+                future.set_exception(error)
+                # the leader raises it too; followers retrieve it from the future
+                future.exception()
+            elif value is _ABANDONED:
+                # see leader_cancelled: a follower takes over the load
+                future.cancel()
+            else:
+                self._loaded(key, value, ttl, stale_ttl, cacheable)
+                future.set_result(value)
+
+        return finish
+
+    def _loaded(self, key, value, ttl, stale_ttl, cacheable):
+        with self._lock:
+            self.stats["loads"] += 1
+        if cacheable is None or cacheable(value):
+            self.set(key, value, ttl, stale_ttl)
+
+    def _refresh_in_background(self, key, loader, ttl, stale_ttl, cacheable):
+        if self._flight.in_flight(key):
+            return
+
+        def refresh():
+            try:
+                self._flight.do(key, lambda: self._load(key, loader, ttl, stale_ttl, cacheable))
+            except Exception as err:
+                logger.warning(f"Background refresh of {key!r} failed: {err}")
+
+        threading.Thread(target=refresh, name=f"cache-refresh-{key}", daemon=True).start()
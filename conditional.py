@@ -0,0 +1,47 @@
+"""ETag / Last-Modified validators and conditional GETs, shared by the Flask and ASGI apps"""
+
+import hashlib
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+# Part of every ETag: bump it when a route changes the shape of what it builds from the same sources
+VALIDATOR_VERSION = "1"
+
+
+def combine(request_key, validators):
+    """
+    (etag, last_modified) of a response built from cached sources, given
+    the request it answers (path and query) and the (digest, changed_at)
+    validator of every source. The ETag hashes the source digests, not the
+    response bytes. None when a source has no validator (it wasn't cached).
+    last_modified is None when a source doesn't know when it changed.
+    """
+    if not validators or any(validator is None for validator in validators):
+        return None
+    digest = hashlib.blake2b(f"{VALIDATOR_VERSION} {request_key}".encode(), digest_size=16)
+    changed = []
+    for source_digest, changed_at in validators:
+        digest.update(b" " + str(source_digest).encode())
+        changed.append(changed_at)
+    return digest.hexdigest(), None if None in changed else max(changed)
+
+
+def headers(etag, last_modified, coding=None):
+    """
+    Validator headers of a response; clients revalidate every time (no-cache)
+    and get a 304 when nothing changed. Each content coding of a body is a
+    representation with an ETag of its own (the etag with a -coding suffix).
+    """
+    result = {"ETag": quote_etag(f"{etag}-{coding}" if coding else etag), "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        result["Last-Modified"] = http_date(int(last_modified))
+    return result
+
+
+def not_modified(request_headers, etag, last_modified):
+    """Whether the client's copy (in any content coding) is current: If-None-Match when sent, else If-Modified-Since"""
+    if_none_match = request_headers.get("If-None-Match")
+    if if_none_match:
+        tags = parse_etags(if_none_match)
+        return tags.star_tag or any(tag.partition("-")[0] == etag for tag in tags.as_set(include_weak=True))
+    since = parse_date(request_headers.get("If-Modified-Since"))
+    return since is not None and last_modified is not None and int(last_modified) <= since.timestamp()
@@ -7,4 +7,38 @@ class config:
         self.get = self.get
 
     def get(self, key):
-        return os.environ.get(key)
\ No newline at end of file
+        return os.environ.get(key)
+
+# Requests per client per minute (shared by the Flask and ASGI apps)
+RATE_LIMIT_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", 100))
+
+# /get_video_urls: guids per call and concurrent upstream lookups (shared by the Flask and ASGI apps)
+VIDEO_URLS_MAX_GUIDS = int(os.environ.get("VIDEO_URLS_MAX_GUIDS", 100))
+VIDEO_URLS_WORKERS = int(os.environ.get("VIDEO_URLS_WORKERS", 8))
+# /upload_files y /delete_files: archivos por llamada y operaciones concurrentes en Bunny
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", 200))
+BULK_WORKERS = int(os.environ.get("BULK_WORKERS", 8))
+
+# Resultados de /search_youtube_playlists
+PLAYLIST_SEARCH_MAX_RESULTS = int(os.environ.get("PLAYLIST_SEARCH_MAX_RESULTS", 50))
+
+# Origins allowed by CORS (shared by the Flask and ASGI apps)
+CORS_ORIGINS = [
+    "http://localhost:3000",
+    "http://localhost:3002", 
+    "https://backoffice.tnonetwork.com",
+    "https://sistema.tnoradio.com",
+    "https://sistema.tnonetwork.com",
+    "https://tnoradio.com",
+    "https://tnonetwork.com",
+    "http://82.25.79.43"
+]
+CORS_METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
+CORS_HEADERS = ["Content-Type", "Authorization", "X-Requested-With"]
+
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Strict-Transport-Security': 'max-age=31536000; includeSubDomains',
+}
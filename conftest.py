@@ -0,0 +1,7 @@
+"""pytest setup shared by the test modules"""
+import os
+
+# The apps are imported by several test modules: keep their rate limit state per test process
+os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+# ...and no background warming of the listing caches against the real upstreams
+os.environ.setdefault("WARM_ENABLED", "0")
@@ -0,0 +1,119 @@
+"""Local stand-in for the BunnyCDN APIs, used by the tests and benchmarks"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b"", content_type="application/json", headers=None):
+        headers = dict(headers or {})
+        self.send_response(status)
+        self.send_header("Content-Type", headers.pop("Content-Type", content_type))
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def iter_body(self, chunk_size=64 * 1024):
+        """Yields the request body, with or without chunked transfer encoding"""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                remaining = size
+                while remaining:
+                    chunk = self.rfile.read(min(chunk_size, remaining))
+                    remaining -= len(chunk)
+                    yield chunk
+                self.rfile.readline()
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining:
+            chunk = self.rfile.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+    def _dispatch(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path))
+            failures = server.failures.get(self.path, 0)
+            if failures:
+                server.failures[self.path] = failures - 1
+        if failures:
+            self._reply(503, b'{"error": "unavailable"}')
+            return
+        handler = server.routes.get((self.command, self.path.split("?")[0]))
+        if handler is None:
+            handler = server.routes.get((self.command, "*"))
+        if handler is None:
+            self._reply(404, b'{"error": "not found"}')
+            return
+        result = handler(self)
+        if result is None:
+            return
+        status, payload = result[0], result[1]
+        headers = result[2] if len(result) > 2 else None
+        if isinstance(payload, (dict, list)):
+            self._reply(status, json.dumps(payload).encode(), headers=headers)
+        else:
+            self._reply(status, payload, "application/octet-stream", headers=headers)
+
+    do_GET = do_PUT = do_DELETE = do_HEAD = do_POST = _dispatch
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    """
+    Threaded HTTP/1.1 server that records every request and counts how many
+    TCP connections clients open against it.
+    Routes map (method, path) to a callable taking the handler and returning
+    (status, payload[, headers]) or None when it already replied.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, routes=None):
+        super().__init__(("127.0.0.1", 0), FakeUpstreamHandler)
+        self.routes = dict(routes or {})
+        self.failures = {}
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def get_request(self):
+        conn = super().get_request()
+        with self.lock:
+            self.connections += 1
+        return conn
+
+    def fail_next(self, path, times=1):
+        """Answers the next `times` requests to path with a 503"""
+        with self.lock:
+            self.failures[path] = times
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,282 @@
+"""Resized, recompressed variants of uploaded show images, rendered in a process pool"""
+
+import os
+import re
+import shutil
+import asyncio
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Variantes de las imagenes subidas: anchos en pixeles, formatos y calidad de cada formato
+IMAGE_VARIANT_WIDTHS = [int(width) for width in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1280").split(",") if width.strip()]
+IMAGE_VARIANT_FORMATS = [fmt.strip().lower() for fmt in os.getenv("IMAGE_VARIANT_FORMATS", "webp,avif").split(",") if fmt.strip()]
+IMAGE_VARIANT_QUALITY = {
+    "webp": int(os.getenv("IMAGE_VARIANT_WEBP_QUALITY", 80)),
+    "avif": int(os.getenv("IMAGE_VARIANT_AVIF_QUALITY", 60)),
+}
+# Procesos que codifican variantes (la codificacion AVIF usa mucha CPU)
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", 2))
+
+SOURCE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+VARIANT_NAME = re.compile(r"^(?P<source>.+)\.(?P<width>\d+)w\.(?P<format>[a-z0-9]+)$")
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_formats = None
+# variants being made after their upload was answered
+_threads = None
+_threads_pid = None
+_pending = set()
+_tasks = set()
+
+
+def available_formats():
+    """The configured variant formats that the installed Pillow can encode (none without Pillow)"""
+    global _formats
+    if _formats is None:
+        try:
+            from PIL import features
+        except ImportError:
+            logger.warning("Pillow is not installed: uploaded images get no variants")
+            _formats = []
+        else:
+            _formats = [fmt for fmt in IMAGE_VARIANT_FORMATS if fmt in IMAGE_VARIANT_QUALITY and features.check(fmt)]
+    return _formats
+
+
+def variant_name(filename, width, fmt):
+    """Storage file name of a variant: next to the original, e.g. banner.png.640w.webp"""
+    return f"{filename}.{width}w.{fmt}"
+
+
+def parse_variant(filename):
+    """(source file name, width, format) of a variant file name, or None"""
+    match = VARIANT_NAME.match(filename)
+    if match is None or match["format"] not in IMAGE_VARIANT_QUALITY:
+        return None
+    return match["source"], int(match["width"]), match["format"]
+
+
+def variants_of(entries, filename):
+    """File names of the variants of filename among storage listing entries"""
+    names = []
+    for entry in entries:
+        variant = parse_variant(entry["File_Name"]) if "File_Name" in entry else None
+        if variant is not None and variant[0] == filename:
+            names.append(entry["File_Name"])
+    return names
+
+
+def wants_variants(filename):
+    """Whether an upload named filename gets variants"""
+    return (
+        os.path.splitext(filename)[1].lower() in SOURCE_EXTENSIONS
+        and parse_variant(filename) is None
+        and bool(IMAGE_VARIANT_WIDTHS and available_formats())
+    )
+
+
+def _render(source_path, filename, out_dir, width, formats, max_width):
+    """
+    Runs in a worker process: writes the variants of one width to out_dir and
+    returns their [(file name, width, format)]. width None is the full-size
+    variant, made only when the original is no wider than max_width; widths
+    the original doesn't reach are skipped.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        if width is not None:
+            # JPEGs are decoded straight at a reduced scale (no smaller than width either way)
+            image.draft("RGB", (width, width))
+        image = ImageOps.exif_transpose(image)
+        if width is None:
+            if image.width > max_width:
+                return []
+            width = image.width
+        elif width >= image.width:
+            return []
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        if width != image.width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        rendered = []
+        for fmt in formats:
+            name = variant_name(filename, width, fmt)
+            image.save(os.path.join(out_dir, name), fmt.upper(), quality=IMAGE_VARIANT_QUALITY[fmt])
+            rendered.append((name, width, fmt))
+        return rendered
+
+
+def get_pool():
+    """Process pool of this process (created on first use, again after a fork)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawned workers don't inherit locks held by this process's threads
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_VARIANT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _submit(source_path, filename, out_dir):
+    formats = available_formats()
+    pool = get_pool()
+    return [
+        pool.submit(_render, source_path, filename, out_dir, width, formats, max(IMAGE_VARIANT_WIDTHS))
+        for width in (*IMAGE_VARIANT_WIDTHS, None)
+    ]
+
+
+def _variant_uploads(storage_path, out_dir, rendered):
+    """[(local path, storage path)] of the rendered variants of the image at storage_path"""
+    directory = storage_path.strip("/").rpartition("/")[0]
+    return [
+        (os.path.join(out_dir, name), f"{directory}/{name}" if directory else name)
+        for renders in rendered for name, _, _ in renders
+    ]
+
+
+def derive(storage, storage_path, source_path):
+    """
+    Renders the variants of the image uploaded to storage_path (a copy of
+    it is at source_path) and uploads them next to it with storage.PutFile.
+    Returns the storage paths of the uploaded variants; an image that can't
+    be decoded gets none.
+    """
+    filename = storage_path.rpartition("/")[2]
+    with tempfile.TemporaryDirectory(prefix="tnoradio-variants-") as out_dir:
+        try:
+            rendered = [future.result() for future in _submit(source_path, filename, out_dir)]
+        except Exception as err:
+            logger.warning(f"No variants for {storage_path}: {err}")
+            return []
+        uploads = _variant_uploads(storage_path, out_dir, rendered)
+        results = storage.PutFiles(uploads)
+    return [path for _, path in uploads if results[path]["status"] == "success"]
+
+
+async def aderive(storage, storage_path, source_path):
+    """Async counterpart of derive(), for an AsyncStorage"""
+    filename = storage_path.rpartition("/")[2]
+    out_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix="tnoradio-variants-")
+    try:
+        try:
+            rendered = await asyncio.gather(*(
+                asyncio.wrap_future(future) for future in _submit(source_path, filename, out_dir)
+            ))
+        except Exception as err:
+            logger.warning(f"No variants for {storage_path}: {err}")
+            return []
+        uploads = _variant_uploads(storage_path, out_dir, rendered)
+        results = await asyncio.gather(*(
+            storage.PutFile(os.path.basename(local_path), path, out_dir) for local_path, path in uploads
+        ))
+        return [path for (_, path), result in zip(uploads, results) if result["status"] == "success"]
+    finally:
+        await asyncio.to_thread(shutil.rmtree, out_dir, ignore_errors=True)
+
+
+def get_threads():
+    """Threads of this process that make the variants of answered uploads (created on first use, again after a fork)"""
+    global _threads, _threads_pid
+    with _pool_lock:
+        if _threads is None or _threads_pid != os.getpid():
+            _threads = ThreadPoolExecutor(max_workers=IMAGE_VARIANT_WORKERS, thread_name_prefix="image-variants")
+            _threads_pid = os.getpid()
+        return _threads
+
+
+def derive_later(storage, storage_path, source_path):
+    """
+    derive() in a background thread, so the upload can be answered once the
+    original is stored. The thread owns source_path and removes it when
+    done. Returns its Future.
+    """
+    def run():
+        try:
+            return derive(storage, storage_path, source_path)
+        except Exception as err:
+            logger.warning(f"No variants for {storage_path}: {err}")
+            return []
+        finally:
+            os.remove(source_path)
+
+    future = get_threads().submit(run)
+    _pending.add(future)
+    future.add_done_callback(_pending.discard)
+    return future
+
+
+def aderive_later(storage, storage_path, source_path):
+    """Async counterpart of derive_later(): aderive() in a task of the running loop"""
+    async def run():
+        try:
+            return await aderive(storage, storage_path, source_path)
+        except Exception as err:
+            logger.warning(f"No variants for {storage_path}: {err}")
+            return []
+        finally:
+            await asyncio.to_thread(os.remove, source_path)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def wait_pending(timeout=None):
+    """Waits for the variants derive_later() is making"""
+    wait(list(_pending), timeout)
+
+
+async def await_pending():
+    """Waits for the variants aderive_later() is making on this loop"""
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(task for task in list(_tasks) if task.get_loop() is loop))
+
+
+def tee(chunks, file):
+    """Yields chunks while writing them to file"""
+    for chunk in chunks:
+        file.write(chunk)
+        yield chunk
+
+
+async def atee(chunks, file):
+    """Async counterpart of tee(), writing off the event loop"""
+    async for chunk in chunks:
+        await asyncio.to_thread(file.write, chunk)
+        yield chunk
+
+
+def group_variants(entries):
+    """
+    Storage listing entries (or recursive tree entries) with every variant
+    moved under its original, as "Variants": [{"File_Name", "Width",
+    "Format"}]. Variants whose original is not listed stay as plain files.
+    """
+    def key(entry, name):
+        path = entry.get("Path")
+        return (path.rpartition("/")[0] if path else None, name)
+
+    originals = {key(entry, entry["File_Name"]): entry for entry in entries if "File_Name" in entry}
+    grouped = []
+    for entry in entries:
+        variant = parse_variant(entry["File_Name"]) if "File_Name" in entry else None
+        original = variant and originals.get(key(entry, variant[0]))
+        if original is None:
+            grouped.append(entry)
+            continue
+        original.setdefault("Variants", []).append({"File_Name": entry["File_Name"], "Width": variant[1], "Format": variant[2]})
+    for entry in grouped:
+        if "Variants" in entry:
+            entry["Variants"].sort(key=lambda variant: (variant["Width"], variant["Format"]))
+    return grouped
@@ -0,0 +1,324 @@
+"""Local SQLite index of the YouTube playlists and playlist items of our channels"""
+
+import os
+import json
+import hashlib
+import time
+import fcntl
+import sqlite3
+import logging
+import tempfile
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from search import SearchIndex
+from youtube import CHANNELS, as_episodes, channel_credentials, channel_key, list_all, merge_episodes
+
+logger = logging.getLogger(__name__)
+
+# Indice local de playlists de YouTube
+YOUTUBE_INDEX_PATH = os.getenv('YOUTUBE_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'tnoradio-youtube.sqlite3'))
+# Segundos entre sincronizaciones incrementales, y entre relecturas completas del canal
+YOUTUBE_SYNC_INTERVAL = float(os.getenv('YOUTUBE_SYNC_INTERVAL', 900))
+YOUTUBE_FULL_SYNC_INTERVAL = float(os.getenv('YOUTUBE_FULL_SYNC_INTERVAL', 24 * 3600))
+YOUTUBE_SYNC_WORKERS = int(os.getenv('YOUTUBE_SYNC_WORKERS', 4))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channels (
+    channel TEXT PRIMARY KEY,
+    etag TEXT,
+    version TEXT,
+    synced_at REAL NOT NULL,
+    full_synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist_id TEXT PRIMARY KEY,
+    channel TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    etag TEXT
+);
+CREATE INDEX IF NOT EXISTS playlists_by_channel ON playlists (channel, position);
+CREATE TABLE IF NOT EXISTS items (
+    playlist_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    video_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    published_at TEXT,
+    PRIMARY KEY (playlist_id, position)
+);
+"""
+
+
+def _pages(etag):
+    """[page_token, etag] of the pages of a channel's stored playlist listing (older indexes stored page 1's etag only)"""
+    try:
+        pages = json.loads(etag or "")
+    except ValueError:
+        return None
+    return pages if isinstance(pages, list) else None
+
+
+def _version(row):
+    """Version of a channel's indexed data; indexes synced before versions were kept fall back to the listing ETag"""
+    return row["version"] or row["etag"] or row["synced_at"]
+
+
+class PlaylistIndex:
+    """
+    Playlists and playlist items of each channel, kept in SQLite so the
+    YouTube routes answer from local disk.
+    sync() is incremental: every page of the channel's playlist listing is
+    requested with its ETag from the last sync, and when all of them answer
+    304 the sync ends there. Otherwise only
+    the playlists whose own ETag changed (title or item count) have their
+    items fetched again. A full re-read of the listing runs every
+    full_interval seconds. One process at a time syncs, under a lock file
+    next to the database.
+    Playlist names are looked up in an in-memory SearchIndex per channel,
+    rebuilt when a sync (in any process) changes the channel's listing.
+    Parameters
+    ----------
+    path          : String
+                    SQLite database file
+    interval      : Float
+                    Seconds between background syncs of a channel
+    full_interval : Float
+                    Seconds between syncs that ignore the listing ETag
+    """
+
+    def __init__(self, path=YOUTUBE_INDEX_PATH, interval=YOUTUBE_SYNC_INTERVAL, full_interval=YOUTUBE_FULL_SYNC_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.full_interval = full_interval
+        self._local = threading.local()
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+        self._names = {}
+        self._names_lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            if "version" not in [row["name"] for row in db.execute("PRAGMA table_info(channels)")]:
+                # indexes created before versions were kept
+                db.execute("ALTER TABLE channels ADD COLUMN version TEXT")
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            # readers never wait for a sync in another process
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    # Reads
+
+    def synced_at(self, channel):
+        row = self._connect().execute(
+            "SELECT synced_at FROM channels WHERE channel = ?", (channel_key(channel),)
+        ).fetchone()
+        return row["synced_at"] if row else None
+
+    def playlists(self, channel):
+        rows = self._connect().execute(
+            "SELECT title, playlist_id FROM playlists WHERE channel = ? ORDER BY position", (channel_key(channel),)
+        )
+        return [{'title': row["title"], 'playlist_id': row["playlist_id"]} for row in rows]
+
+    def items(self, playlist_id):
+        rows = self._connect().execute(
+            "SELECT title, video_id, published_at FROM items WHERE playlist_id = ? ORDER BY position", (playlist_id,)
+        )
+        return [
+            {'title': row["title"], 'video_id': row["video_id"], 'published_at': row["published_at"]}
+            for row in rows
+        ]
+
+    def validators(self, channels=CHANNELS):
+        """
+        (version, None) of each channel's indexed data: a digest of the
+        playlists and items its last sync committed, so it changes exactly
+        when they do. None for channels never synced.
+        """
+        rows = dict(
+            (row["channel"], _version(row))
+            for row in self._connect().execute("SELECT channel, etag, version, synced_at FROM channels")
+        )
+        return [(rows[channel], None) if channel in rows else None for channel in map(channel_key, channels)]
+
+    def names(self, channel):
+        """SearchIndex of the channel's playlist titles, rebuilt when its listing changed"""
+        channel = channel_key(channel)
+        row = self._connect().execute(
+            "SELECT etag, version, synced_at FROM channels WHERE channel = ?", (channel,)
+        ).fetchone()
+        version = row and _version(row)
+        with self._names_lock:
+            cached = self._names.get(channel)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        names = SearchIndex()
+        for position, playlist in enumerate(self.playlists(channel)):
+            names.add(playlist['playlist_id'], playlist['title'], position, dict(playlist, channel=channel))
+        with self._names_lock:
+            self._names[channel] = (version, names)
+        return names
+
+    def find_playlist(self, channel, playlist_name):
+        """Same result as youtube.find_playlist_by_name over the channel's playlists"""
+        found = self.names(channel).search(playlist_name, limit=1, words=False)
+        return found[0] if found else None
+
+    def search(self, query, channels=CHANNELS, limit=10):
+        """Best playlists of the channels for a (partial) name: substring or word-prefix matches"""
+        ranked = [self.names(channel).ranked(query) for channel in channels]
+        return [playlist for _, playlist in heapq.merge(*ranked, key=lambda result: result[0])][:limit]
+
+    def playlist_items(self, channel, playlist_name):
+        """Items of the channel's playlist best matching playlist_name, or [] when none does"""
+        playlist = self.find_playlist(channel, playlist_name)
+        if not playlist:
+            return []
+        return self.items(playlist['playlist_id'])
+
+    def all_episodes_sorted(self, playlist_name):
+        """
+        Episodes of the playlist_name playlists of every channel, sorted by
+        'published_at': each channel's are sorted once, then merged
+        """
+        return merge_episodes(
+            as_episodes(self.playlist_items(channel, playlist_name), channel) for channel in CHANNELS
+        )
+
+    # Sync
+
+    def sync(self, channel, full=False):
+        """Brings the channel up to date with YouTube; returns the number of playlists re-read"""
+        channel = channel_key(channel)
+        api_key, channel_id = channel_credentials(channel)
+        db = self._connect()
+        row = db.execute("SELECT etag, full_synced_at FROM channels WHERE channel = ?", (channel,)).fetchone()
+        now = time.time()
+        full = full or row is None or now - row["full_synced_at"] >= self.full_interval
+        pages, playlists = list_all(
+            api_key, "playlists", pages=None if full else _pages(row["etag"]),
+            part="snippet,contentDetails", channelId=channel_id,
+        )
+        if playlists is None:
+            with db:
+                db.execute("UPDATE channels SET synced_at = ? WHERE channel = ?", (now, channel))
+            return 0
+
+        known = dict(db.execute("SELECT playlist_id, etag FROM playlists WHERE channel = ?", (channel,)).fetchall())
+        changed = [playlist for playlist in playlists if known.get(playlist['id']) != playlist.get('etag')]
+        with ThreadPoolExecutor(max_workers=YOUTUBE_SYNC_WORKERS) as pool:
+            items = dict(zip(
+                (playlist['id'] for playlist in changed),
+                pool.map(lambda playlist: list_all(api_key, "playlistItems", playlistId=playlist['id'])[1], changed),
+            ))
+
+        with db:
+            current = [playlist['id'] for playlist in playlists]
+            removed = set(known) - set(current)
+            for playlist_id in removed:
+                db.execute("DELETE FROM playlists WHERE playlist_id = ?", (playlist_id,))
+                db.execute("DELETE FROM items WHERE playlist_id = ?", (playlist_id,))
+            for position, playlist in enumerate(playlists):
+                db.execute(
+                    "INSERT OR REPLACE INTO playlists (playlist_id, channel, position, title, etag) VALUES (?, ?, ?, ?, ?)",
+                    (playlist['id'], channel, position, playlist['snippet']['title'], playlist.get('etag')),
+                )
+            for playlist_id, playlist_items in items.items():
+                db.execute("DELETE FROM items WHERE playlist_id = ?", (playlist_id,))
+                db.executemany(
+                    "INSERT INTO items (playlist_id, position, video_id, title, published_at) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            playlist_id, position, item['snippet']['resourceId']['videoId'],
+                            item['snippet']['title'], item['snippet'].get('publishedAt'),
+                        )
+                        for position, item in enumerate(playlist_items)
+                    ],
+                )
+            db.execute(
+                "INSERT OR REPLACE INTO channels (channel, etag, version, synced_at, full_synced_at) VALUES (?, ?, ?, ?, ?)",
+                (channel, json.dumps(pages), self._digest(db, channel), now, now if full else row["full_synced_at"]),
+            )
+        logger.info(f"Synced {channel}: {len(playlists)} playlists, {len(changed)} re-read, {len(removed)} removed")
+        return len(changed)
+
+    @staticmethod
+    def _digest(db, channel):
+        """Digest of the playlists and items of a channel as stored in db"""
+        digest = hashlib.blake2b(digest_size=16)
+        rows = db.execute(
+            "SELECT playlists.playlist_id, playlists.title, items.video_id, items.title, items.published_at"
+            " FROM playlists LEFT JOIN items ON items.playlist_id = playlists.playlist_id"
+            " WHERE playlists.channel = ? ORDER BY playlists.position, items.position",
+            (channel,),
+        )
+        for row in rows:
+            digest.update(json.dumps(tuple(row)).encode())
+        return digest.hexdigest()
+
+    def _lock(self, blocking=True):
+        """Holds the sync lock file; returns its descriptor, or None if another process holds it"""
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _unlock(self, fd):
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def ensure_synced(self, channel):
+        """Syncs a channel that has never been synced (first request after a fresh install)"""
+        if self.synced_at(channel) is not None:
+            return
+        fd = self._lock()
+        try:
+            # another process may have synced it while we waited for the lock
+            if self.synced_at(channel) is None:
+                self.sync(channel)
+        finally:
+            self._unlock(fd)
+
+    def sync_due(self):
+        """Syncs the channels whose last sync is older than the interval, unless another process is at it"""
+        fd = self._lock(blocking=False)
+        if fd is None:
+            return
+        try:
+            for channel in CHANNELS:
+                synced_at = self.synced_at(channel)
+                if synced_at is None or time.time() - synced_at >= self.interval:
+                    try:
+                        self.sync(channel)
+                    except Exception as e:
+                        logger.warning(f"YouTube sync of {channel} failed: {e}")
+        finally:
+            self._unlock(fd)
+
+    def start(self):
+        """Starts the background sync thread of this process (once per process)"""
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+
+        def run():
+            while not self._stop.is_set():
+                self.sync_due()
+                self._stop.wait(min(self.interval, 60))
+
+        self._thread = threading.Thread(target=run, name="youtube-index-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,64 @@
+"""Listings projected to a few fields per item, kept as compact rows"""
+
+import sys
+from cache import json_size
+
+# Campos pedidos con fields= como maximo
+MAX_FIELDS = 32
+
+
+class Rows:
+    """
+    The items of a listing projected to `fields`: one tuple per item (absent
+    fields are None) instead of a dict, with short strings interned so the
+    values repeated across items (collection ids, resolutions...) are stored
+    once. `meta` holds the top-level keys of the listing other than items.
+    """
+
+    __slots__ = ("fields", "rows", "meta", "size")
+
+    def __init__(self, items, fields, meta=None):
+        self.fields = fields
+        self.rows = [tuple(_compact(item.get(field)) for field in fields) for item in items]
+        self.meta = meta or {}
+        self.size = json_size(self.rows) + json_size(self.meta)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_json(self):
+        """The listing with the shape of the original, each item holding only the projected fields"""
+        fields = self.fields
+        return {**self.meta, "items": [dict(zip(fields, row)) for row in self.rows]}
+
+
+def _compact(value):
+    if type(value) is str and len(value) <= 64:
+        return sys.intern(value)
+    return value
+
+
+def project(listing, fields):
+    """Rows of a Bunny listing ({"items": [...], ...}) projected to fields"""
+    return Rows(listing.get("items", []), fields, {key: value for key, value in listing.items() if key != "items"})
+
+
+def parse_fields(fields=None, view=None, views=None):
+    """
+    The fields to project a listing to for a request's fields= (comma
+    separated names) and view= (a name in views), in order and without
+    repeats; None for the full objects. Raises ValueError for an unknown view
+    or too many fields.
+    """
+    if view:
+        if view not in (views or {}):
+            raise ValueError(f"Unknown view: {view}. Views: {', '.join(views or ())}")
+        names = list(views[view])
+    else:
+        names = []
+    if fields:
+        names.extend(field.strip() for field in fields.split(","))
+    names = tuple(dict.fromkeys(name for name in names if name))
+    if len(names) > MAX_FIELDS:
+        raise ValueError(f"At most {MAX_FIELDS} fields")
+    return names or None
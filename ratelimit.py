@@ -0,0 +1,175 @@
+"""Per-client request rate limiting shared by the Flask and ASGI apps"""
+
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+
+# Backend del rate limiter: "shared" (memoria compartida entre workers) o "memory" (por proceso)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "shared")
+RATE_LIMIT_SHARED_PATH = os.getenv(
+    "RATE_LIMIT_SHARED_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "tnoradio-ratelimit"),
+)
+RATE_LIMIT_SLOTS = int(os.getenv("RATE_LIMIT_SLOTS", 65536))
+
+
+def _refill(tokens, last, now, rate, capacity):
+    """Tokens in a bucket at `now`, given what it held at `last`"""
+    return min(capacity, tokens + max(now - last, 0) * rate)
+
+
+class MemoryBackend:
+    """
+    Token buckets in a dict local to the process. A bucket that has refilled
+    completely carries no information, so buckets of idle clients are
+    dropped on a periodic sweep.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def take(self, client, now, rate, capacity):
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now, rate, capacity)
+            tokens, last = self.buckets.get(client, (capacity, now))
+            tokens = _refill(tokens, last, now, rate, capacity)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[client] = (tokens, now)
+            return allowed
+
+    def _sweep(self, now, rate, capacity):
+        for client, (tokens, last) in list(self.buckets.items()):
+            if _refill(tokens, last, now, rate, capacity) >= capacity:
+                del self.buckets[client]
+        self._next_sweep = now + capacity / rate
+
+
+class SharedMemoryBackend:
+    """
+    Token buckets in a fixed-size hash table in a memory-mapped file, so every
+    gunicorn worker (or uvicorn process) on the host enforces one shared limit.
+    Each slot holds (client hash, tokens, last update). Lookups probe a few
+    slots from the client's hash. A slot whose bucket has refilled completely
+    counts as free, so idle clients expire without a sweep. When all the
+    probed slots are taken, the least recently updated one is reused.
+    Parameters
+    ----------
+    path  : String
+            File backing the table (a tmpfs path such as /dev/shm keeps it in memory)
+    slots : Int
+            Number of buckets in the table (24 bytes each)
+    """
+
+    SLOT = struct.Struct("<Qdd")
+    PROBES = 16
+
+    def __init__(self, path=RATE_LIMIT_SHARED_PATH, slots=RATE_LIMIT_SLOTS):
+        self.path = path
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != size:
+                # a table of another size (or a new file) starts empty
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _key(self, client):
+        key = int.from_bytes(hashlib.blake2b(str(client).encode(), digest_size=8).digest(), "little")
+        return key or 1
+
+    def take(self, client, now, rate, capacity):
+        if self._pid != os.getpid():
+            # forked: the lock may have been held by a thread of the parent
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+        key = self._key(client)
+        slot, size, view = self.SLOT, self.SLOT.size, self._map
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                found = free = oldest = None
+                oldest_last = float("inf")
+                start = key % self.slots
+                for probe in range(self.PROBES):
+                    offset = ((start + probe) % self.slots) * size
+                    slot_key, tokens, last = slot.unpack_from(view, offset)
+                    if slot_key == key:
+                        found = offset
+                        break
+                    if slot_key == 0:
+                        # slots are never emptied again, so the client can't be further on
+                        if free is None:
+                            free = offset
+                        break
+                    if free is None and _refill(tokens, last, now, rate, capacity) >= capacity:
+                        free = offset
+                    elif last < oldest_last:
+                        oldest, oldest_last = offset, last
+                if found is not None:
+                    tokens = _refill(tokens, last, now, rate, capacity)
+                else:
+                    found = free if free is not None else oldest
+                    tokens = capacity
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                slot.pack_into(view, found, key, tokens, now)
+                return allowed
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def build_backend(name=RATE_LIMIT_BACKEND):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "shared":
+        return SharedMemoryBackend()
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+class RateLimiter:
+    """
+    Token bucket per client: bursts of up to `limit` requests, refilled at
+    `limit` requests every `window` seconds. Unlike a fixed window, a client
+    can't send 2x the limit around a window boundary.
+    Parameters
+    ----------
+    limit   : Int
+              Requests allowed per window
+    window  : Float
+              Window length in seconds
+    backend : MemoryBackend | SharedMemoryBackend
+              Where the buckets live (RATE_LIMIT_BACKEND by default)
+    """
+
+    def __init__(self, limit=100, window=60, backend=None):
+        self.limit = limit
+        self.window = window
+        self.rate = limit / window
+        self.backend = backend if backend is not None else build_backend()
+
+    def allow(self, client, now):
+        return self.backend.take(client, now, self.rate, self.limit)
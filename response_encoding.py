@@ -0,0 +1,145 @@
+"""JSON bodies of the listing routes: fast encoding, negotiated compression and a cache of the encoded bytes"""
+
+import os
+import json
+import gzip
+import logging
+from cache import Cache
+
+logger = logging.getLogger(__name__)
+
+# Serializador JSON de los listados: "orjson" (si esta instalado) o "json" (stdlib)
+JSON_ENCODER = os.getenv("JSON_ENCODER", "orjson")
+# Compresion de respuestas: codificaciones en orden de preferencia, y tamaño minimo en bytes
+COMPRESS_CODINGS = [coding.strip() for coding in os.getenv("COMPRESS_CODINGS", "zstd,br,gzip").split(",") if coding.strip()]
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+# Cuerpos ya codificados (y comprimidos) de las respuestas con ETag
+ENCODED_CACHE_MAX_BYTES = int(os.getenv("ENCODED_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+ENCODED_CACHE_TTL = float(os.getenv("ENCODED_CACHE_TTL", 3600))
+
+# Bodies keyed by (ETag, content coding or None): an ETag names one body, so entries never go stale
+encoded_cache = Cache(max_bytes=ENCODED_CACHE_MAX_BYTES, sizeof=len)
+
+
+def _stdlib_dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str).encode()
+
+
+def _build_dumps(name):
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            logger.warning("orjson is not installed: JSON responses use the stdlib encoder")
+        else:
+            # same output as the stdlib encoder for our payloads, several times faster
+            return lambda value: orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    elif name != "json":
+        raise ValueError(f"Unknown JSON encoder: {name}")
+    return _stdlib_dumps
+
+
+dumps = _build_dumps(JSON_ENCODER)
+
+
+def _build_codecs():
+    """Compressors of the available content codings (gzip always, br and zstd when installed)"""
+    codecs = {"gzip": lambda data: gzip.compress(data, compresslevel=6, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        codecs["br"] = lambda data: brotli.compress(data, quality=5)
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        # a ZstdCompressor isn't thread-safe: one per call
+        codecs["zstd"] = lambda data: zstandard.ZstdCompressor(level=6).compress(data)
+    return codecs
+
+
+codecs = _build_codecs()
+
+
+def negotiate(accept_encoding):
+    """
+    Content coding for a request's Accept-Encoding: the one with the highest
+    q among the available ones, COMPRESS_CODINGS order breaking ties; None
+    for identity.
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in COMPRESS_CODINGS:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if coding in codecs and q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def cached(etag, accept_encoding):
+    """(body, coding) of a response already encoded for this ETag and Accept-Encoding, or None"""
+    if etag is None:
+        return None
+    coding = negotiate(accept_encoding)
+    if coding is not None:
+        body = encoded_cache.get((etag, coding))
+        if body is not None:
+            return body, coding
+    body = encoded_cache.get((etag, None))
+    # bodies under the threshold are only stored uncompressed
+    if body is not None and (coding is None or len(body) < COMPRESS_MIN_BYTES):
+        return body, None
+    return None
+
+
+def encode(payload, accept_encoding, etag=None):
+    """
+    (body, coding) of payload for a request's Accept-Encoding: its JSON
+    (payload may also be a callable building the value, called only when
+    the body isn't cached),
+    compressed with the negotiated coding when at least COMPRESS_MIN_BYTES
+    long (coding None otherwise). With an ETag, the encoded and compressed
+    bodies are kept in encoded_cache, so the next request for the same ETag
+    skips both.
+    """
+    found = cached(etag, accept_encoding)
+    if found is not None:
+        return found
+    coding = negotiate(accept_encoding)
+
+    def encoded():
+        return dumps(payload() if callable(payload) else payload)
+
+    if etag is None:
+        body = encoded()
+    else:
+        # concurrent requests for the same ETag share one encoding
+        body = encoded_cache.get_or_load((etag, None), encoded, ENCODED_CACHE_TTL)
+    if coding is None or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if etag is None:
+        return codecs[coding](body), coding
+    return encoded_cache.get_or_load((etag, coding), lambda: codecs[coding](body), ENCODED_CACHE_TTL), coding
+
+
+def headers(coding):
+    """Headers of an encoded body"""
+    result = {"Content-Type": "application/json", "Vary": "Accept-Encoding"}
+    if coding is not None:
+        result["Content-Encoding"] = coding
+    return result
@@ -0,0 +1,87 @@
+"""Request parsing and response pieces shared by the Flask (app.py) and ASGI (asgi.py) apps"""
+
+import json
+import conditional
+import response_encoding
+from config import BULK_MAX_ITEMS, VIDEO_URLS_MAX_GUIDS
+
+
+def bulk_paths(params):
+    """(valid, invalid) storage paths of a bulk delete: `paths`, plus `filenames` inside `image_type`"""
+    paths = list(params.get('paths') or [])
+    if params.get('image_type'):
+        paths += [f"{params['image_type']}/{filename}" for filename in params.get('filenames') or []]
+    valid, invalid = [], []
+    for path in dict.fromkeys(str(path) for path in paths):
+        # an empty path would delete the whole show
+        parts = path.strip("/").split("/")
+        (invalid if any(part in ("", ".", "..") for part in parts) else valid).append(path)
+    return valid, invalid
+
+
+def bulk_delete_params(params, args):
+    """
+    ((show_slug, valid paths, invalid paths), problem) of a bulk delete from
+    its JSON body and query string; problem is (error payload, status) or None
+    """
+    show_slug = params.get('show_slug') or args.get('show_slug')
+    paths, invalid = bulk_paths(params)
+    if not show_slug or not (paths or invalid):
+        return None, ({"error": "Missing required parameters: show_slug, paths"}, 400)
+    if len(paths) + len(invalid) > BULK_MAX_ITEMS:
+        return None, ({"error": f"At most {BULK_MAX_ITEMS} paths per request"}, 400)
+    return (show_slug, paths, invalid), None
+
+
+def bulk_line(counts, storage_path, result):
+    """One NDJSON line of a bulk response"""
+    counts[result.get("status")] = counts.get(result.get("status"), 0) + 1
+    return json.dumps({"path": storage_path, "status": result.get("status"), "message": result.get("msg")}) + "\n"
+
+
+def bulk_error(counts, storage_path, message):
+    """NDJSON line of an item of a bulk request refused before reaching Bunny.net"""
+    return bulk_line(counts, storage_path, {"status": "error", "msg": message})
+
+
+def bulk_summary(counts):
+    return json.dumps({"status": "done", "succeeded": counts.get("success", 0), "failed": sum(counts.values()) - counts.get("success", 0)}) + "\n"
+
+
+def batch_guids(params):
+    """Unique guids of a batch request: a JSON list or a comma-separated string"""
+    guids = params.get('guids') or []
+    if isinstance(guids, str):
+        guids = guids.split(',')
+    return list(dict.fromkeys(guid.strip() for guid in guids if isinstance(guid, str) and guid.strip()))
+
+
+def video_urls_params(params):
+    """((guids, resolution, format), problem) of a /get_video_urls request; problem is (error payload, status) or None"""
+    guids = batch_guids(params)
+    if not guids:
+        return None, ({"error": "Missing required parameter: guids"}, 400)
+    if len(guids) > VIDEO_URLS_MAX_GUIDS:
+        return None, ({"error": f"At most {VIDEO_URLS_MAX_GUIDS} guids per request"}, 400)
+    return (guids, params.get('resolution', '720p'), params.get('format', 'mp4')), None
+
+
+def not_modified_headers(request_headers, validator):
+    """
+    Headers of a 304 when the client's copy of a response with this
+    (etag, last_modified) validator is current, otherwise None
+    """
+    if not validator or not conditional.not_modified(request_headers, *validator):
+        return None
+    accept_encoding = request_headers.get('Accept-Encoding')
+    found = response_encoding.cached(validator[0], accept_encoding)
+    coding = found[1] if found else response_encoding.negotiate(accept_encoding)
+    return conditional.headers(*validator, coding)
+
+
+def json_headers(validator, coding):
+    """Headers of an encoded JSON body, with its validators when it has them"""
+    headers = response_encoding.headers(coding)
+    if validator:
+        headers.update(conditional.headers(*validator, coding))
+    return headers
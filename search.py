@@ -0,0 +1,242 @@
+"""In-memory name index: accent-insensitive substring, word-prefix and fuzzy lookups with a deterministic ranking"""
+
+import bisect
+import unicodedata
+
+
+def normalize(text):
+    """Lower case, without accents, with runs of anything but letters and digits turned into one space"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    return " ".join("".join(char if char.isalnum() else " " for char in text).split())
+
+
+# Words shorter than this only match exactly or as a prefix, never fuzzily
+FUZZY_MIN_LENGTH = 4
+
+
+def _grams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _variants(word):
+    """The word and the words one deletion away from it (two words sharing a variant are at most two edits apart)"""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def rank(text, query, query_words=(), words=None):
+    """
+    How well a normalized text matches a normalized query, lower is better,
+    or None when it doesn't match:
+    0 equal, 1 starts with the query, 2 the query starts a word, 3 the query
+    is anywhere else, 4 (only when query_words are given) every query word
+    starts a word of the text. SearchIndex ranks fuzzy matches 5.
+    """
+    at = text.find(query)
+    if at == 0:
+        return 0 if len(text) == len(query) else 1
+    if at > 0:
+        return 2 if text[at - 1] == " " else 3
+    if query_words:
+        words = text.split() if words is None else words
+        if all(any(word.startswith(query_word) for word in words) for query_word in query_words):
+            return 4
+    return None
+
+
+def best_match(items, query, text):
+    """
+    Best ranked item whose text(item) contains query, ignoring case and
+    accents; ties go to the shorter text, then to the earlier item. Same
+    result as a SearchIndex over the items searched with words=False.
+    """
+    query = normalize(query)
+    best = best_key = None
+    for position, item in enumerate(items):
+        normalized = normalize(text(item))
+        tier = rank(normalized, query)
+        if tier is not None and (best_key is None or (tier, len(normalized), position) < best_key):
+            best, best_key = item, (tier, len(normalized), position)
+    return best
+
+
+class _Entry:
+    __slots__ = ("key", "text", "words", "position", "data")
+
+    def __init__(self, key, text, position, data, extra=""):
+        self.key = key
+        self.text = text
+        self.words = tuple(dict.fromkeys((text + " " + extra).split()))
+        self.position = position
+        self.data = data
+
+
+class SearchIndex:
+    """
+    Names indexed for lookups that don't scan every name: a trigram index
+    finds the names containing a query, and a sorted word list (searched
+    with bisect, like a trie) finds the names with words starting with
+    each query word. Fuzzy searches also match words one or two edits away
+    (typos), found through a table of the words one deletion away from each
+    indexed word. Matches are ranked by rank(), then by the length of the
+    name, then by the position given when the name was added. That second
+    order is computed once per change of the index, so ranking the matches
+    of a search sorts plain integers.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._grams = {}
+        self._postings = {}
+        self._words = []
+        self._variants = {}
+        self._order = None
+        self._order_of = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        return self._entries.keys()
+
+    def add(self, key, text, position=0, data=None, extra=""):
+        """
+        Indexes text under key (replacing what key had); data is what searches
+        return. The words of extra (e.g. metadata) match word searches but
+        don't take part in substring matches or in the ranking.
+        """
+        if key in self._entries:
+            self.remove(key)
+        self._order = None
+        entry = self._entries[key] = _Entry(key, normalize(text), position, data, normalize(extra))
+        for gram in _grams(entry.text):
+            self._grams.setdefault(gram, set()).add(key)
+        for word in entry.words:
+            posting = self._postings.get(word)
+            if posting is None:
+                posting = self._postings[word] = set()
+                bisect.insort(self._words, word)
+                if len(word) >= FUZZY_MIN_LENGTH:
+                    for variant in _variants(word):
+                        self._variants.setdefault(variant, set()).add(word)
+            posting.add(key)
+
+    def remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._order = None
+        for gram in _grams(entry.text):
+            posting = self._grams[gram]
+            posting.discard(key)
+            if not posting:
+                del self._grams[gram]
+        for word in entry.words:
+            posting = self._postings[word]
+            posting.discard(key)
+            if not posting:
+                del self._postings[word]
+                del self._words[bisect.bisect_left(self._words, word)]
+                if len(word) >= FUZZY_MIN_LENGTH:
+                    for variant in _variants(word):
+                        similar = self._variants[variant]
+                        similar.discard(word)
+                        if not similar:
+                            del self._variants[variant]
+
+    def _containing(self, query):
+        """Keys whose text may contain query"""
+        if len(query) < 3:
+            return set(self._entries)
+        postings = sorted((self._grams.get(gram, set()) for gram in _grams(query)), key=len)
+        return set(postings[0]).intersection(*postings[1:])
+
+    def _prefixed(self, prefix):
+        """Keys with a word starting with prefix"""
+        keys = set()
+        start = bisect.bisect_left(self._words, prefix)
+        for word in self._words[start:]:
+            if not word.startswith(prefix):
+                break
+            keys |= self._postings[word]
+        return keys
+
+    def _similar(self, word):
+        """Keys with a word a typo or two away from word"""
+        keys = set()
+        if len(word) < FUZZY_MIN_LENGTH:
+            return keys
+        for variant in _variants(word):
+            for similar in self._variants.get(variant, ()):
+                keys |= self._postings[similar]
+        return keys
+
+    def _matching_words(self, query_words, fuzzy):
+        """Keys with a match for every query word: a word starting with it, or a similar word when fuzzy"""
+        keys = None
+        for query_word in query_words:
+            found = self._prefixed(query_word)
+            if fuzzy:
+                found |= self._similar(query_word)
+            keys = found if keys is None else keys & found
+            if not keys:
+                break
+        return keys or set()
+
+    def _ordering(self):
+        """Keys sorted by (length, position, key), and the index of each key in that list"""
+        if self._order is None:
+            entries = self._entries.values()
+            self._order = [entry.key for entry in sorted(entries, key=lambda entry: (len(entry.text), entry.position, str(entry.key)))]
+            self._order_of = {key: index for index, key in enumerate(self._order)}
+        return self._order, self._order_of
+
+    def _scores(self, query, words, fuzzy):
+        """Sorted scores of the matches of a normalized query: tier * len(index) + place in _ordering()"""
+        keys = self._containing(query)
+        query_words = query.split() if words or fuzzy else ()
+        if query_words:
+            keys |= self._matching_words(query_words, False)
+        _, order_of = self._ordering()
+        size = len(self._entries)
+        entries = self._entries
+        scores = {}
+        for key in keys:
+            entry = entries[key]
+            tier = rank(entry.text, query, query_words, entry.words)
+            if tier is not None:
+                scores[key] = tier * size + order_of[key]
+        if fuzzy:
+            for key in self._matching_words(query_words, True):
+                if key not in scores:
+                    scores[key] = 5 * size + order_of[key]
+        return sorted(scores.values())
+
+    def page(self, query, offset=0, limit=None, words=True, fuzzy=False):
+        """
+        (number of matches, sorted (rank key, data) of the matches from offset
+        to offset + limit) for query. With words=False only names containing
+        the query match; otherwise names with a word starting with every query
+        word match too, and with fuzzy=True so do names with words similar to
+        the query words. Rank keys are (tier, length, position, str(key)), so
+        results of different indexes can be merged.
+        """
+        query = normalize(query)
+        if not query:
+            return 0, []
+        scores = self._scores(query, words, fuzzy)
+        order, size = self._order, len(self._entries)
+        end = None if limit is None else offset + limit
+        results = []
+        for score in scores[offset:end]:
+            entry = self._entries[order[score % size]]
+            results.append(((score // size, len(entry.text), entry.position, str(entry.key)), entry.data))
+        return len(scores), results
+
+    def ranked(self, query, words=True, fuzzy=False):
+        """Sorted (rank key, data) of all the matches of query (see page())"""
+        return self.page(query, words=words, fuzzy=fuzzy)[1]
+
+    def search(self, query, limit=None, words=True, fuzzy=False, offset=0):
+        """Data of the best `limit` matches of query after the first `offset` (all when limit is None)"""
+        return [data for _, data in self.page(query, offset, limit, words, fuzzy)[1]]
@@ -0,0 +1,480 @@
+"""On-disk cache of proxied video bytes, kept as fixed-size segments of sparse files"""
+
+import os
+import json
+import mmap
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from werkzeug.http import parse_content_range_header, parse_range_header
+
+logger = logging.getLogger(__name__)
+
+# Cache local de /proxy_video y /proxy_thumbnail
+SEGMENT_CACHE_DIR = os.getenv('SEGMENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'tnoradio-segments'))
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv('SEGMENT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+SEGMENT_SIZE = int(os.getenv('SEGMENT_SIZE', 1024 * 1024))
+READ_CHUNK = 256 * 1024
+# Segundos entre relecturas del directorio compartido (lo que cachearon los otros workers)
+SEGMENT_CACHE_RESCAN_INTERVAL = float(os.getenv('SEGMENT_CACHE_RESCAN_INTERVAL', 10))
+
+
+class CachedObject:
+    """
+    One upstream object (a video rendition or a thumbnail) stored in a sparse
+    file of its full size. `segments` holds the indexes of the segments whose
+    bytes are all on disk. Every version of an object gets a data file of
+    its own name (the metadata names the current one), so a path never
+    holds another version. `meta_mtime` is the mtime of the metadata as
+    last read or written here.
+    """
+
+    __slots__ = (
+        "key", "name", "path", "total", "content_type", "etag", "last_modified", "segments", "evicted", "meta_mtime",
+    )
+
+    def __init__(self, key, name, path, total, content_type, etag=None, last_modified=None, segments=()):
+        self.key = key
+        self.name = name
+        self.path = path
+        self.total = total
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.segments = set(segments)
+        self.evicted = False
+        self.meta_mtime = None
+
+    def to_dict(self):
+        return {
+            "key": list(self.key),
+            "total": self.total,
+            "content_type": self.content_type,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "segments": sorted(self.segments),
+            "file": os.path.basename(self.path),
+        }
+
+
+class SegmentCache:
+    """
+    Size-bounded, LRU on-disk cache of upstream objects keyed by
+    (guid, variant), filled one byte range at a time.
+    Cached ranges are read back through mmap, and complete objects can be
+    handed to send_file() so the server may use sendfile(2).
+    The directory is shared by the worker processes: an object is checked
+    against its files (data file, metadata mtime) when looked up and
+    before it is read, so one dropped or replaced by another process is
+    forgotten instead of served, and segments filled elsewhere are picked
+    up. Every process re-reads the whole directory at most every
+    `rescan_interval` seconds as it fills, so the byte bound holds for the
+    directory, not per process.
+    Parameters
+    ----------
+    root            : String
+                      Directory for the data files and their JSON metadata
+    max_bytes       : Int
+                      Upper bound for the cached bytes
+    segment_size    : Int
+                      Granularity in bytes at which ranges are cached
+    rescan_interval : Float
+                      Seconds between re-reads of the directory
+    """
+
+    def __init__(
+        self, root=SEGMENT_CACHE_DIR, max_bytes=SEGMENT_CACHE_MAX_BYTES, segment_size=SEGMENT_SIZE,
+        rescan_interval=SEGMENT_CACHE_RESCAN_INTERVAL,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self.rescan_interval = rescan_interval
+        self._objects = OrderedDict()
+        self._bytes = 0
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "partial_hits": 0, "misses": 0, "filled_bytes": 0, "evictions": 0}
+        os.makedirs(root, exist_ok=True)
+        with self._lock:
+            self._rescan()
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def _name(self, key):
+        return hashlib.sha1("/".join(key).encode()).hexdigest()
+
+    def _meta_path(self, name):
+        return os.path.join(self.root, name + ".json")
+
+    def _rescan(self):
+        """Brings the objects and the byte count up to date with the directory (called with the lock held)"""
+        for obj in list(self._objects.values()):
+            self._revalidate(obj)
+        known = {obj.name for obj in self._objects.values()}
+        metas = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".json") and entry.name[:-5] not in known:
+                try:
+                    metas.append((entry.stat().st_mtime, entry.name[:-5]))
+                except FileNotFoundError:
+                    pass
+        for _, name in sorted(metas):
+            self._read_meta(name)
+        self._scanned = time.monotonic()
+
+    def _load_meta(self, name):
+        """(metadata, mtime) of an object's metadata file, or (None, None)"""
+        try:
+            with open(self._meta_path(name)) as file:
+                return json.load(file), os.fstat(file.fileno()).st_mtime_ns
+        except (OSError, ValueError):
+            return None, None
+
+    def _data_path(self, name, data):
+        return os.path.join(self.root, data.get("file") or name + ".bin")
+
+    def _read_meta(self, name):
+        data, mtime = self._load_meta(name)
+        if data is None:
+            return None
+        path = self._data_path(name, data)
+        if not os.path.exists(path):
+            return None
+        obj = CachedObject(
+            tuple(data["key"]), name, path, data["total"], data["content_type"],
+            data.get("etag"), data.get("last_modified"), data.get("segments", ()),
+        )
+        obj.meta_mtime = mtime
+        self._objects[obj.key] = obj
+        self._bytes += self._cached_bytes(obj, obj.segments)
+        return obj
+
+    def _write_meta(self, obj):
+        # segments another process filled in the same data file are kept
+        data, _ = self._load_meta(obj.name)
+        if data is not None and self._data_path(obj.name, data) == obj.path:
+            self._add_segments(obj, data.get("segments", ()))
+        temp_path = self._meta_path(obj.name) + f".{os.getpid()}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(obj.to_dict(), file)
+            obj.meta_mtime = os.fstat(file.fileno()).st_mtime_ns
+        os.replace(temp_path, self._meta_path(obj.name))
+
+    def _add_segments(self, obj, segments):
+        added = set(segments) - obj.segments
+        obj.segments |= added
+        self._bytes += self._cached_bytes(obj, added)
+
+    def _revalidate(self, obj):
+        """
+        obj, updated with the segments other processes marked, or None when
+        another process dropped or replaced its data file (it is forgotten
+        here). Called with the lock held.
+        """
+        try:
+            meta_mtime = os.stat(self._meta_path(obj.name)).st_mtime_ns
+        except FileNotFoundError:
+            meta_mtime = None
+        if meta_mtime is None or not os.path.exists(obj.path):
+            self._forget(obj)
+            return None
+        if meta_mtime != obj.meta_mtime:
+            data, obj.meta_mtime = self._load_meta(obj.name)
+            if data is None or self._data_path(obj.name, data) != obj.path:
+                # another version replaced it
+                self._forget(obj)
+                return None
+            self._add_segments(obj, data.get("segments", ()))
+        return obj
+
+    def _forget(self, obj):
+        obj.evicted = True
+        if self._objects.get(obj.key) is obj:
+            del self._objects[obj.key]
+            self._bytes -= self._cached_bytes(obj, obj.segments)
+
+    def _segment_count(self, obj):
+        return (obj.total + self.segment_size - 1) // self.segment_size
+
+    def _cached_bytes(self, obj, segments):
+        size = 0
+        for index in segments:
+            size += min(self.segment_size, obj.total - index * self.segment_size)
+        return size
+
+    def lookup(self, key):
+        """Returns the CachedObject for key (most recently used from now on), or None"""
+        with self._lock:
+            obj = self._objects.get(key)
+            if obj is not None:
+                obj = self._revalidate(obj)
+            if obj is None:
+                # another worker process may have cached it
+                obj = self._read_meta(self._name(key))
+                self._evict()
+            if obj is not None:
+                self._objects.move_to_end(key)
+            return obj
+
+    def create(self, key, total, content_type, etag=None, last_modified=None):
+        """Starts caching key as an empty sparse file of total bytes, replacing any older version"""
+        name = self._name(key)
+        path = os.path.join(self.root, f"{name}.{uuid.uuid4().hex[:16]}.bin")
+        with self._lock:
+            old = self._objects.get(key)
+            if old is not None:
+                self._forget(old)
+            # the version on disk, whichever process cached it
+            data, _ = self._load_meta(name)
+            with open(path, "wb") as file:
+                file.truncate(total)
+            obj = CachedObject(key, name, path, total, content_type, etag, last_modified)
+            self._write_meta(obj)
+            if data is not None:
+                self._remove(self._data_path(name, data))
+            self._objects[key] = obj
+        return obj
+
+    def invalidate(self, key):
+        with self._lock:
+            obj = self._objects.get(key)
+            if obj is not None:
+                self._drop(obj)
+
+    def _drop(self, obj):
+        self._forget(obj)
+        data, _ = self._load_meta(obj.name)
+        if data is not None and self._data_path(obj.name, data) == obj.path:
+            self._remove(self._meta_path(obj.name))
+        # an older version's file: the newer one, if any, stays
+        self._remove(obj.path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep=None):
+        while self._bytes > self.max_bytes and len(self._objects) > (keep is not None):
+            for key, obj in self._objects.items():
+                if obj is not keep:
+                    break
+            self._drop(obj)
+            self.stats["evictions"] += 1
+
+    def is_complete(self, obj):
+        return len(obj.segments) == self._segment_count(obj)
+
+    def runs(self, obj, start, end):
+        """
+        Splits the inclusive byte range start-end into consecutive runs
+        (cached, run_start, run_end). Missing runs are widened to whole
+        segments so that filling them caches complete segments.
+        """
+        first, last = start // self.segment_size, end // self.segment_size
+        runs = []
+        for index in range(first, last + 1):
+            cached = index in obj.segments
+            if runs and runs[-1][0] == cached:
+                runs[-1][2] = index
+            else:
+                runs.append([cached, index, index])
+        result = []
+        for cached, first_index, last_index in runs:
+            run_start = first_index * self.segment_size
+            run_end = min((last_index + 1) * self.segment_size, obj.total) - 1
+            if cached:
+                run_start, run_end = max(run_start, start), min(run_end, end)
+            result.append((cached, run_start, run_end))
+        with self._lock:
+            if all(cached for cached, _, _ in result):
+                self.stats["hits"] += 1
+            elif any(cached for cached, _, _ in result):
+                self.stats["partial_hits"] += 1
+            else:
+                self.stats["misses"] += 1
+        return result
+
+    def current(self, obj):
+        """obj when its data file is still the one cached here (see lookup), otherwise None"""
+        with self._lock:
+            return None if obj.evicted else self._revalidate(obj)
+
+    def read(self, obj, start, end, chunk_size=READ_CHUNK):
+        """
+        Yields the cached bytes start-end (inclusive) from a memory map of the
+        data file. Raises FileNotFoundError when another process dropped or
+        replaced the file since obj was looked up.
+        """
+        try:
+            file = open(obj.path, "rb")
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(obj)
+            raise
+        with file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            position = start
+            while position <= end:
+                stop = min(position + chunk_size, end + 1)
+                yield view[position:stop]
+                position = stop
+
+    def fill(self, obj, offset, start=None, end=None):
+        """Returns a Fill writing upstream bytes that begin at offset into obj"""
+        return Fill(self, obj, offset, start, end)
+
+    def _mark(self, obj, segments):
+        with self._lock:
+            if obj.evicted or self._revalidate(obj) is None:
+                return
+            segments = set(segments) - obj.segments
+            if not segments:
+                return
+            self._add_segments(obj, segments)
+            self.stats["filled_bytes"] += self._cached_bytes(obj, segments)
+            self._write_meta(obj)
+            if time.monotonic() - self._scanned >= self.rescan_interval:
+                # count what the other processes cached too
+                self._rescan()
+            self._evict(keep=obj)
+
+    def begin(self, key, status, headers):
+        """
+        Returns a Fill caching the body of an upstream 200/206 response for
+        key, or None when the response can't be cached.
+        """
+        if headers.get("Content-Encoding"):
+            return None
+        if status == 206:
+            content_range = parse_content_range_header(headers.get("Content-Range"))
+            if content_range is None or content_range.length is None:
+                return None
+            offset, total = content_range.start, content_range.length
+        elif status == 200 and headers.get("Content-Length"):
+            offset, total = 0, int(headers["Content-Length"])
+        else:
+            return None
+        if total == 0:
+            return None
+        etag = headers.get("ETag")
+        obj = self.lookup(key)
+        if obj is None or obj.total != total or obj.etag != etag:
+            obj = self.create(
+                key, total, headers.get("Content-Type", "application/octet-stream"),
+                etag, headers.get("Last-Modified"),
+            )
+        return self.fill(obj, offset)
+
+    def store(self, key, data, content_type, etag=None, last_modified=None):
+        """Caches a whole small object (e.g. a thumbnail) in one go"""
+        obj = self.create(key, len(data), content_type, etag, last_modified)
+        fill = self.fill(obj, 0)
+        fill.feed(data)
+        fill.close()
+        return obj
+
+
+def request_window(obj, range_header, if_range=None):
+    """
+    Resolves a client's Range/If-Range against a cached object.
+    Returns (status, start, end) with an inclusive end and a status of 200,
+    206 or 416, or None for multi-range requests, which are not served from
+    the cache.
+    """
+    full = (200, 0, obj.total - 1)
+    if not range_header:
+        return full
+    if if_range and if_range not in (obj.etag, obj.last_modified):
+        return full
+    requested = parse_range_header(range_header)
+    if requested is None:
+        return full
+    if len(requested.ranges) != 1:
+        return None
+    span = requested.range_for_length(obj.total)
+    if span is None:
+        return 416, 0, -1
+    return 206, span[0], span[1] - 1
+
+
+def response_headers(obj, status, start, end):
+    """Headers of a response served from the cache for request_window()'s result"""
+    headers = {
+        'Content-Type': obj.content_type,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'public, max-age=3600',
+    }
+    if status == 416:
+        headers['Content-Range'] = f"bytes */{obj.total}"
+        return headers
+    headers['Content-Length'] = str(end - start + 1)
+    if status == 206:
+        headers['Content-Range'] = f"bytes {start}-{end}/{obj.total}"
+    if obj.etag:
+        headers['ETag'] = obj.etag
+    if obj.last_modified:
+        headers['Last-Modified'] = obj.last_modified
+    return headers
+
+
+class Fill:
+    """
+    Writes a stream of upstream bytes starting at `offset` into a cached
+    object while it is relayed. feed() returns the part of each chunk that
+    falls within the client's window start-end, and every segment fully
+    covered by the written bytes is marked as cached.
+    """
+
+    def __init__(self, cache, obj, offset, start=None, end=None):
+        self.cache = cache
+        self.obj = obj
+        self.position = offset
+        self.start = offset if start is None else start
+        self.end = obj.total - 1 if end is None else end
+        self._first_segment = -(-offset // cache.segment_size)
+        self._marked = self._first_segment
+        try:
+            self._fd = os.open(obj.path, os.O_WRONLY)
+        except OSError:
+            # evicted meanwhile: keep relaying without caching
+            self._fd = None
+
+    def feed(self, chunk):
+        position = self.position
+        if self._fd is not None and chunk:
+            try:
+                os.pwrite(self._fd, chunk, position)
+            except OSError as err:
+                logger.warning(f"Segment cache write failed: {err}")
+                self.close()
+        self.position = position + len(chunk)
+        self._mark()
+        lo = max(self.start - position, 0)
+        hi = min(self.end + 1 - position, len(chunk))
+        if lo == 0 and hi == len(chunk):
+            return chunk
+        return chunk[lo:hi] if lo < hi else b""
+
+    def _mark(self):
+        if self._fd is None:
+            return
+        size = self.cache.segment_size
+        done = self.position // size
+        if self.position >= self.obj.total:
+            done = self.cache._segment_count(self.obj)
+        if done > self._marked:
+            self.cache._mark(self.obj, range(self._marked, done))
+            self._marked = done
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -1,10 +1,186 @@
 """This code is to use the BunnyCDN Storage API"""
 
 import os
-import requests
+import json
+import asyncio
+import hashlib
+import tempfile
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
+import aiohttp
+import upstream
+from cache import Cache
 from requests.exceptions import HTTPError
 from urllib import parse
 
+# Overrides the regional storage endpoint (e.g. a local stand-in for tests)
+STORAGE_BASE_URL = os.getenv("BUNNY_STORAGE_BASE_URL")
+# Concurrent uploads in Storage.PutFiles
+UPLOAD_WORKERS = int(os.getenv("STORAGE_UPLOAD_WORKERS", 4))
+# Listados de directorios: frescos por STORAGE_LIST_TTL segundos, luego servidos
+# mientras se reconcilian con Bunny en segundo plano
+STORAGE_LIST_TTL = float(os.getenv("STORAGE_LIST_TTL", 300))
+STORAGE_LIST_STALE_TTL = float(os.getenv("STORAGE_LIST_STALE_TTL", 3600))
+STORAGE_LIST_MAX_BYTES = int(os.getenv("STORAGE_LIST_MAX_BYTES", 8 * 1024 * 1024))
+# Marcas de escritura por show, compartidas por los workers: una subida o borrado en un
+# worker descarta los listados de ese show guardados por los demas
+STORAGE_LIST_MARKERS_DIR = os.getenv(
+    "STORAGE_LIST_MARKERS_DIR", os.path.join(tempfile.gettempdir(), "tnoradio-storage-listings")
+)
+# Directorios listados en paralelo por el listado recursivo
+STORAGE_TREE_WORKERS = int(os.getenv("STORAGE_TREE_WORKERS", 8))
+# Descargas: tamaño de buffer y archivos descargados en paralelo por Storage.MirrorTree
+STORAGE_DOWNLOAD_CHUNK = int(os.getenv("STORAGE_DOWNLOAD_CHUNK", 1024 * 1024))
+STORAGE_MIRROR_WORKERS = int(os.getenv("STORAGE_MIRROR_WORKERS", 8))
+
+# Raw directory listings of Bunny, keyed by ("storage", base_url, directory)
+listing_cache = Cache(max_bytes=STORAGE_LIST_MAX_BYTES)
+_listing_lock = threading.Lock()
+_listing_writes = {}
+# base_url -> write marker of the show the cached listings of this process reflect
+_markers_seen = {}
+
+
+def FileChecksum(path, chunk_size=1024 * 1024):
+    """SHA256 of a local file as the uppercase hex digest expected by the Checksum header"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest().upper()
+
+
+def _preallocate(file, length):
+    """Reserves length bytes for a file about to be written, so it is laid out in one go"""
+    if not length:
+        return
+    try:
+        os.posix_fallocate(file.fileno(), 0, length)
+    except (AttributeError, OSError):
+        # not supported by the platform or the filesystem
+        pass
+
+
+def _local_copy_matches(local_path, length, checksum=None):
+    """Whether a local file has the size (and, when known, the SHA256) of a storage object"""
+    try:
+        if os.path.getsize(local_path) != length:
+            return False
+    except OSError:
+        return False
+    return not checksum or FileChecksum(local_path) == checksum.upper()
+
+
+def _split_path(storage_path):
+    """(directory, name) of a storage path, the directory without leading or trailing slashes"""
+    directory, _, name = storage_path.strip("/").rpartition("/")
+    return directory, name
+
+
+def _listing_key(base_url, directory):
+    return ("storage", base_url, directory)
+
+
+def _listing_generation(key):
+    """
+    Writes through to a listing in this process, and the show's write marker
+    seen, so a load that raced with a write (in any worker) is not cached
+    """
+    with _listing_lock:
+        return _listing_writes.get(key, 0), _markers_seen.get(key[1])
+
+
+def _marker_path(base_url):
+    return os.path.join(STORAGE_LIST_MARKERS_DIR, hashlib.blake2b(base_url.encode(), digest_size=16).hexdigest())
+
+
+def _read_marker(base_url):
+    try:
+        with open(_marker_path(base_url)) as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def _mark_written(base_url):
+    """
+    Replaces the show's write marker on disk, after this process wrote
+    through to its cached listings, so the other workers drop theirs
+    """
+    marker = uuid.uuid4().hex
+    os.makedirs(STORAGE_LIST_MARKERS_DIR, exist_ok=True)
+    partial_path = f"{_marker_path(base_url)}.{marker}.part"
+    with open(partial_path, "w") as file:
+        file.write(marker)
+    os.replace(partial_path, _marker_path(base_url))
+    with _listing_lock:
+        _markers_seen[base_url] = marker
+
+
+def _revalidate_listings(base_url):
+    """Drops the cached listings of a show when another worker wrote to it since they were cached"""
+    marker = _read_marker(base_url)
+    with _listing_lock:
+        if base_url in _markers_seen and _markers_seen[base_url] == marker:
+            return
+        _markers_seen[base_url] = marker
+        listing_cache.invalidate_matching(lambda key: key[:2] == ("storage", base_url))
+
+
+def _update_listing(key, update):
+    """
+    Write-through of an upload or delete to a cached listing: stores
+    update(objects) unless it returns None.
+    """
+    with _listing_lock:
+        _listing_writes[key] = _listing_writes.get(key, 0) + 1
+        objects = listing_cache.peek(key)
+        if objects is None:
+            return
+        objects = update(objects)
+        if objects is not None:
+            listing_cache.set(key, objects, STORAGE_LIST_TTL, STORAGE_LIST_STALE_TTL)
+
+
+def _without(objects, name):
+    return [obj for obj in objects if obj.get("ObjectName") != name]
+
+
+def _last_changed():
+    """Current time in the format of Bunny's LastChanged"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+
+
+class _UploadManifest:
+    """Resume manifest of Storage.PutFiles: {storage_path: checksum} saved as JSON after every upload"""
+
+    def __init__(self, path, base_url):
+        self.path = path
+        self.base_url = base_url
+        self.files = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as file:
+                data = json.load(file)
+            # a manifest written for another storage zone/show is not reused
+            if data.get("base_url") == base_url:
+                self.files = data.get("files", {})
+
+    def get(self, storage_path):
+        with self._lock:
+            return self.files.get(storage_path)
+
+    def set(self, storage_path, checksum):
+        with self._lock:
+            self.files[storage_path] = checksum
+            if self.path:
+                temp_path = self.path + ".tmp"
+                with open(temp_path, "w") as file:
+                    json.dump({"base_url": self.base_url, "files": self.files}, file)
+                os.replace(temp_path, self.path)
+
 class Storage:
 
     # initializer for storage account
@@ -37,7 +213,9 @@ class Storage:
         assert storage_zone != "", "storage_zone is not specified/missing"
 
         # For generating base_url for sending requests
-        if storage_zone_region == "de" or storage_zone_region == "":
+        if STORAGE_BASE_URL:
+            self.base_url = STORAGE_BASE_URL + "/" + storage_zone + "/" + show_slug + "/"
+        elif storage_zone_region == "de" or storage_zone_region == "":
             self.base_url = "https://storage.bunnycdn.com/" + storage_zone + "/" + show_slug + "/"
         else:
             self.base_url = (
@@ -78,7 +256,7 @@ class Storage:
 
         # to return appropriate help messages if file is present or not and download file if present
         try:
-            response = requests.get(url, headers=self.headers, stream=True)
+            response = upstream.get(url, headers=self.headers, stream=True)
             response.raise_for_status()
         except HTTPError as http:
             return {
@@ -95,22 +273,92 @@ class Storage:
         else:
             download_path = os.path.join(download_path, file_name)
             # Downloading file
-            with open(download_path, "wb") as file:
+            self._WriteDownload(response, download_path)
+            return {
+                "status": "success",
+                "HTTP": response.status_code,
+                "msg": "File downloaded Successfully",
+            }
 
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        file.write(chunk)
-                return {
-                    "status": "success",
-                    "HTTP": response.status_code,
-                    "msg": "File downloaded Successfully",
-                }
+    def MirrorTree(self, download_path, storage_path=None, workers=STORAGE_MIRROR_WORKERS):
+        """
+        This function copies every file under storage_path, at any depth, into
+        download_path, keeping the folder structure, with several downloads
+        in flight. Files whose local copy already has the size (and the
+        SHA256, when Bunny.net lists it) of the stored object are not
+        downloaded again, so running it again only fetches what changed.
+        Parameters
+        ----------
+        download_path : String
+                        Local directory that mirrors storage_path
+        storage_path  : String (optional)
+                        The directory to mirror (the whole show by default)
+        workers       : Int
+                        Maximum number of downloads in flight
+        Returns a dict of {path: result} for every file, with paths relative to
+        storage_path and the usual result dicts; skipped files have status
+        "skipped". A failed listing returns its error dict instead.
+        """
+        root = (storage_path or "").strip("/")
+        tree = self.GetStoragedObjectsTree(root)
+        if isinstance(tree, dict):
+            return tree
+        results = {}
+
+        def download(entry):
+            local_path = os.path.join(download_path, *entry["Path"].split("/"))
+            if _local_copy_matches(local_path, entry["Length"], entry.get("Checksum")):
+                return {"status": "skipped", "HTTP": None, "msg": "Already downloaded"}
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            response = upstream.get(self._UploadUrl(f"{root}/{entry['Path']}"), headers=self.headers, stream=True)
+            try:
+                response.raise_for_status()
+                self._WriteDownload(response, local_path, entry["Length"])
+            finally:
+                response.close()
+            return {"status": "success", "HTTP": response.status_code, "msg": "File downloaded Successfully"}
+
+        files = [entry for entry in tree if "File_Name" in entry]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(download, entry): entry["Path"] for entry in files}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    results[path] = future.result()
+                except HTTPError as http:
+                    results[path] = {"status": "error", "HTTP": http.response.status_code, "msg": f"Http error occured {http}"}
+                except Exception as err:
+                    results[path] = {"status": "error", "HTTP": None, "msg": f"Download failed: {err}"}
+        return results
+
+    @staticmethod
+    def _WriteDownload(response, local_path, length=None):
+        """
+        Writes a streamed response to local_path in large chunks, through a
+        preallocated temporary file that replaces local_path once complete.
+        """
+        if length is None and response.headers.get("Content-Length", "").isdigit():
+            length = int(response.headers["Content-Length"])
+        temp_path = local_path + ".part"
+        try:
+            with open(temp_path, "wb") as file:
+                _preallocate(file, length)
+                for chunk in response.iter_content(chunk_size=STORAGE_DOWNLOAD_CHUNK):
+                    file.write(chunk)
+                # in case less than the preallocated length arrived
+                file.truncate()
+            os.replace(temp_path, local_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
 
     def PutFile(
         self,
         file_name,
         storage_path=None,
         local_upload_file_path=os.getcwd(),
+        checksum=False,
     ):
 
         """
@@ -132,21 +380,143 @@ class Storage:
         local_upload_file_path      : 'C:\\User\\Sample_Directory'
         storage_path                : '<Directory name in storage zone>/<file name as to be uploaded on storage zone>.txt'
                                         #Here .txt because the file being uploaded in example is txt
+        checksum                    : Bool or String (optional)
+                                      True to send the SHA256 of the file in the Checksum header,
+                                      or the hex digest itself if already known. Bunny.net rejects
+                                      the upload if the content it received does not match.
         """
         local_upload_file_path = os.path.join(local_upload_file_path, file_name)
 
-        # to build correct url
-        if storage_path is not None and storage_path != "":
-            if storage_path[0] == "/":
-                storage_path = storage_path[1:]
-            if storage_path[-1] == "/":
-                storage_path = storage_path[:-1]
-            url = self.base_url + parse.quote(storage_path)
-        else:
-            url = self.base_url + parse.quote(file_name)
+        url = self._UploadUrl(storage_path, file_name)
+        headers = self.headers
+        if checksum:
+            if checksum is True:
+                checksum = FileChecksum(local_upload_file_path)
+            headers = dict(self.headers, Checksum=checksum.upper())
+        # the file object is streamed (and rewound on retries), never read whole into memory
         with open(local_upload_file_path, "rb") as file:
-            file_data = file.read()
-        response = requests.put(url, data=file_data, headers=self.headers)
+            response = upstream.put(url, data=file, headers=headers)
+        result = self._UploadResult(response)
+        if result["status"] == "success":
+            self._Uploaded(storage_path or file_name, os.path.getsize(local_upload_file_path))
+        return result
+
+    def PutFiles(self, files, workers=UPLOAD_WORKERS, manifest_path=None):
+        """
+        This function uploads many local files concurrently, each one with its
+        SHA256 in the Checksum header, and can resume an interrupted batch.
+        Bunny.net storage only takes whole-object PUTs, so the unit of work
+        that is retried and resumed is a file.
+        Parameters
+        ----------
+        files         : List of (local_path, storage_path) tuples
+        workers       : Int
+                        Maximum number of uploads in flight
+        manifest_path : String (optional)
+                        JSON file recording the checksum of every file already
+                        uploaded. When the batch is run again, files whose
+                        checksum matches their manifest entry are not re-sent.
+        Returns a dict of {storage_path: result} with the usual result dicts;
+        skipped files have status "skipped".
+        """
+        manifest = _UploadManifest(manifest_path, self.base_url)
+        results = {}
+
+        def upload(local_path, storage_path):
+            checksum = FileChecksum(local_path)
+            if manifest.get(storage_path) == checksum:
+                return {"status": "skipped", "HTTP": None, "msg": "Already uploaded"}
+            folder, file_name = os.path.split(local_path)
+            result = self.PutFile(file_name, storage_path, folder or os.getcwd(), checksum=checksum)
+            if result["status"] == "success":
+                manifest.set(storage_path, checksum)
+            return result
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(upload, local_path, storage_path): storage_path
+                for local_path, storage_path in files
+            }
+            for future in as_completed(futures):
+                storage_path = futures[future]
+                try:
+                    results[storage_path] = future.result()
+                except Exception as err:
+                    results[storage_path] = {"status": "error", "HTTP": None, "msg": f"Upload failed: {err}"}
+        return results
+
+    def PutStream(self, data, storage_path):
+        """
+        This function uploads content that is produced while it is sent,
+        e.g. the body of an incoming upload, without buffering it.
+        The content is sent with chunked transfer encoding.
+        Parameters
+        ----------
+        data            : Iterable of bytes
+                          The content of the file, chunk by chunk
+        storage_path    : String
+                          The path of the file in the storage zone
+                          (including file name and excluding storage zone name)
+        """
+        url = self._UploadUrl(storage_path)
+        sent = [0]
+
+        def counted():
+            for chunk in data:
+                sent[0] += len(chunk)
+                yield chunk
+
+        # a generator can't be replayed, so this upload is never retried
+        response = upstream.put(url, data=counted(), headers=self.headers, retry=False)
+        result = self._UploadResult(response)
+        if result["status"] == "success":
+            self._Uploaded(storage_path, sent[0])
+        return result
+
+    def PutFileObject(self, file, storage_path, checksum=None):
+        """
+        This function uploads an open, seekable file object (e.g. a spooled upload)
+        from its current position; like PutFile, it is retried from that position.
+        Parameters
+        ----------
+        file         : File object
+        storage_path : String
+                       The path of the file in the storage zone
+                       (including file name and excluding storage zone name)
+        checksum     : String (optional)
+                       SHA256 hex digest of the content for the Checksum header
+        """
+        start = file.tell()
+        length = file.seek(0, os.SEEK_END) - start
+        file.seek(start)
+        headers = dict(self.headers, Checksum=checksum.upper()) if checksum else self.headers
+        response = upstream.put(self._UploadUrl(storage_path), data=file, headers=headers)
+        result = self._UploadResult(response)
+        if result["status"] == "success":
+            self._Uploaded(storage_path, length)
+        return result
+
+    def DeleteFiles(self, storage_paths, workers=UPLOAD_WORKERS):
+        """
+        This function deletes many files or folders concurrently.
+        Parameters
+        ----------
+        storage_paths : Iterable of String
+                        Paths as taken by DeleteFile
+        workers       : Int
+                        Maximum number of deletes in flight
+        Yields (storage_path, result) as each delete finishes, in that order.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.DeleteFile, storage_path): storage_path for storage_path in storage_paths}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as err:
+                    result = {"status": "error", "HTTP": None, "msg": f"Object Delete failed ,Error occured:{err}"}
+                yield futures[future], result
+
+    def _UploadResult(self, response):
         try:
             response.raise_for_status()
         except HTTPError as http:
@@ -180,12 +550,13 @@ class Storage:
         url = self.base_url + parse.quote(storage_path)
 
         try:
-            response = requests.delete(url, headers=self.headers)
-            response.raise_for_status
+            response = upstream.delete(url, headers=self.headers)
+            response.raise_for_status()
+            self._Deleted(storage_path)
         except HTTPError as http:
             return {
                 "status": "error",
-                "HTTP": response.raise_for_status(),
+                "HTTP": http.response.status_code,
                 "msg": f"HTTP Error occured: {http}",
             }
         except Exception as err:
@@ -208,32 +579,320 @@ class Storage:
         ----------
         storage_path : The directory path that you want to list.
         """
+        # Answered from the listing cache
+        try:
+            objects = self._Listing(storage_path)
+        except HTTPError as http:
+            return {
+                "status": "error",
+                "HTTP": http.response.status_code,
+                "msg": f"http error occured {http}",
+            }
+        else:
+            return self._ToStorageList(objects)
+
+    def GetStoragedObjectsTree(self, storage_path=None, workers=STORAGE_TREE_WORKERS):
+        """
+        This function returns every file and folder under storage_path, at any depth,
+        as one flat list sorted by path.
+        Parameters
+        ----------
+        storage_path : The directory path that you want to list.
+        workers      : Int
+                       Maximum number of directories listed at the same time
+        Every entry has its "Path" relative to storage_path, "File_Name" or
+        "Folder_Name", and the "Length" and "LastChanged" of the object, plus
+        the "Checksum" (SHA256) of files when Bunny.net lists it.
+        """
+        root = (storage_path or "").strip("/")
+        tree = []
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = {pool.submit(self._Listing, root): ""}
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for path, obj in self._TreeEntries(pending.pop(future), future.result(), tree):
+                            pending[pool.submit(self._Listing, f"{root}/{path}".strip("/"))] = path
+        except HTTPError as http:
+            return {
+                "status": "error",
+                "HTTP": http.response.status_code,
+                "msg": f"http error occured {http}",
+            }
+        tree.sort(key=lambda entry: entry["Path"])
+        return tree
+
+    def ListingValidators(self, storage_path=None, tree=None):
+        """
+        (digest, changed_at) of the cached listing of storage_path, and of every
+        folder of tree when it is GetStoragedObjectsTree(storage_path); None for
+        listings that are not cached (see Cache.validator).
+        """
+        root = (storage_path or "").strip("/")
+        directories = [root] + [f"{root}/{entry['Path']}".strip("/") for entry in tree or () if "Folder_Name" in entry]
+        return [listing_cache.validator(_listing_key(self.base_url, directory)) for directory in directories]
+
+    def _Listing(self, storage_path=None):
+        """Raw objects of a directory: cached, and reconciled with Bunny in the background once stale"""
+        directory = (storage_path or "").strip("/")
+        key = _listing_key(self.base_url, directory)
+        _revalidate_listings(self.base_url)
+        generation = _listing_generation(key)
+
+        def load():
+            response = upstream.get(self._DirectoryUrl(directory), headers=self.headers)
+            response.raise_for_status()
+            return response.json()
+
+        return listing_cache.get_or_load(
+            key, load, ttl=STORAGE_LIST_TTL, stale_ttl=STORAGE_LIST_STALE_TTL,
+            cacheable=lambda objects: _listing_generation(key) == generation,
+        )
+
+    def _Uploaded(self, storage_path, length):
+        """Adds an uploaded file, and the folders it may have created, to the cached listings"""
+        # what another worker wrote meanwhile is not in them
+        _revalidate_listings(self.base_url)
+        directory, name = _split_path(storage_path)
+        obj = {"ObjectName": name, "IsDirectory": False, "Length": length, "LastChanged": _last_changed()}
+        _update_listing(_listing_key(self.base_url, directory), lambda objects: _without(objects, name) + [obj])
+        while directory:
+            directory, folder = _split_path(directory)
+            _update_listing(
+                _listing_key(self.base_url, directory),
+                lambda objects: None if any(existing.get("ObjectName") == folder for existing in objects)
+                else objects + [{"ObjectName": folder, "IsDirectory": True, "Length": 0, "LastChanged": obj["LastChanged"]}],
+            )
+        _mark_written(self.base_url)
+
+    def _Deleted(self, storage_path):
+        """Removes a deleted file or folder (with everything cached under it) from the cached listings"""
+        _revalidate_listings(self.base_url)
+        directory, name = _split_path(storage_path)
+        _update_listing(_listing_key(self.base_url, directory), lambda objects: _without(objects, name))
+        path = storage_path.strip("/")
+        listing_cache.invalidate_matching(
+            lambda key: key[:2] == ("storage", self.base_url) and (key[2] == path or key[2].startswith(path + "/"))
+        )
+        _mark_written(self.base_url)
+
+    @staticmethod
+    def _TreeEntries(relative, objects, tree):
+        """Appends the objects of the directory at relative to tree; returns the (path, obj) of its folders"""
+        folders = []
+        for obj in objects:
+            path = f"{relative}/{obj['ObjectName']}" if relative else obj["ObjectName"]
+            entry = {"Path": path, **Storage._ToStorageEntry(obj)}
+            entry["Length"] = obj.get("Length")
+            entry["LastChanged"] = obj.get("LastChanged")
+            if obj.get("Checksum"):
+                entry["Checksum"] = obj["Checksum"]
+            tree.append(entry)
+            if obj["IsDirectory"]:
+                folders.append((path, obj))
+        return folders
+
+    def _UploadUrl(self, storage_path, file_name=None):
         # to build correct url
-        if storage_path is not None:
+        if storage_path is not None and storage_path != "":
             if storage_path[0] == "/":
                 storage_path = storage_path[1:]
-            if storage_path[-1] != "/":
-                url = self.base_url + parse.quote(storage_path) + "/"
+            if storage_path[-1] == "/":
+                storage_path = storage_path[:-1]
+            return self.base_url + parse.quote(storage_path)
+        return self.base_url + parse.quote(file_name)
+
+    def _DirectoryUrl(self, storage_path=None):
+        # to build correct url
+        if storage_path:
+            storage_path = storage_path.strip("/")
+        if not storage_path:
+            return self.base_url
+        return self.base_url + parse.quote(storage_path) + "/"
+
+    @staticmethod
+    def _ToStorageEntry(obj):
+        if obj["IsDirectory"]:
+            return {"Folder_Name": obj["ObjectName"]}
+        return {"File_Name": obj["ObjectName"]}
+
+    @staticmethod
+    def _ToStorageList(objects):
+        return [Storage._ToStorageEntry(obj) for obj in objects]
+
+
+class AsyncStorage(Storage):
+    """
+    Storage client for the ASGI app: the same storage zone URLs and result
+    dicts, with the upstream calls awaited on the shared async client.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # aiohttp rejects None header values (requests drops them)
+        self.headers = {key: value for key, value in self.headers.items() if value is not None}
+
+    async def PutFile(
+        self,
+        file_name,
+        storage_path=None,
+        local_upload_file_path=os.getcwd(),
+    ):
+        local_upload_file_path = os.path.join(local_upload_file_path, file_name)
+        url = self._UploadUrl(storage_path, file_name)
+        return await self._APut(url, _aread_file(local_upload_file_path), storage_path or file_name)
+
+    async def PutStream(self, data, storage_path):
+        """Async counterpart of Storage.PutStream: data is an async iterable of bytes"""
+        return await self._APut(self._UploadUrl(storage_path), data, storage_path)
+
+    async def PutFileObject(self, file, storage_path):
+        """Async counterpart of Storage.PutFileObject (not retried: the body is streamed)"""
+        return await self._APut(self._UploadUrl(storage_path), _aread(file), storage_path)
+
+    async def DeleteFiles(self, storage_paths, workers=UPLOAD_WORKERS):
+        """Async counterpart of Storage.DeleteFiles: an async generator of (storage_path, result)"""
+        limit = asyncio.Semaphore(workers)
+
+        async def delete(storage_path):
+            async with limit:
+                try:
+                    return storage_path, await self.DeleteFile(storage_path)
+                except Exception as err:
+                    return storage_path, {"status": "error", "HTTP": None, "msg": f"Object Delete failed ,Error occured:{err}"}
+
+        for done in asyncio.as_completed([delete(storage_path) for storage_path in storage_paths]):
+            yield await done
+
+    async def _APut(self, url, data, storage_path):
+        sent = [0]
+
+        async def counted():
+            async for chunk in data:
+                sent[0] += len(chunk)
+                yield chunk
+
+        try:
+            # streamed bodies can't be replayed, so uploads are never retried
+            response = await upstream.aput(url, data=counted(), headers=self.headers, max_retries=0)
+            response.raise_for_status()
+        except aiohttp.ClientResponseError as http:
+            return {
+                "status": "error",
+                "HTTP": http.status,
+                "msg": f"Upload Failed HTTP Error Occured: {http}",
+            }
         else:
-            url = self.base_url
-        # Sending GET request
+            self._Uploaded(storage_path, sent[0])
+            return {
+                "status": "success",
+                "HTTP": response.status,
+                "msg": "The File Upload was Successful",
+            }
+
+    async def DeleteFile(self, storage_path=""):
+        assert (
+            storage_path != ""
+        ), "storage_path must be specified"  # to make sure storage_path is not null
+        # to build correct url
+        if storage_path[0] == "/":
+            storage_path = storage_path[1:]
+        url = self.base_url + parse.quote(storage_path)
+
         try:
-            response = requests.get(url, headers=self.headers)
+            response = await upstream.adelete(url, headers=self.headers)
             response.raise_for_status()
-        except HTTPError as http:
+            self._Deleted(storage_path)
+        except aiohttp.ClientResponseError as http:
             return {
                 "status": "error",
-                "HTTP": response.status_code,
-                "msg": "http error occured {http}",
+                "HTTP": http.status,
+                "msg": f"HTTP Error occured: {http}",
+            }
+        except Exception as err:
+            return {
+                "status": "error",
+                "HTTP": None,
+                "msg": f"Object Delete failed ,Error occured:{err}",
             }
         else:
-            storage_list = []
-            for dictionary in response.json():
-                temp_dict = {}
-                for key in dictionary:
-                    if key == "ObjectName" and dictionary["IsDirectory"] is False:
-                        temp_dict["File_Name"] = dictionary[key]
-                    if key == "ObjectName" and dictionary["IsDirectory"]:
-                        temp_dict["Folder_Name"] = dictionary[key]
-                storage_list.append(temp_dict)
-            return storage_list
\ No newline at end of file
+            return {
+                "status": "success",
+                "HTTP": response.status,
+                "msg": "Object Successfully Deleted",
+            }
+
+    async def GetStoragedObjectsList(self, storage_path=None):
+        try:
+            objects = await self._Listing(storage_path)
+        except aiohttp.ClientResponseError as http:
+            return {
+                "status": "error",
+                "HTTP": http.status,
+                "msg": f"http error occured {http}",
+            }
+        else:
+            return self._ToStorageList(objects)
+
+    async def GetStoragedObjectsTree(self, storage_path=None, workers=STORAGE_TREE_WORKERS):
+        """Async counterpart of Storage.GetStoragedObjectsTree: each level's folders are listed concurrently"""
+        root = (storage_path or "").strip("/")
+        limit = asyncio.Semaphore(workers)
+        tree = []
+
+        async def listing(path):
+            async with limit:
+                return await self._Listing(f"{root}/{path}".strip("/"))
+
+        try:
+            folders = [("", None)]
+            while folders:
+                listings = await asyncio.gather(*(listing(path) for path, _ in folders))
+                found = []
+                for (path, _), objects in zip(folders, listings):
+                    found.extend(self._TreeEntries(path, objects, tree))
+                folders = found
+        except aiohttp.ClientResponseError as http:
+            return {
+                "status": "error",
+                "HTTP": http.status,
+                "msg": f"http error occured {http}",
+            }
+        tree.sort(key=lambda entry: entry["Path"])
+        return tree
+
+    async def _Listing(self, storage_path=None):
+        directory = (storage_path or "").strip("/")
+        key = _listing_key(self.base_url, directory)
+        _revalidate_listings(self.base_url)
+        generation = _listing_generation(key)
+
+        async def load():
+            response = await upstream.aget(self._DirectoryUrl(directory), headers=self.headers)
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+        return await listing_cache.aget_or_load(
+            key, load, ttl=STORAGE_LIST_TTL, stale_ttl=STORAGE_LIST_STALE_TTL,
+            cacheable=lambda objects: _listing_generation(key) == generation,
+        )
+
+
+async def _aread(file, chunk_size=256 * 1024):
+    """Reads an open file chunk by chunk without blocking the event loop"""
+    while True:
+        chunk = await asyncio.to_thread(file.read, chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _aread_file(path, chunk_size=256 * 1024):
+    """Reads a local file chunk by chunk without blocking the event loop"""
+    file = await asyncio.to_thread(open, path, "rb")
+    try:
+        async for chunk in _aread(file, chunk_size):
+            yield chunk
+    finally:
+        file.close()
\ No newline at end of file
@@ -2,9 +2,19 @@
 
 import os
 import json
-from flask import jsonify
-import requests
-from requests.exceptions import HTTPError, RequestException
+import time
+import asyncio
+import aiohttp
+import threading
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import upstream
+from cache import Cache
+from projection import project
+from search import SearchIndex
+from requests.exceptions import RequestException
 from urllib import parse
 from dotenv import load_dotenv
 
@@ -12,10 +22,365 @@ from dotenv import load_dotenv
 load_dotenv()
 
 API_KEY = os.getenv('BUNNY_API_KEY') 
+VIDEO_HOST = os.getenv('BUNNY_VIDEO_HOST', "https://video.bunnycdn.com")
+BASE_URL = f"{VIDEO_HOST}/library"
+
+# Cache de listados de Bunny Stream (TTL por endpoint, en segundos)
+LIBRARY_TTL = float(os.getenv('STREAM_LIBRARY_TTL', 300))
+COLLECTIONS_TTL = float(os.getenv('STREAM_COLLECTIONS_TTL', 300))
+VIDEOS_TTL = float(os.getenv('STREAM_VIDEOS_TTL', 120))
+STALE_TTL = float(os.getenv('STREAM_STALE_TTL', 3600))
+CACHE_MAX_BYTES = int(os.getenv('STREAM_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Paginacion de /library/{id}/videos
+VIDEOS_PAGE_SIZE = int(os.getenv('STREAM_VIDEOS_PAGE_SIZE', 100))
+VIDEOS_PAGE_WORKERS = int(os.getenv('STREAM_VIDEOS_PAGE_WORKERS', 4))
+
+# Indice de videos por guid: existencia y resoluciones sin ir a Bunny
+VIDEO_INDEX_TTL = float(os.getenv('STREAM_VIDEO_INDEX_TTL', 600))
+VIDEO_INDEX_MISSING_TTL = float(os.getenv('STREAM_VIDEO_INDEX_MISSING_TTL', 30))
+VIDEO_INDEX_MAX_BYTES = int(os.getenv('STREAM_VIDEO_INDEX_MAX_BYTES', 8 * 1024 * 1024))
+
+# Indice de busqueda por titulo: segundos entre relecturas completas del listado, y resultados por pagina
+TITLE_INDEX_TTL = float(os.getenv('STREAM_TITLE_INDEX_TTL', 600))
+TITLE_SEARCH_MAX_PER_PAGE = int(os.getenv('STREAM_TITLE_SEARCH_MAX_PER_PAGE', 100))
+
+# Listados proyectados a pocos campos (fields= / view=), por contenido del listado completo
+PROJECTION_MAX_BYTES = int(os.getenv('STREAM_PROJECTION_MAX_BYTES', 8 * 1024 * 1024))
+
+# Named field sets of /get_videos and /get_stream_collections (view=)
+VIDEO_VIEWS = {
+    "compact": ("guid", "title", "dateUploaded", "length", "collectionId", "thumbnailFileName"),
+    "player": ("guid", "title", "length", "width", "height", "availableResolutions", "thumbnailFileName"),
+}
+COLLECTION_VIEWS = {
+    "compact": ("guid", "name", "videoCount", "previewImageUrls"),
+}
+
+
+
+def _project_views(key, listing):
+    """
+    Projects a listing to its named views as it is stored in the cache, and
+    drops the projections of the content it replaced (or of the listing,
+    when it is dropped)
+    """
+    views = {"videos": VIDEO_VIEWS, "collections": COLLECTION_VIEWS}.get(key[0])
+    if views is None:
+        return
+    validator = cache.validator(key, listing) if listing is not None else None
+    digest = validator[0] if validator else None
+    projections.invalidate_matching(lambda projected: projected[0] == key and projected[1] != digest)
+    if digest is not None and _cacheable(listing):
+        for fields in views.values():
+            projections.set((key, digest, fields), project(listing, fields), ttl=STALE_TTL)
+
+
+cache = Cache(max_bytes=CACHE_MAX_BYTES, on_change=_project_views)
+video_index = Cache(max_bytes=VIDEO_INDEX_MAX_BYTES)
+# Rows keyed by (listing key, listing digest, fields), only for the content cached now:
+# the named views are built as a listing is stored, other field sets on first use
+projections = Cache(max_bytes=PROJECTION_MAX_BYTES, sizeof=lambda rows: rows.size)
+
+
+def video_library_id():
+    return os.environ.get("BUNNY_VIDEO_LIBRARY_ID", "286671")
+
+
+def video_headers(api_key):
+    return {
+        'AccessKey': api_key,
+        'Content-Type': 'application/json'
+    }
+
+
+def video_info_url(guid):
+    return f"{BASE_URL}/{video_library_id()}/videos/{guid}"
+
+
+def play_url(guid, resolution="720p"):
+    return f"{VIDEO_HOST}/stream/{video_library_id()}/{guid}/play_{resolution}.mp4"
+
+
+def hls_url(guid):
+    return f"{VIDEO_HOST}/stream/{video_library_id()}/{guid}/playlist.m3u8"
+
+
+def thumbnail_url(guid):
+    return f"{VIDEO_HOST}/stream/{video_library_id()}/{guid}/thumbnail.jpg"
+
+
+# Cabeceras que el proxy de video reenvia en cada sentido
+PROXY_REQUEST_HEADERS = ("Range", "If-Range")
+PROXY_RESPONSE_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "ETag", "Last-Modified")
+RELAY_MIN_CHUNK = 64 * 1024
+RELAY_MAX_CHUNK = 1024 * 1024
+
+
+def proxy_request_headers(api_key, client_headers):
+    """Upstream headers for a proxied video request: auth plus the client's Range/If-Range"""
+    headers = video_headers(api_key)
+    for name in PROXY_REQUEST_HEADERS:
+        value = client_headers.get(name)
+        if value:
+            headers[name] = value
+    return headers
+
+
+def proxy_response_headers(upstream_headers):
+    """Client headers for a proxied video response, taken from the upstream response"""
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'public, max-age=3600'
+    }
+    for name in PROXY_RESPONSE_HEADERS:
+        value = upstream_headers.get(name)
+        if value:
+            headers[name] = value
+    headers.setdefault('Content-Type', 'video/mp4')
+    return headers
+
+
+def relay_chunk_size(content_length):
+    """Bigger reads for bigger bodies: ~1/64 of the body, between 64 KiB and 1 MiB"""
+    try:
+        size = int(content_length) // 64
+    except (TypeError, ValueError):
+        return RELAY_MIN_CHUNK
+    return max(RELAY_MIN_CHUNK, min(RELAY_MAX_CHUNK, size))
+
+
+def _index_entry(video):
+    return {"guid": video.get("guid"), "availableResolutions": video.get("availableResolutions") or ""}
+
+
+def index_videos(items):
+    """Records the videos of a listing page in the guid index"""
+    for video in items:
+        guid = video.get("guid")
+        if guid:
+            video_index.set(guid, _index_entry(video), VIDEO_INDEX_TTL)
+
+
+def available_resolutions(video):
+    return [resolution for resolution in video.get("availableResolutions", "").split(",") if resolution]
+
+
+def has_resolution(video, resolution):
+    """False only when Bunny lists the video's renditions and resolution is not among them"""
+    resolutions = available_resolutions(video)
+    return not resolutions or resolution in resolutions
+
+
+def video_url(guid, resolution="720p", format_type="mp4"):
+    """URL handed out by /get_video_stream: the HLS playlist or the MP4 of a resolution"""
+    if format_type == 'hls':
+        return hls_url(guid)
+    return play_url(guid, resolution)
+
+
+def video_problem(video, resolution=None):
+    """(error payload, status) when a guid index entry rules a request out, otherwise None"""
+    if not video:
+        return {"error": "Failed to get video info"}, 500
+    if resolution and not has_resolution(video, resolution):
+        return {
+            "error": f"Resolution {resolution} not available",
+            "availableResolutions": available_resolutions(video),
+        }, 400
+    return None
+
+
+def _video_found(guid, status, video):
+    if status in (400, 404):
+        # remembered for a short while, so unknown guids don't go upstream on every request
+        video_index.set(guid, {}, VIDEO_INDEX_MISSING_TTL)
+        return {}
+    return _index_entry(video)
+
+
+def get_video(guid, api_key):
+    """
+    Guid index entry of a video, or {} if it does not exist. Videos seen in a
+    listing are answered from memory; other guids cost one upstream lookup,
+    shared by concurrent requests.
+    """
+    def load():
+        response = upstream.get(video_info_url(guid), headers=video_headers(api_key))
+        if response.status_code not in (400, 404):
+            response.raise_for_status()
+        return _video_found(guid, response.status_code, response.json() if response.ok else None)
+
+    return video_index.get_or_load(guid, load, ttl=VIDEO_INDEX_TTL, cacheable=bool)
+
+
+async def aget_video(guid, api_key):
+    """Async counterpart of get_video() for the ASGI app"""
+    async def load():
+        response = await upstream.aget(video_info_url(guid), headers=video_headers(api_key))
+        if response.status not in (400, 404):
+            response.raise_for_status()
+        return _video_found(guid, response.status, await response.json(content_type=None) if response.ok else None)
+
+    return await video_index.aget_or_load(guid, load, ttl=VIDEO_INDEX_TTL, cacheable=bool)
+
+
+def _recency(video):
+    """Position of a video in the title index: newest first"""
+    try:
+        return -datetime.fromisoformat(video.get("dateUploaded") or "").timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _metadata(video):
+    return " ".join(str(tag.get("value") or "") for tag in video.get("metaTags") or ())
+
+
+class TitleIndex:
+    """
+    SearchIndex of the videos of each library by title (and meta tag
+    values), so /get_video_by_title answers without going to Bunny. Every
+    videos listing page fetched updates it as it arrives; a full pass over
+    the library listing every `ttl` seconds, run in the background, also
+    drops deleted videos. A library is searched once its first pass is done.
+    """
+
+    def __init__(self, ttl=TITLE_INDEX_TTL):
+        self.ttl = ttl
+        self._libraries = {}
+        self._refreshed = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._libraries.clear()
+            self._refreshed.clear()
+            self._refreshing.clear()
+
+    def record(self, library_id, items):
+        """Adds or updates the videos of a listing page"""
+        with self._lock:
+            index = self._libraries.setdefault(str(library_id), SearchIndex())
+            for video in items:
+                guid = video.get("guid")
+                if guid:
+                    index.add(guid, video.get("title") or "", _recency(video), video, _metadata(video))
+
+    def begin_refresh(self, library_id):
+        """True when the library is due a full pass and the caller is to run it (one caller at a time)"""
+        library_id = str(library_id)
+        with self._lock:
+            refreshed = self._refreshed.get(library_id)
+            if library_id in self._refreshing or (refreshed is not None and time.monotonic() - refreshed < self.ttl):
+                return False
+            self._refreshing.add(library_id)
+            return True
+
+    def end_refresh(self, library_id, guids=None):
+        """Ends a full pass with the guids it listed, or None if it failed"""
+        library_id = str(library_id)
+        with self._lock:
+            self._refreshing.discard(library_id)
+            if guids is None:
+                return
+            index = self._libraries.setdefault(library_id, SearchIndex())
+            for guid in set(index.keys()) - guids:
+                index.remove(guid)
+            self._refreshed[library_id] = time.monotonic()
+
+    def search(self, library_id, title, page=1, per_page=10):
+        """
+        Page of the matches of title in the shape of Bunny's videos listing,
+        or None when the library isn't indexed yet or nothing matches.
+        """
+        library_id = str(library_id)
+        with self._lock:
+            if library_id not in self._refreshed:
+                return None
+            total, matches = self._libraries[library_id].page(title, (page - 1) * per_page, per_page, fuzzy=True)
+        if not total:
+            return None
+        items = [video for _, video in matches]
+        return {"totalItems": total, "currentPage": page, "itemsPerPage": per_page, "items": items}
+
+
+title_index = TitleIndex()
+# background passes of the ASGI app (the event loop only keeps weak references to tasks)
+_title_refreshes = set()
+
+
+def _cacheable(data):
+    return isinstance(data, dict) and "error" not in data
+
+
+class _Started:
+    """Iterator over a generator advanced to its first chunk; close() closes the generator"""
+
+    def __init__(self, chunks):
+        self._head = [next(chunks)]
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._head:
+            return self._head.pop()
+        return next(self._chunks)
+
+    def close(self):
+        self._head = []
+        self._chunks.close()
+
+
+class _StreamedListing:
+    """
+    JSON chunks of a videos listing sent as its pages arrive, shaped like
+    GetVideosList's, and the listing itself while it fits in the cache
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.count = 0
+        self.kept = []
+        self.kept_bytes = 0
+
+    def head(self):
+        # itemsPerPage goes last: it is the number of items sent
+        return f'{{"totalItems":{self.total},"currentPage":1,"items":['.encode()
+
+    def add(self, items):
+        """Chunk with a page of items (empty for an empty page)"""
+        encoded = [json.dumps(item, separators=(",", ":")) for item in items]
+        if self.kept is not None:
+            self.kept.extend(items)
+            self.kept_bytes += sum(len(item) for item in encoded)
+            if self.kept_bytes > cache.max_bytes:
+                self.kept = None
+        if not encoded:
+            return b""
+        chunk = ("," if self.count else "") + ",".join(encoded)
+        self.count += len(encoded)
+        return chunk.encode()
+
+    def tail(self, error=None):
+        tail = f'],"itemsPerPage":{self.count}'
+        if error is not None:
+            tail += f',"error":{json.dumps(error)}'
+        return (tail + "}").encode()
+
+    def data(self):
+        """The listing sent, as GetVideosList returns it, or None if it was too large to keep"""
+        if self.kept is None:
+            return None
+        return {"totalItems": self.total, "currentPage": 1, "itemsPerPage": len(self.kept), "items": self.kept}
+
 
 class Stream:
     def __init__(self):
-        self.baseUrl = "https://video.bunnycdn.com/library"
+        self.baseUrl = BASE_URL
         self.headers = {
             "accept": "application/json",
             "AccessKey": API_KEY,
@@ -25,9 +390,16 @@ class Stream:
         self.trailersLibraryId = 286671     
 
     def GetVideoLibraryList(self):
+        return cache.get_or_load(
+            self._LibraryKey(),
+            self._FetchVideoLibraryList,
+            ttl=LIBRARY_TTL, stale_ttl=STALE_TTL, cacheable=_cacheable,
+        )
+
+    def _FetchVideoLibraryList(self):
         try:
-            url=f'{self.baseUrl}/{self.bunnyStreamLibraryId}/collections?page=1&itemsPerPage=100&orderBy=date&includeThumbnails=false'
-            response = requests.get(url, headers=self.headers)
+            url=self._LibraryUrl()
+            response = upstream.get(url, headers=self.headers)
             response.raise_for_status()
             return response.json()
         except RequestException as e:
@@ -35,43 +407,422 @@ class Stream:
             return {"error": str(e), "items": []}
     
     def GetVideosList(self, collection=""):
+        return cache.get_or_load(
+            self._VideosKey(collection),
+            lambda: self._FetchVideosList(collection),
+            ttl=VIDEOS_TTL, stale_ttl=STALE_TTL, cacheable=_cacheable,
+        )
+
+    def RefreshVideosList(self, collection=""):
+        """Reloads the videos listing into the cache, even while it is fresh"""
+        return cache.refresh(
+            self._VideosKey(collection),
+            lambda: self._FetchVideosList(collection),
+            ttl=VIDEOS_TTL, stale_ttl=STALE_TTL, cacheable=_cacheable,
+        )
+
+    def VideosStoredAt(self, collection=""):
+        """Wall-clock time at which the cached videos listing was stored, or None"""
+        return cache.stored_at(self._VideosKey(collection))
+
+    def IsVideosListCached(self, collection=""):
+        """True when GetVideosList can answer from the cache (fresh or stale)"""
+        return cache.peek(self._VideosKey(collection)) is not None
+
+    def LibraryValidator(self, data=None):
+        """(digest, changed_at) of the cached library listing, or None (see Cache.validator)"""
+        return cache.validator(self._LibraryKey(), data)
+
+    def CollectionsValidator(self, data=None):
+        return cache.validator(self._CollectionsKey(), data)
+
+    def VideosValidator(self, collection="", data=None):
+        return cache.validator(self._VideosKey(collection), data)
+
+    def ProjectVideosList(self, data, collection="", fields=()):
+        """GetVideosList(collection)'s data projected to fields (projection.Rows)"""
+        return self._Project(self._VideosKey(collection), data, fields)
+
+    def ProjectColletcionsList(self, data, fields=()):
+        return self._Project(self._CollectionsKey(), data, fields)
+
+    def _Project(self, key, data, fields):
+        """Rows of a listing, projected once per content while the listing is cached"""
+        validator = cache.validator(key, data)
+        if validator is None:
+            return project(data, fields)
+        return projections.get_or_load(
+            (key, validator[0], fields), lambda: project(data, fields), ttl=STALE_TTL,
+        )
+
+    def _LibraryKey(self):
+        return ("library", self.bunnyStreamLibraryId)
+
+    def _CollectionsKey(self):
+        return ("collections", self.bunnyStreamLibraryId)
+
+    def _LibraryUrl(self):
+        return f'{self.baseUrl}/{self.bunnyStreamLibraryId}/collections?page=1&itemsPerPage=100&orderBy=date&includeThumbnails=false'
+
+    def _CollectionsUrl(self):
+        return f'{self.baseUrl}/{self.bunnyStreamLibraryId}/collections?page=1&itemsPerPage=500&orderBy=date&includeThumbnails=true'
+
+    def _SearchUrl(self, libraryId, title, page=1, itemsPerPage=10):
+        params = {"page": page, "itemsPerPage": itemsPerPage, "search": title or "", "orderBy": "date"}
+        return f'{self.baseUrl}/{libraryId}/videos?{parse.urlencode(params)}'
+
+    def _LibraryId(self, collection):
+        return self.trailersLibraryId if collection == "trailers" else self.bunnyStreamLibraryId
+
+    def _VideosKey(self, collection):
+        return ("videos", collection or "")
+
+    def _VideosUrl(self, collection, page):
+        # to build correct url
+        params = {"page": page, "itemsPerPage": VIDEOS_PAGE_SIZE, "orderBy": "date"}
+        if collection and collection != "trailers":
+            params["collection"] = collection
+        return f'{self.baseUrl}/{self._LibraryId(collection)}/videos?{parse.urlencode(params)}'
+
+    def _FetchVideosPage(self, collection, page):
+        response = upstream.get(self._VideosUrl(collection, page), headers=self.headers)
+        response.raise_for_status()
+        data = response.json()
+        index_videos(data.get("items", []))
+        title_index.record(self._LibraryId(collection), data.get("items", []))
+        return data
+
+    def IterVideosPages(self, collection=""):
+        """
+        Yields (totalItems, items) for every page of the videos listing, in order.
+        The first page tells how many pages there are; the rest are fetched
+        concurrently, at most VIDEOS_PAGE_WORKERS pages ahead of the consumer,
+        so memory stays bounded whatever the size of the library.
+        """
+        first = self._FetchVideosPage(collection, 1)
+        total = first.get("totalItems", 0)
+        yield total, first.get("items", [])
+
+        pages = -(-total // VIDEOS_PAGE_SIZE)
+        if pages <= 1:
+            return
+        pool = ThreadPoolExecutor(max_workers=VIDEOS_PAGE_WORKERS)
         try:
-            # to build correct url
-            if collection == "trailers":
-                url=f'{self.baseUrl}/{self.trailersLibraryId}/videos'
-            else:
-                url=f'{self.baseUrl}/{self.bunnyStreamLibraryId}/videos'
+            pending = deque()
+            next_page = 2
+            while next_page <= pages and len(pending) < VIDEOS_PAGE_WORKERS:
+                pending.append(pool.submit(self._FetchVideosPage, collection, next_page))
+                next_page += 1
+            while pending:
+                data = pending.popleft().result()
+                if next_page <= pages:
+                    pending.append(pool.submit(self._FetchVideosPage, collection, next_page))
+                    next_page += 1
+                yield total, data.get("items", [])
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
 
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            
-            # Parse JSON response
-            data = response.json()
-            print(f"Successfully fetched {len(data.get('items', []))} videos for collection: {collection}")
-            return data
+    def _FetchVideosList(self, collection=""):
+        try:
+            items = []
+            total = 0
+            for total, page in self.IterVideosPages(collection):
+                items.extend(page)
+            print(f"Successfully fetched {len(items)} videos for collection: {collection}")
+            return {"totalItems": total, "currentPage": 1, "itemsPerPage": len(items), "items": items}
             
         except RequestException as e:
             print(f"Error in GetVideosList: {e}")
             return {"error": str(e), "items": [], "totalItems": 0}
+
+    def StreamVideosList(self, collection=""):
+        """
+        Returns a generator of JSON chunks with the same content as
+        GetVideosList, or None when the listing is already being loaded
+        (GetVideosList then waits for that load). The first page is fetched
+        before returning, so upstream errors surface as a RequestException
+        instead of a broken body. Items are sent as each page arrives. The
+        stream is the load that concurrent GetVideosList misses wait for: when
+        the whole listing fits in the cache it is stored there and shared with
+        them, otherwise (or when the client goes away) one of them loads it.
+        """
+        finish = cache.lead(self._VideosKey(collection), VIDEOS_TTL, STALE_TTL, _cacheable)
+        if finish is None:
+            return None
+        pages = self.IterVideosPages(collection)
+        try:
+            total, first = next(pages)
+        except RequestException as e:
+            finish({"error": str(e), "items": [], "totalItems": 0})
+            raise
+        except BaseException as e:
+            finish(error=e)
+            raise
+
+        def generate():
+            listing = _StreamedListing(total)
+            # what the waiting requests get: nothing means one of them loads the listing
+            outcome = ()
+            try:
+                yield listing.head()
+                for page in chain([first], (items for _, items in pages)):
+                    chunk = listing.add(page)
+                    if chunk:
+                        yield chunk
+                data = listing.data()
+                if data is not None:
+                    outcome = (data,)
+                yield listing.tail()
+            except RequestException as e:
+                print(f"Error in StreamVideosList: {e}")
+                outcome = ({"error": str(e), "items": [], "totalItems": 0},)
+                yield listing.tail(str(e))
+            finally:
+                pages.close()
+                finish(*outcome)
+
+        chunks = generate()
+        # started, so that it ends the load even if the client goes away before reading it
+        return _Started(chunks)
     
     def GetColletcionsList(self):
+        return cache.get_or_load(
+            self._CollectionsKey(),
+            self._FetchColletcionsList,
+            ttl=COLLECTIONS_TTL, stale_ttl=STALE_TTL, cacheable=_cacheable,
+        )
+
+    def RefreshColletcionsList(self):
+        return cache.refresh(
+            self._CollectionsKey(),
+            self._FetchColletcionsList,
+            ttl=COLLECTIONS_TTL, stale_ttl=STALE_TTL, cacheable=_cacheable,
+        )
+
+    def ColletcionsStoredAt(self):
+        return cache.stored_at(self._CollectionsKey())
+
+    def _FetchColletcionsList(self):
         try:
-            # to build correct url
-            url=f'{self.baseUrl}/{self.bunnyStreamLibraryId}/collections?page=1&itemsPerPage=500&orderBy=date&includeThumbnails=true'
-            response = requests.get(url, headers=self.headers)
+            url=self._CollectionsUrl()
+            response = upstream.get(url, headers=self.headers)
             response.raise_for_status()
             return response.json()
         except RequestException as e:
             print(f"Error in GetColletcionsList: {e}")
             return {"error": str(e), "items": []}
     
-    def GetVideoByTitle(self, libraryId=0, title=""):
+    def _IsTitleIndexed(self, libraryId, title):
+        """Whether a title search can try the local index (and bring it up to date)"""
+        if not title or str(libraryId) != str(self.bunnyStreamLibraryId):
+            return False
+        if title_index.begin_refresh(libraryId):
+            threading.Thread(target=self._RefreshTitleIndex, name="title-index-refresh", daemon=True).start()
+        return True
+
+    def RefreshTitleIndex(self):
+        """Runs a full pass of the title index over the library listing, if one is due"""
+        if title_index.begin_refresh(self.bunnyStreamLibraryId):
+            self._RefreshTitleIndex()
+
+    def _RefreshTitleIndex(self):
+        guids = None
         try:
-            # to build correct url
-            url=f'{self.baseUrl}/{libraryId}/videos?page=1&itemsPerPage=10&search={title}&orderBy=date'
-            response = requests.get(url, headers=self.headers)
+            seen = set()
+            # the pages are recorded in the index as they are fetched
+            for _, items in self.IterVideosPages(""):
+                seen.update(video.get("guid") for video in items)
+            guids = seen
+        except RequestException as e:
+            print(f"Error in RefreshTitleIndex: {e}")
+        finally:
+            title_index.end_refresh(self.bunnyStreamLibraryId, guids)
+
+    def GetVideoByTitle(self, libraryId=0, title="", page=1, itemsPerPage=10):
+        """
+        Videos of the library matching title (prefix, accent-insensitive and
+        fuzzy), from the local title index; Bunny's search answers while the
+        index is being built and when nothing matches locally.
+        """
+        if self._IsTitleIndexed(libraryId, title):
+            found = title_index.search(libraryId, title, page, itemsPerPage)
+            if found is not None:
+                return found
+        try:
+            url=self._SearchUrl(libraryId, title, page, itemsPerPage)
+            response = upstream.get(url, headers=self.headers)
             response.raise_for_status()
             return response.json()
         except RequestException as e:
             print(f"Error in GetVideoByTitle: {e}")
-            return {"error": str(e), "items": []}
\ No newline at end of file
+            return {"error": str(e), "items": []}
+
+
+class AsyncStream(Stream):
+    """
+    Stream client for the ASGI app: the same URLs and listing cache as Stream,
+    with the upstream calls awaited on the shared async client.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # aiohttp rejects None header values (requests drops them)
+        self.headers = {key: value for key, value in self.headers.items() if value is not None}
+
+    async def _Get(self, url, name, default):
+        try:
+            response = await upstream.aget(url, headers=self.headers)
+            response.raise_for_status()
+            return await response.json(content_type=None)
+        except aiohttp.ClientError as e:
+            print(f"Error in {name}: {e}")
+            return {"error": str(e), **default}
+
+    async def GetVideoLibraryList(self):
+        return await cache.aget_or_load(
+            self._LibraryKey(),
+            lambda: self._Get(self._LibraryUrl(), "GetVideoLibraryList", {"items": []}),
+            ttl=LIBRARY_TTL, stale_ttl=STALE_TTL, cacheable=_cacheable,
+        )
+
+    async def GetColletcionsList(self):
+        return await cache.aget_or_load(
+            self._CollectionsKey(),
+            lambda: self._Get(self._CollectionsUrl(), "GetColletcionsList", {"items": []}),
+            ttl=COLLECTIONS_TTL, stale_ttl=STALE_TTL, cacheable=_cacheable,
+        )
+
+    def _IsTitleIndexed(self, libraryId, title):
+        if not title or str(libraryId) != str(self.bunnyStreamLibraryId):
+            return False
+        if title_index.begin_refresh(libraryId):
+            task = asyncio.ensure_future(self._RefreshTitleIndex())
+            _title_refreshes.add(task)
+            task.add_done_callback(_title_refreshes.discard)
+        return True
+
+    async def _RefreshTitleIndex(self):
+        guids = None
+        try:
+            data = await self._FetchVideosList("")
+            if "error" not in data:
+                guids = {video.get("guid") for video in data["items"]}
+        finally:
+            title_index.end_refresh(self.bunnyStreamLibraryId, guids)
+
+    async def GetVideoByTitle(self, libraryId=0, title="", page=1, itemsPerPage=10):
+        if self._IsTitleIndexed(libraryId, title):
+            found = title_index.search(libraryId, title, page, itemsPerPage)
+            if found is not None:
+                return found
+        return await self._Get(self._SearchUrl(libraryId, title, page, itemsPerPage), "GetVideoByTitle", {"items": []})
+
+    async def GetVideosList(self, collection=""):
+        return await cache.aget_or_load(
+            self._VideosKey(collection),
+            lambda: self._FetchVideosList(collection),
+            ttl=VIDEOS_TTL, stale_ttl=STALE_TTL, cacheable=_cacheable,
+        )
+
+    async def _FetchVideosPage(self, collection, page):
+        response = await upstream.aget(self._VideosUrl(collection, page), headers=self.headers)
+        response.raise_for_status()
+        data = await response.json(content_type=None)
+        index_videos(data.get("items", []))
+        title_index.record(self._LibraryId(collection), data.get("items", []))
+        return data
+
+    async def IterVideosPages(self, collection=""):
+        """Async counterpart of Stream.IterVideosPages: the pages ahead are fetched as tasks"""
+        first = await self._FetchVideosPage(collection, 1)
+        total = first.get("totalItems", 0)
+        yield total, first.get("items", [])
+
+        pages = -(-total // VIDEOS_PAGE_SIZE)
+        pending = deque()
+        next_page = 2
+        try:
+            while next_page <= pages and len(pending) < VIDEOS_PAGE_WORKERS:
+                pending.append(asyncio.ensure_future(self._FetchVideosPage(collection, next_page)))
+                next_page += 1
+            while pending:
+                data = await pending.popleft()
+                if next_page <= pages:
+                    pending.append(asyncio.ensure_future(self._FetchVideosPage(collection, next_page)))
+                    next_page += 1
+                yield total, data.get("items", [])
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _FetchVideosList(self, collection=""):
+        pages = self.IterVideosPages(collection)
+        try:
+            items = []
+            total = 0
+            async for total, page in pages:
+                items.extend(page)
+            print(f"Successfully fetched {len(items)} videos for collection: {collection}")
+            return {"totalItems": total, "currentPage": 1, "itemsPerPage": len(items), "items": items}
+        except aiohttp.ClientError as e:
+            print(f"Error in GetVideosList: {e}")
+            return {"error": str(e), "items": [], "totalItems": 0}
+        finally:
+            await pages.aclose()
+
+    async def StreamVideosList(self, collection=""):
+        """
+        Async counterpart of Stream.StreamVideosList: returns an async
+        generator of JSON chunks, or None when the listing is already being
+        loaded. Errors on the first page surface as an aiohttp.ClientError.
+        """
+        finish = cache.alead(self._VideosKey(collection), VIDEOS_TTL, STALE_TTL, _cacheable)
+        if finish is None:
+            return None
+        pages = self.IterVideosPages(collection)
+        try:
+            total, first = await pages.__anext__()
+        except aiohttp.ClientError as e:
+            finish({"error": str(e), "items": [], "totalItems": 0})
+            raise
+        except asyncio.CancelledError:
+            finish()
+            raise
+        except Exception as e:
+            finish(error=e)
+            raise
+
+        async def generate():
+            listing = _StreamedListing(total)
+            outcome = ()
+            try:
+                yield listing.head()
+                chunk = listing.add(first)
+                if chunk:
+                    yield chunk
+                async for _, page in pages:
+                    chunk = listing.add(page)
+                    if chunk:
+                        yield chunk
+                data = listing.data()
+                if data is not None:
+                    outcome = (data,)
+                yield listing.tail()
+            except aiohttp.ClientError as e:
+                print(f"Error in StreamVideosList: {e}")
+                outcome = ({"error": str(e), "items": [], "totalItems": 0},)
+                yield listing.tail(str(e))
+            finally:
+                await pages.aclose()
+                finish(*outcome)
+
+        chunks = generate()
+        head = await chunks.__anext__()
+
+        async def body():
+            # chunks is started, so that it ends the load even if the client goes away before reading it
+            yield head
+            async for chunk in chunks:
+                yield chunk
+
+        return body()
@@ -0,0 +1,172 @@
+"""
+Tests for the async (ASGI) serving mode, run against a local stand-in server
+"""
+import asyncio
+import pytest
+import stream
+import upstream
+from fake_upstream import FakeUpstream
+
+
+def _video(handler):
+    guid = handler.path.rsplit("/", 1)[-1]
+    if guid == "missing":
+        return 404, {"error": "not found"}
+    return 200, {"guid": guid, "title": "Episode"}
+
+
+def _videos(handler):
+    return 200, {"totalItems": 2, "items": [{"guid": "a"}, {"guid": "b"}]}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    routes = {
+        ("GET", "/library/286671/videos"): _videos,
+        ("GET", "*"): _video,
+    }
+    with FakeUpstream(routes) as fake:
+        monkeypatch.setattr(stream, "VIDEO_HOST", fake.url)
+        monkeypatch.setattr(stream, "BASE_URL", fake.url + "/library")
+        monkeypatch.setenv("BUNNY_API_KEY", "key")
+        stream.cache.clear()
+        stream.video_index.clear()
+        stream.title_index.clear()
+        yield fake
+    stream.cache.clear()
+    stream.video_index.clear()
+    stream.title_index.clear()
+
+
+def _run(coro):
+    async def main():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            return await coro()
+        finally:
+            await upstream.aclose_async_client()
+    return asyncio.run(main())
+
+
+def test_video_urls_are_checked_upstream(server):
+    from asgi import app
+
+    async def calls():
+        client = app.test_client()
+        found = await client.get("/get_video_thumbnail?guid=abc")
+        missing = await client.get("/get_video_stream?guid=missing")
+        return found.status_code, await found.get_json(), missing.status_code
+
+    status, body, missing_status = _run(calls)
+    assert status == 200
+    assert body == {"url": f"{server.url}/stream/286671/abc/thumbnail.jpg"}
+    assert missing_status == 500
+
+
+def test_concurrent_requests_share_one_listing_load(server):
+    from asgi import app
+
+    async def calls():
+        client = app.test_client()
+        responses = await asyncio.gather(*(client.get("/get_videos") for _ in range(20)))
+        return [await response.get_json() for response in responses]
+
+    bodies = _run(calls)
+    assert all(body["items"] == [{"guid": "a"}, {"guid": "b"}] for body in bodies)
+    assert len(server.requests) == 1
+
+
+def test_listing_is_streamed_page_by_page(server, monkeypatch):
+    from asgi import app
+    monkeypatch.setattr(stream, "VIDEOS_PAGE_SIZE", 2)
+
+    def pages(handler):
+        page = int(handler.path.split("page=")[1].split("&")[0])
+        return 200, {"totalItems": 5, "items": [{"guid": f"v{i}"} for i in range(5)][(page - 1) * 2:page * 2]}
+
+    server.routes[("GET", "/library/286671/videos")] = pages
+
+    async def calls():
+        client = app.test_client()
+        responses = await asyncio.gather(*(client.get("/get_videos") for _ in range(5)))
+        return [await response.get_json() for response in responses]
+
+    bodies = _run(calls)
+    assert all(body["items"] == [{"guid": f"v{i}"} for i in range(5)] for body in bodies)
+    assert all(body["itemsPerPage"] == 5 for body in bodies)
+    assert stream.cache.peek(("videos", ""))["items"] == bodies[0]["items"]
+    assert len(server.requests) == 3
+
+
+def test_video_urls_batch(server):
+    from asgi import app
+
+    async def call():
+        response = await app.test_client().get("/get_video_urls?guids=abc,missing&format=hls")
+        return await response.get_json()
+
+    videos = _run(call)["videos"]
+    assert videos["abc"] == {
+        "url": f"{server.url}/stream/286671/abc/playlist.m3u8",
+        "thumbnail": f"{server.url}/stream/286671/abc/thumbnail.jpg",
+    }
+    assert videos["missing"] == {"error": "Failed to get video info"}
+
+
+def test_title_search_uses_the_index_once_built(server):
+    from asgi import app
+    titles = [{"guid": "a", "title": "Noticias de la Mañana"}, {"guid": "b", "title": "Deportes"}]
+    server.routes[("GET", "/library/286671/videos")] = lambda handler: (200, {"totalItems": 2, "items": titles})
+
+    async def calls():
+        client = app.test_client()
+        # Bunny answers while the index is built in the background
+        first = await client.get("/get_video_by_title?libraryId=286671&title=manana")
+        for _ in range(100):
+            if stream.title_index.search(286671, "manana") is not None:
+                break
+            await asyncio.sleep(0.01)
+        requests_before = len(server.requests)
+        second = await client.get("/get_video_by_title?libraryId=286671&title=manana")
+        return await first.get_json(), await second.get_json(), len(server.requests) - requests_before
+
+    first, second, requests = _run(calls)
+    assert [item["guid"] for item in first["items"]] == ["a", "b"]
+    assert [item["guid"] for item in second["items"]] == ["a"]
+    assert requests == 0
+
+
+def test_conditional_listing(server):
+    from asgi import app
+
+    async def calls():
+        client = app.test_client()
+        first = await client.get("/get_videos")
+        # the first answer may be the one that loaded the listing
+        second = await client.get("/get_videos", headers={"If-None-Match": first.headers.get("ETag", "x")})
+        if second.status_code == 200:
+            second = await client.get("/get_videos", headers={"If-None-Match": second.headers["ETag"]})
+        return second
+
+    response = _run(calls)
+    assert response.status_code == 304
+    assert response.headers["ETag"]
+
+
+def test_upstream_timeouts_get_the_problem_response(server, monkeypatch):
+    import asgi
+    from app import app as flask_app
+
+    async def timeout(guid, api_key):
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(asgi, "aget_video", timeout)
+
+    async def call():
+        response = await asgi.app.test_client().get("/get_video_stream?guid=slow")
+        return response.status_code, await response.get_json()
+
+    # the same answer as the sync app gives for an upstream failure
+    server.fail_next("/library/286671/videos/down", times=10)
+    expected = flask_app.test_client().get("/get_video_stream?guid=down")
+    assert _run(call) == (expected.status_code, expected.get_json()) == (500, {"error": "Failed to get video info"})
@@ -0,0 +1,170 @@
+"""
+Tests for the listing cache (TTL, stale-while-revalidate, LRU and single-flight)
+"""
+import asyncio
+import json
+import threading
+import time
+from cache import Cache, SingleFlight
+
+
+def test_fresh_hits_do_not_reload():
+    cache = Cache(max_bytes=1024)
+    calls = []
+    loader = lambda: calls.append(1) or {"items": [1, 2]}
+    for _ in range(5):
+        assert cache.get_or_load("k", loader, ttl=60) == {"items": [1, 2]}
+    assert len(calls) == 1
+    assert cache.stats["hits"] == 4
+
+
+def test_uncacheable_values_are_not_stored():
+    cache = Cache(max_bytes=1024)
+    calls = []
+    loader = lambda: calls.append(1) or {"error": "boom"}
+    cache.get_or_load("k", loader, ttl=60, cacheable=lambda v: "error" not in v)
+    cache.get_or_load("k", loader, ttl=60, cacheable=lambda v: "error" not in v)
+    assert len(calls) == 2
+    assert len(cache) == 0
+
+
+def test_stale_value_is_served_while_refreshing():
+    cache = Cache(max_bytes=1024)
+    cache.set("k", "old", ttl=0, stale_ttl=60)
+    refreshed = threading.Event()
+
+    def loader():
+        refreshed.set()
+        return "new"
+
+    assert cache.get_or_load("k", loader, ttl=60, stale_ttl=60) == "old"
+    assert refreshed.wait(2)
+    for _ in range(100):
+        if cache.peek("k") == "new":
+            break
+        time.sleep(0.01)
+    assert cache.get_or_load("k", loader, ttl=60) == "new"
+
+
+def test_lru_eviction_is_bounded_by_bytes():
+    cache = Cache(max_bytes=30)
+    cache.set("a", "x" * 10, ttl=60)
+    cache.set("b", "y" * 10, ttl=60)
+    cache.get_or_load("a", lambda: None, ttl=60)
+    cache.set("c", "z" * 10, ttl=60)
+    assert cache.size <= 30
+    assert cache.peek("b") is None
+    assert cache.peek("a") == "x" * 10
+    assert not cache.set("huge", "h" * 100, ttl=60)
+
+
+def test_concurrent_misses_share_one_load():
+    cache = Cache(max_bytes=1024)
+    calls = []
+    gate = threading.Event()
+
+    def loader():
+        calls.append(1)
+        gate.wait(2)
+        return "value"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader, ttl=60)))
+        for _ in range(50)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert results == ["value"] * 50
+    assert len(calls) == 1
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    try:
+        flight.do("k", lambda: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    assert not flight.in_flight("k")
+    assert flight.do("k", lambda: 2) == 2
+
+
+def test_invalidate_matching_drops_selected_keys():
+    cache = Cache(max_bytes=1024)
+    for key in (("a", 1), ("a", 2), ("b", 1)):
+        cache.set(key, "v", ttl=60)
+    cache.invalidate_matching(lambda key: key[0] == "a")
+    assert len(cache) == 1
+    assert cache.peek(("b", 1)) == "v"
+    assert cache.size == cache.sizeof("v")
+
+
+def test_validator_follows_content_not_refreshes():
+    cache = Cache(max_bytes=1024)
+    assert cache.validator("k") is None
+    value = {"items": [1, 2]}
+    cache.set("k", value, ttl=60)
+    digest, changed_at = cache.validator("k", value)
+    assert cache.validator("k", {"items": [1, 2]}) is None
+    time.sleep(0.01)
+    cache.set("k", {"items": [1, 2]}, ttl=60)
+    assert cache.validator("k") == (digest, changed_at)
+    cache.set("k", {"items": [1, 2, 3]}, ttl=60)
+    new_digest, new_changed_at = cache.validator("k")
+    assert new_digest != digest and new_changed_at > changed_at
+
+
+def test_snapshot_restores_entries_in_another_cache():
+    cache = Cache(max_bytes=10_000)
+    cache.set(("videos", "c1"), {"items": [1, 2]}, ttl=60, stale_ttl=60)
+    cache.set(("videos", "c2"), {"items": [3]}, ttl=0, stale_ttl=5)
+    digest, changed_at = cache.validator(("videos", "c1"))
+    entries = json.loads(json.dumps(cache.snapshot()))
+
+    other = Cache(max_bytes=10_000)
+    # taken 30 seconds ago: c2 ran out of its stale window meanwhile
+    assert other.restore(entries, elapsed=30) == [("videos", "c1")]
+    assert other.get(("videos", "c1")) == {"items": [1, 2]}
+    assert other.validator(("videos", "c1")) == (digest, changed_at)
+    assert other.stored_at(("videos", "c1")) == cache.stored_at(("videos", "c1"))
+    # entries stored since are newer than the snapshot's
+    other.set(("videos", "c1"), {"items": []}, ttl=60)
+    assert other.restore(entries) == [("videos", "c2")]
+    assert other.get(("videos", "c1")) == {"items": []}
+
+
+def test_refresh_reloads_fresh_entries():
+    cache = Cache(max_bytes=1000)
+    cache.set("k", "old", ttl=60)
+    assert cache.refresh("k", lambda: "new", ttl=60) == "new"
+    assert cache.get_or_load("k", lambda: "unused", ttl=60) == "new"
+
+
+def test_followers_take_over_a_cancelled_async_load():
+    cache = Cache(max_bytes=1000)
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.05)
+        return len(loads)
+
+    async def main():
+        leader = asyncio.ensure_future(cache.aget_or_load("k", loader, ttl=60))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(cache.aget_or_load("k", loader, ttl=60)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        # the leader's client goes away
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        return leader.cancelled(), results
+
+    cancelled, results = asyncio.run(main())
+    assert cancelled
+    # one of the followers loaded it again, for all of them
+    assert results == [2, 2, 2]
+    assert cache.get("k") == 2
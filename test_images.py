@@ -0,0 +1,143 @@
+"""
+Tests for the image variants made on upload, run against a local stand-in storage server
+"""
+import asyncio
+import io
+import pytest
+import storage
+import upstream
+from fake_upstream import FakeUpstream
+from images import await_pending, group_variants, parse_variant, variant_name, wait_pending
+from test_storage import _delete, _get, _put
+
+ROOT = "/shows-tnoradio/show/"
+BOUNDARY = "image-boundary"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeUpstream({("GET", "*"): _get, ("PUT", "*"): _put, ("DELETE", "*"): _delete}) as fake:
+        fake.files = {}
+        monkeypatch.setattr(storage, "STORAGE_BASE_URL", fake.url)
+        upstream.set_session(None)
+        storage.listing_cache.clear()
+        yield fake
+    storage.listing_cache.clear()
+    upstream.set_session(None)
+
+
+def _image(width, height, fmt, mode="RGB"):
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.new(mode, (width, height), (200, 30, 60, 128)[:len(mode)]).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def _body(filename, data):
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="show_slug"\r\n\r\nshow\r\n'
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image_type"\r\n\r\nbanner\r\n'
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def _size(data):
+    Image = pytest.importorskip("PIL.Image")
+    with Image.open(io.BytesIO(data)) as image:
+        return image.format, image.size
+
+
+def test_variant_names_and_grouping():
+    assert variant_name("banner.png", 640, "webp") == "banner.png.640w.webp"
+    assert parse_variant("banner.png.640w.webp") == ("banner.png", 640, "webp")
+    assert parse_variant("banner.png") is None
+    assert parse_variant("clip.10w.mp4") is None
+    entries = [
+        {"File_Name": "banner.png"}, {"File_Name": "banner.png.640w.webp"}, {"File_Name": "banner.png.320w.avif"},
+        {"File_Name": "gone.png.320w.webp"}, {"Folder_Name": "old"},
+    ]
+    assert group_variants(entries) == [
+        {"File_Name": "banner.png", "Variants": [
+            {"File_Name": "banner.png.320w.avif", "Width": 320, "Format": "avif"},
+            {"File_Name": "banner.png.640w.webp", "Width": 640, "Format": "webp"},
+        ]},
+        {"File_Name": "gone.png.320w.webp"}, {"Folder_Name": "old"},
+    ]
+    tree = [{"Path": "a/x.png", "File_Name": "x.png"}, {"Path": "b/x.png.320w.webp", "File_Name": "x.png.320w.webp"}]
+    assert group_variants(tree) == tree
+
+
+def test_upload_makes_variants_listed_under_the_original(server):
+    from app import app
+    original = _image(900, 600, "PNG", "RGBA")
+    client = app.test_client()
+    response = client.post(
+        "/upload_file", data=_body("hero.png", original), content_type=f"multipart/form-data; boundary={BOUNDARY}",
+    )
+
+    # answered once the original is stored, the variants follow
+    assert response.status_code == 200
+    assert response.get_json()["variants"] == "pending"
+    assert server.files[ROOT + "banner/hero.png"] == original
+    wait_pending()
+    # narrower than the largest width: a full-size variant too
+    expected = [f"banner/hero.png.{width}w.{fmt}" for width in (320, 640, 900) for fmt in ("webp", "avif")]
+    assert sorted(server.files) == sorted(ROOT + path for path in ["banner/hero.png", *expected])
+    assert _size(server.files[ROOT + "banner/hero.png.640w.webp"]) == ("WEBP", (640, 427))
+    assert _size(server.files[ROOT + "banner/hero.png.320w.avif"])[1] == (320, 213)
+
+    files = client.get("/list_files?show_slug=show&image_type=banner").get_json()["files"]
+    assert [entry["File_Name"] for entry in files] == ["hero.png"]
+    assert [(variant["Width"], variant["Format"]) for variant in files[0]["Variants"]] == [
+        (320, "avif"), (320, "webp"), (640, "avif"), (640, "webp"), (900, "avif"), (900, "webp"),
+    ]
+
+    assert client.delete("/delete_file?show_slug=show&image_type=banner&filename=hero.png").status_code == 200
+    assert server.files == {}
+
+
+def test_undecodable_images_upload_without_variants(server):
+    from app import app
+    response = app.test_client().post(
+        "/upload_file", data=_body("broken.jpg", b"not an image"), content_type=f"multipart/form-data; boundary={BOUNDARY}",
+    )
+    assert response.status_code == 200
+    assert response.get_json()["variants"] == "pending"
+    wait_pending()
+    assert list(server.files) == [ROOT + "banner/broken.jpg"]
+
+
+def test_other_files_upload_without_variants(server):
+    from app import app
+    response = app.test_client().post(
+        "/upload_file", data=_body("notes.txt", b"text"), content_type=f"multipart/form-data; boundary={BOUNDARY}",
+    )
+    assert response.get_json()["variants"] == []
+
+
+def test_async_upload_makes_variants(server):
+    from asgi import app
+    original = _image(2000, 1000, "JPEG")
+
+    async def call():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            response = await app.test_client().post(
+                "/upload_file", data=_body("wide.jpg", original),
+                headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+            )
+            payload = await response.get_json()
+            await await_pending()
+            return response.status_code, payload
+        finally:
+            await upstream.aclose_async_client()
+
+    status, payload = asyncio.run(call())
+    assert status == 200
+    assert payload["variants"] == "pending"
+    # wider than the largest width: no full-size variant
+    assert sorted(server.files) == sorted(
+        ROOT + path for path in ["banner/wide.jpg", *(f"banner/wide.jpg.{width}w.{fmt}" for width in (320, 640, 1280) for fmt in ("webp", "avif"))]
+    )
+    assert _size(server.files[ROOT + "banner/wide.jpg.1280w.avif"]) == ("AVIF", (1280, 640))
@@ -0,0 +1,274 @@
+"""
+Tests for the range-aware video proxy, run against a local stand-in server
+"""
+import asyncio
+import re
+import threading
+import pytest
+import app as flask_app
+import asgi
+import stream
+import upstream
+from segments import SegmentCache
+from fake_upstream import FakeUpstream
+
+VIDEO = bytes(range(256)) * 4096  # 1 MiB
+ETAG = '"v1"'
+
+
+def _play(handler):
+    handler.server.ranges.append(handler.headers.get("Range"))
+    headers = {"ETag": ETAG, "Accept-Ranges": "bytes"}
+    match = re.fullmatch(r"bytes=(\d+)-(\d*)", handler.headers.get("Range", ""))
+    if_range = handler.headers.get("If-Range")
+    if match is None or (if_range is not None and if_range != ETAG):
+        return 200, VIDEO, headers
+    start = int(match.group(1))
+    end = min(int(match.group(2) or len(VIDEO) - 1), len(VIDEO) - 1)
+    if start >= len(VIDEO):
+        return 416, b"", {"Content-Range": f"bytes */{len(VIDEO)}"}
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(VIDEO)}"
+    return 206, VIDEO[start:end + 1], headers
+
+
+def _video(handler):
+    return 200, {"guid": handler.path.rsplit("/", 1)[-1]}
+
+
+def _thumbnail(handler):
+    handler.server.ranges.append("thumbnail")
+    return 200, b"\xff\xd8jpeg", {"Content-Type": "image/jpeg"}
+
+
+@pytest.fixture
+def segment_cache(monkeypatch, tmp_path):
+    cache = SegmentCache(str(tmp_path / "segments"), max_bytes=4 * len(VIDEO), segment_size=64 * 1024)
+    monkeypatch.setattr(flask_app, "segment_cache", cache)
+    monkeypatch.setattr(asgi, "segment_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def server(monkeypatch, segment_cache):
+    routes = {
+        ("GET", "/stream/286671/abc/play_720p.mp4"): _play,
+        ("GET", "/stream/286671/other/play_720p.mp4"): _play,
+        ("GET", "/stream/286671/abc/thumbnail.jpg"): _thumbnail,
+        ("GET", "*"): _video,
+    }
+    with FakeUpstream(routes) as fake:
+        fake.ranges = []
+        monkeypatch.setattr(stream, "VIDEO_HOST", fake.url)
+        monkeypatch.setattr(stream, "BASE_URL", fake.url + "/library")
+        monkeypatch.setenv("BUNNY_API_KEY", "key")
+        upstream.set_session(None)
+        stream.video_index.clear()
+        yield fake
+    upstream.set_session(None)
+    stream.video_index.clear()
+
+
+def _get(headers=None, guid="abc"):
+    return flask_app.app.test_client().get(f"/proxy_video/{guid}", headers=headers or {})
+
+
+def test_range_request_is_forwarded_and_answered_with_206(server):
+    response = _get({"Range": "bytes=1000-1999"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 1000-1999/{len(VIDEO)}"
+    assert response.headers["Content-Length"] == "1000"
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.data == VIDEO[1000:2000]
+
+
+def test_request_without_range_relays_the_whole_video(server):
+    response = _get()
+    assert response.status_code == 200
+    assert "Content-Range" not in response.headers
+    assert response.headers["Content-Length"] == str(len(VIDEO))
+    assert response.headers["ETag"] == ETAG
+    assert response.data == VIDEO
+
+
+def test_stale_if_range_gets_the_whole_video(server):
+    response = _get({"Range": "bytes=10-", "If-Range": '"v0"'})
+    assert response.status_code == 200
+    assert response.data == VIDEO
+    fresh = _get({"Range": "bytes=10-", "If-Range": ETAG})
+    assert fresh.status_code == 206
+    assert fresh.data == VIDEO[10:]
+
+
+def test_unsatisfiable_range_is_passed_through(server):
+    response = _get({"Range": f"bytes={len(VIDEO)}-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(VIDEO)}"
+
+
+def test_relay_chunk_size_grows_with_the_body():
+    assert stream.relay_chunk_size(None) == stream.RELAY_MIN_CHUNK
+    assert stream.relay_chunk_size(1024) == stream.RELAY_MIN_CHUNK
+    assert stream.relay_chunk_size(16 * 1024 * 1024) == 256 * 1024
+    assert stream.relay_chunk_size(10 ** 10) == stream.RELAY_MAX_CHUNK
+
+
+def test_async_proxy_forwards_range(server):
+    async def call():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            response = await asgi.app.test_client().get("/proxy_video/abc", headers={"Range": "bytes=0-99"})
+            return response.status_code, response.headers, await response.get_data()
+        finally:
+            await upstream.aclose_async_client()
+
+    status, headers, body = asyncio.run(call())
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes 0-99/{len(VIDEO)}"
+    assert body == VIDEO[:100]
+
+
+def test_whole_video_is_served_from_disk_once_cached(server, segment_cache):
+    assert _get().data == VIDEO
+    assert segment_cache.is_complete(segment_cache.lookup(("abc", "720p")))
+
+    response = _get({"Range": "bytes=5000-5999"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 5000-5999/{len(VIDEO)}"
+    assert response.data == VIDEO[5000:6000]
+    assert _get().data == VIDEO
+    assert server.ranges == [None]
+
+
+def test_partially_cached_video_fills_missing_segments(server, segment_cache):
+    # the first range is relayed as asked; it covers no whole segment
+    assert _get({"Range": "bytes=0-99"}).data == VIDEO[:100]
+    # later ranges fetch whole segments, once each
+    assert _get({"Range": "bytes=100-199"}).data == VIDEO[100:200]
+    assert _get({"Range": "bytes=200-70000"}).data == VIDEO[200:70001]
+    assert _get({"Range": "bytes=1000-2000"}).data == VIDEO[1000:2001]
+    assert server.ranges == ["bytes=0-99", "bytes=0-65535", "bytes=65536-131071"]
+    assert segment_cache.lookup(("abc", "720p")).segments == {0, 1}
+
+
+def test_least_recently_used_video_is_evicted(server, monkeypatch, tmp_path):
+    cache = SegmentCache(str(tmp_path / "small"), max_bytes=len(VIDEO) + 1, segment_size=64 * 1024)
+    monkeypatch.setattr(flask_app, "segment_cache", cache)
+    assert _get().data == VIDEO
+    assert _get(guid="other").data == VIDEO
+    assert cache.lookup(("abc", "720p")) is None
+    assert cache.is_complete(cache.lookup(("other", "720p")))
+    assert cache.size == len(VIDEO)
+
+
+def test_cache_index_survives_a_restart(server, segment_cache):
+    assert _get().data == VIDEO
+    reopened = SegmentCache(segment_cache.root, segment_cache.max_bytes, segment_cache.segment_size)
+    assert reopened.is_complete(reopened.lookup(("abc", "720p")))
+    assert b"".join(reopened.read(reopened.lookup(("abc", "720p")), 10, 19)) == VIDEO[10:20]
+
+
+def test_thumbnail_is_cached(server):
+    client = flask_app.app.test_client()
+    first = client.get("/proxy_thumbnail/abc")
+    second = client.get("/proxy_thumbnail/abc")
+    assert first.data == second.data == b"\xff\xd8jpeg"
+    assert second.content_type == "image/jpeg"
+    assert server.ranges == ["thumbnail"]
+
+
+def test_async_proxy_serves_from_the_shared_cache(server):
+    assert _get().data == VIDEO
+
+    async def call():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            response = await asgi.app.test_client().get("/proxy_video/abc", headers={"Range": "bytes=100-199"})
+            return response.status_code, await response.get_data()
+        finally:
+            await upstream.aclose_async_client()
+
+    assert asyncio.run(call()) == (206, VIDEO[100:200])
+    assert server.ranges == [None]
+
+
+def test_async_proxy_reads_and_writes_the_cache_off_the_event_loop(server, segment_cache, monkeypatch):
+    on_loop = []
+    read, store = segment_cache.read, segment_cache.store
+
+    def spy_read(*args, **kwargs):
+        for chunk in read(*args, **kwargs):
+            on_loop.append(threading.current_thread() is threading.main_thread())
+            yield chunk
+
+    def spy_store(*args, **kwargs):
+        on_loop.append(threading.current_thread() is threading.main_thread())
+        return store(*args, **kwargs)
+
+    monkeypatch.setattr(segment_cache, "read", spy_read)
+    monkeypatch.setattr(segment_cache, "store", spy_store)
+    assert _get().data == VIDEO
+    on_loop.clear()
+
+    async def call():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            client = asgi.app.test_client()
+            bodies = []
+            for path in ("/proxy_thumbnail/abc", "/proxy_thumbnail/abc", "/proxy_video/abc"):
+                bodies.append(await (await client.get(path)).get_data())
+            return bodies
+        finally:
+            await upstream.aclose_async_client()
+
+    assert asyncio.run(call()) == [b"\xff\xd8jpeg", b"\xff\xd8jpeg", VIDEO]
+    assert on_loop and not any(on_loop)
+
+
+def _worker(cache, **kwargs):
+    """Another worker process's view of the same directory"""
+    return SegmentCache(cache.root, cache.max_bytes, cache.segment_size, **kwargs)
+
+
+def test_objects_replaced_by_another_worker_are_not_served(server, segment_cache):
+    assert _get().data == VIDEO
+    other = _worker(segment_cache)
+    seen = other.lookup(("abc", "720p"))
+    assert other.is_complete(seen)
+
+    # this worker starts the video over (it changed upstream)
+    segment_cache.create(("abc", "720p"), len(VIDEO), "video/mp4", '"v2"')
+    with pytest.raises(FileNotFoundError):
+        b"".join(other.read(seen, 0, 99))
+    fresh = other.lookup(("abc", "720p"))
+    assert (fresh.etag, fresh.segments) == ('"v2"', set())
+
+    # and drops it
+    segment_cache.invalidate(("abc", "720p"))
+    assert other.lookup(("abc", "720p")) is None
+    assert other.size == 0
+
+
+def test_segments_filled_by_another_worker_are_picked_up(server, segment_cache):
+    other = _worker(segment_cache)
+    assert _get({"Range": "bytes=0-65535"}).data == VIDEO[:65536]
+    seen = other.lookup(("abc", "720p"))
+    assert seen.segments == {0}
+    other_fill = other.fill(seen, 65536)
+    other_fill.feed(VIDEO[65536:131072])
+    other_fill.close()
+    assert segment_cache.lookup(("abc", "720p")).segments == {0, 1}
+    assert _get({"Range": "bytes=0-131071"}).data == VIDEO[:131072]
+    assert server.ranges == ["bytes=0-65535"]
+
+
+def test_byte_bound_holds_across_workers(server, segment_cache, monkeypatch):
+    small = SegmentCache(segment_cache.root + "-small", len(VIDEO) + 1, segment_cache.segment_size, rescan_interval=0)
+    other = _worker(small, rescan_interval=0)
+    monkeypatch.setattr(flask_app, "segment_cache", small)
+    assert _get().data == VIDEO
+    # the other worker fills a second video: the first one goes
+    other.store(("thumbs", "big"), VIDEO, "image/jpeg")
+    assert small.lookup(("abc", "720p")) is None
+    assert other.size == len(VIDEO)
+    assert _get().data == VIDEO
+    assert server.ranges == [None, None]
@@ -0,0 +1,72 @@
+"""
+Tests for the token bucket rate limiter and its backends
+"""
+import multiprocessing
+import pytest
+from ratelimit import MemoryBackend, RateLimiter, SharedMemoryBackend
+
+
+@pytest.fixture(params=["memory", "shared"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryBackend()
+        return
+    backend = SharedMemoryBackend(str(tmp_path / "buckets"), slots=64)
+    yield backend
+    backend.close()
+
+
+def test_burst_then_refill(backend):
+    limiter = RateLimiter(limit=10, window=60, backend=backend)
+    assert [limiter.allow("1.2.3.4", 100) for _ in range(11)] == [True] * 10 + [False]
+    # one token every 6 seconds
+    assert not limiter.allow("1.2.3.4", 105)
+    assert limiter.allow("1.2.3.4", 106.1)
+    assert not limiter.allow("1.2.3.4", 106.2)
+    assert limiter.allow("5.6.7.8", 106.2)
+
+
+def test_no_double_burst_at_a_window_boundary(backend):
+    limiter = RateLimiter(limit=10, window=60, backend=backend)
+    allowed = sum(limiter.allow("client", 59.9) for _ in range(10))
+    allowed += sum(limiter.allow("client", 60.1) for _ in range(10))
+    assert allowed == 10
+
+
+def test_idle_clients_are_dropped():
+    backend = MemoryBackend()
+    limiter = RateLimiter(limit=10, window=60, backend=backend)
+    for i in range(1000):
+        limiter.allow(f"10.0.{i // 256}.{i % 256}", 0)
+    assert len(backend) == 1000
+    limiter.allow("active", 61)
+    assert len(backend) == 1
+
+
+def test_shared_table_reuses_slots(tmp_path):
+    backend = SharedMemoryBackend(str(tmp_path / "buckets"), slots=16)
+    limiter = RateLimiter(limit=2, window=60, backend=backend)
+    for i in range(500):
+        assert limiter.allow(f"client-{i}", i)
+    # a client that just spent its tokens is still remembered
+    limiter.allow("client-499", 499)
+    assert not limiter.allow("client-499", 499)
+    backend.close()
+
+
+def _hammer(path, results):
+    limiter = RateLimiter(limit=100, window=60, backend=SharedMemoryBackend(path, slots=64))
+    results.put(sum(limiter.allow("1.2.3.4", 1000) for _ in range(80)))
+
+
+def test_limit_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "buckets")
+    SharedMemoryBackend(path, slots=64).close()
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [context.Process(target=_hammer, args=(path, results)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert sum(results.get() for _ in workers) == 100
@@ -0,0 +1,110 @@
+"""
+Tests for the JSON encoding and compression of the listing routes, run against a local stand-in server
+"""
+import gzip
+import json
+import pytest
+import response_encoding
+import stream
+import upstream
+from fake_upstream import FakeUpstream
+
+
+def _collections(handler):
+    items = [{"guid": f"c{i}", "name": f"Colección {i}", "thumbnailUrl": f"https://example.com/{i}.jpg"} for i in range(handler.server.total)]
+    return 200, {"totalItems": len(items), "items": items}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeUpstream({("GET", "/library/286671/collections"): _collections}) as fake:
+        fake.total = 500
+        upstream.set_session(upstream.build_session(backoff_factor=0))
+        monkeypatch.setattr(stream, "BASE_URL", fake.url + "/library")
+        stream.cache.clear()
+        response_encoding.encoded_cache.clear()
+        yield fake
+    stream.cache.clear()
+    response_encoding.encoded_cache.clear()
+    upstream.set_session(None)
+
+
+def test_negotiation(monkeypatch):
+    monkeypatch.setattr(response_encoding, "codecs", {"gzip": None, "br": None})
+    assert response_encoding.negotiate(None) is None
+    assert response_encoding.negotiate("identity") is None
+    assert response_encoding.negotiate("gzip, deflate") == "gzip"
+    assert response_encoding.negotiate("gzip, br, zstd") == "br"
+    assert response_encoding.negotiate("br;q=0.5, gzip") == "gzip"
+    assert response_encoding.negotiate("*;q=0.1") == "br"
+    assert response_encoding.negotiate("gzip;q=0, br;q=0") is None
+
+
+def test_encoders_agree():
+    value = {"name": "Mañanera", "items": [1, 2.5, None, True], "at": object}
+    assert json.loads(response_encoding.dumps(value)) == json.loads(response_encoding._build_dumps("json")(value))
+
+
+def test_compressed_bodies_are_encoded_once(server, monkeypatch):
+    from app import app
+    client = app.test_client()
+    client.get("/get_stream_collections")
+    encodes = []
+    dumps = response_encoding.dumps
+    monkeypatch.setattr(response_encoding, "dumps", lambda value: encodes.append(1) or dumps(value))
+
+    first = client.get("/get_stream_collections", headers={"Accept-Encoding": "gzip"})
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert first.headers["Vary"] == "Accept-Encoding"
+    assert first.headers["ETag"].endswith('-gzip"')
+    data = json.loads(gzip.decompress(first.data))
+    assert len(data["items"]) == 500
+    assert len(first.data) < len(response_encoding.dumps(data)) / 4
+
+    second = client.get("/get_stream_collections", headers={"Accept-Encoding": "gzip"})
+    assert second.data == first.data
+    plain = client.get("/get_stream_collections")
+    assert "Content-Encoding" not in plain.headers
+    assert json.loads(plain.data) == data
+    # one encoding for all three responses
+    assert len(encodes) == 1
+
+    # a copy in any coding is current
+    revalidated = client.get("/get_stream_collections", headers={"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"] == first.headers["ETag"]
+
+
+@pytest.mark.parametrize("coding, module", [("br", "brotli"), ("zstd", "zstandard")])
+def test_optional_codings(server, coding, module):
+    codec = pytest.importorskip(module)
+    from app import app
+    response = app.test_client().get("/get_stream_collections", headers={"Accept-Encoding": f"gzip;q=0.5, {coding}"})
+    assert response.headers["Content-Encoding"] == coding
+    body = codec.decompress(response.data) if coding == "br" else codec.ZstdDecompressor().decompressobj().decompress(response.data)
+    assert len(json.loads(body)["items"]) == 500
+
+
+def test_small_bodies_are_not_compressed(server):
+    from app import app
+    server.total = 1
+    response = app.test_client().get("/get_stream_collections", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert len(response.get_json()["items"]) == 1
+
+
+def test_async_route_compresses(server):
+    import asyncio
+    from asgi import app
+
+    async def call():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            response = await app.test_client().get("/get_stream_collections", headers={"Accept-Encoding": "gzip"})
+            return response.headers.get("Content-Encoding"), await response.get_data()
+        finally:
+            await upstream.aclose_async_client()
+
+    coding, body = asyncio.run(call())
+    assert coding == "gzip"
+    assert len(json.loads(gzip.decompress(body))["items"]) == 500
@@ -0,0 +1,90 @@
+"""
+Tests for the in-memory name index
+"""
+import random
+import search
+from search import SearchIndex, best_match, normalize
+
+TITLES = [
+    "Deportes Extra", "Noticias de la Mañana", "Deportes", "El Café de la Tarde",
+    "Mañanera: Edición Especial", "Tecnología y más", "Deportes",
+]
+
+
+def _index(titles=TITLES):
+    index = SearchIndex()
+    for position, title in enumerate(titles):
+        index.add(f"PL{position}", title, position, title)
+    return index
+
+
+def test_normalize_drops_case_accents_and_punctuation():
+    assert normalize("  Mañanera:  EDICIÓN   especial! ") == "mananera edicion especial"
+    assert normalize(None) == ""
+
+
+def test_matches_ignore_accents_and_are_ranked():
+    index = _index()
+    assert index.search("manan") == ["Mañanera: Edición Especial", "Noticias de la Mañana"]
+    assert index.search("MAÑANA", words=False) == ["Noticias de la Mañana"]
+    # equal title first, then by length, then by position
+    assert index.search("deportes") == ["Deportes", "Deportes", "Deportes Extra"]
+    assert [key for (_, _, _, key), _ in index.ranked("deportes")] == ["PL2", "PL6", "PL0"]
+    assert index.search("cafe tar") == ["El Café de la Tarde"]
+    assert index.search("tar cafe") == ["El Café de la Tarde"]
+    assert index.search("tar cafe", words=False) == []
+    assert index.search("ia") == ["Tecnología y más", "Noticias de la Mañana", "Mañanera: Edición Especial"]
+    assert index.search("") == []
+    assert index.search("x", limit=1) == ["Deportes Extra"]
+
+
+def test_index_agrees_with_the_linear_lookup():
+    rng = random.Random(7)
+    words = ["noticias", "mañana", "deportes", "café", "tarde", "edición", "música", "la", "de"]
+    titles = [" ".join(rng.choice(words) for _ in range(rng.randint(1, 4))) for _ in range(300)]
+    index = _index(titles)
+    for query in words + ["man", "de l", "ica", "zzz", "a"]:
+        found = index.search(query, limit=1, words=False)
+        assert (found[0] if found else None) == best_match(titles, query, lambda title: title)
+
+
+def test_updates_and_removals():
+    index = _index()
+    index.add("PL2", "Cultura", 2, "Cultura")
+    index.remove("PL6")
+    index.remove("missing")
+    assert index.search("deportes") == ["Deportes Extra"]
+    assert index.search("cult") == ["Cultura"]
+    assert len(index) == 6
+
+
+def test_lookups_only_rank_the_indexed_candidates(monkeypatch):
+    rng = random.Random(1)
+    syllables = ["ma", "ña", "no", "ti", "cias", "de", "por", "tes", "ca", "fé", "lo", "ra"]
+    titles = [
+        " ".join("".join(rng.choice(syllables) for _ in range(3)) for _ in range(4)) for _ in range(5000)
+    ]
+    index = _index(titles)
+    queries = [title.split()[1][:4] for title in titles[:200]]
+    ranked = []
+    rank = search.rank
+    monkeypatch.setattr(search, "rank", lambda *args: ranked.append(args) or rank(*args))
+    examined = matches = 0
+    for query in queries:
+        ranked.clear()
+        found, _ = index.page(query, limit=10)
+        examined += len(ranked)
+        matches += found
+    # the trigram and word postings narrow each lookup to (nearly) its matches instead of every name
+    assert matches <= examined < matches * 1.05
+
+
+def test_fuzzy_and_metadata_matches_rank_last():
+    index = _index()
+    index.add("PL9", "Entrevista", 9, "Entrevista", extra="invitado especial tecnologia")
+    assert index.search("deprotes") == []
+    assert index.search("deprotes", fuzzy=True) == ["Deportes", "Deportes", "Deportes Extra"]
+    assert index.search("tecnologia", fuzzy=True) == ["Tecnología y más", "Entrevista"]
+    assert index.search("invitado") == ["Entrevista"]
+    assert index.search("invitado", words=False) == []
+    assert index.search("deportes", limit=2, offset=1) == ["Deportes", "Deportes Extra"]
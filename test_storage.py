@@ -0,0 +1,333 @@
+"""
+Tests for the cached storage zone listings, run against a local stand-in storage server
+"""
+import asyncio
+import hashlib
+import json
+from urllib import parse
+import pytest
+import storage
+import upstream
+from fake_upstream import FakeUpstream
+
+ROOT = "/shows-tnoradio/show/"
+
+
+def _get(handler):
+    path = parse.unquote(handler.path.split("?")[0])
+    files = handler.server.files
+    if not path.endswith("/"):
+        return (200, files[path]) if path in files else (404, {"HttpCode": 404})
+    children = {}
+    for name in files:
+        if name.startswith(path):
+            child, _, rest = name[len(path):].partition("/")
+            children[child] = children.get(child, False) or bool(rest)
+    return 200, [
+        {"ObjectName": child, "IsDirectory": is_directory, "Length": 0 if is_directory else len(files[path + child]),
+         "LastChanged": "2024-01-01T00:00:00.000",
+         "Checksum": None if is_directory else hashlib.sha256(files[path + child]).hexdigest().upper()}
+        for child, is_directory in sorted(children.items())
+    ]
+
+
+def _put(handler):
+    handler.server.files[parse.unquote(handler.path)] = b"".join(handler.iter_body())
+    return 201, {"HttpCode": 201}
+
+
+def _delete(handler):
+    path = parse.unquote(handler.path)
+    names = [name for name in handler.server.files if name == path or name.startswith(path.rstrip("/") + "/")]
+    if not names:
+        return 404, {"HttpCode": 404, "Message": "Object Not Found"}
+    for name in names:
+        del handler.server.files[name]
+    return 200, {"HttpCode": 200}
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    with FakeUpstream({("GET", "*"): _get, ("PUT", "*"): _put, ("DELETE", "*"): _delete}) as fake:
+        fake.files = {
+            ROOT + "logo/logo.png": b"png",
+            ROOT + "video/ep1.mp4": b"1" * 10,
+            ROOT + "video/extras/clip.mp4": b"c" * 5,
+        }
+        monkeypatch.setattr(storage, "STORAGE_BASE_URL", fake.url)
+        monkeypatch.setattr(storage, "STORAGE_LIST_MARKERS_DIR", str(tmp_path / "markers"))
+        monkeypatch.setattr(storage, "_markers_seen", {})
+        upstream.set_session(None)
+        storage.listing_cache.clear()
+        yield fake
+    storage.listing_cache.clear()
+    upstream.set_session(None)
+
+
+def _listings(server):
+    return [path for method, path in server.requests if method == "GET"]
+
+
+def test_listings_are_cached(server):
+    myStorage = storage.Storage("key", "shows-tnoradio", "show")
+    assert myStorage.GetStoragedObjectsList() == [{"Folder_Name": "logo"}, {"Folder_Name": "video"}]
+    assert myStorage.GetStoragedObjectsList("video") == [{"File_Name": "ep1.mp4"}, {"Folder_Name": "extras"}]
+    assert myStorage.GetStoragedObjectsList("/video/") == [{"File_Name": "ep1.mp4"}, {"Folder_Name": "extras"}]
+    assert storage.Storage("key", "shows-tnoradio", "show").GetStoragedObjectsList() == [
+        {"Folder_Name": "logo"}, {"Folder_Name": "video"},
+    ]
+    assert _listings(server) == [ROOT, ROOT + "video/"]
+
+
+def test_uploads_and_deletes_write_through(server, tmp_path):
+    myStorage = storage.Storage("key", "shows-tnoradio", "show")
+    myStorage.GetStoragedObjectsList()
+    myStorage.GetStoragedObjectsList("video")
+    (tmp_path / "ep2.mp4").write_bytes(b"2" * 20)
+
+    assert myStorage.PutFile("ep2.mp4", "video/ep2.mp4", str(tmp_path))["status"] == "success"
+    assert myStorage.PutStream(iter([b"a", b"bc"]), "audio/new/intro.mp3")["status"] == "success"
+    assert myStorage.DeleteFile("logo")["status"] == "success"
+    assert myStorage.GetStoragedObjectsList() == [{"Folder_Name": "video"}, {"Folder_Name": "audio"}]
+    assert myStorage.GetStoragedObjectsList("video") == [
+        {"File_Name": "ep1.mp4"}, {"Folder_Name": "extras"}, {"File_Name": "ep2.mp4"},
+    ]
+    assert _listings(server) == [ROOT, ROOT + "video/"]
+    # folders created by the upload were not cached yet
+    assert myStorage.GetStoragedObjectsList("audio/new") == [{"File_Name": "intro.mp3"}]
+
+
+def test_writes_in_another_worker_drop_the_cached_listings(server):
+    myStorage = storage.Storage("key", "shows-tnoradio", "show")
+    other = storage.Storage("key", "shows-tnoradio", "other")
+    myStorage.GetStoragedObjectsList("video")
+    other.GetStoragedObjectsList()
+    # another worker uploads: its write-through is in its own memory, the marker on disk is shared
+    server.files[ROOT + "video/ep2.mp4"] = b"2"
+    seen = dict(storage._markers_seen)
+    storage._mark_written(myStorage.base_url)
+    storage._markers_seen.update(seen)
+
+    assert myStorage.GetStoragedObjectsList("video") == [
+        {"File_Name": "ep1.mp4"}, {"File_Name": "ep2.mp4"}, {"Folder_Name": "extras"},
+    ]
+    assert myStorage.GetStoragedObjectsList("video") == [
+        {"File_Name": "ep1.mp4"}, {"File_Name": "ep2.mp4"}, {"Folder_Name": "extras"},
+    ]
+    other.GetStoragedObjectsList()
+    # other shows keep their listings
+    assert _listings(server) == [ROOT + "video/", "/shows-tnoradio/other/", ROOT + "video/"]
+
+
+def test_a_listing_that_raced_with_a_write_is_not_cached(server):
+    myStorage = storage.Storage("key", "shows-tnoradio", "show")
+
+    def slow_get(handler):
+        # the upload lands while this listing is on its way
+        storage.Storage("key", "shows-tnoradio", "show")._Uploaded("video/late.mp4", 1)
+        return _get(handler)
+
+    server.routes[("GET", "*")] = slow_get
+    myStorage.GetStoragedObjectsList("video")
+    server.routes[("GET", "*")] = _get
+    server.files[ROOT + "video/late.mp4"] = b"l"
+    assert {"File_Name": "late.mp4"} in myStorage.GetStoragedObjectsList("video")
+    assert len(_listings(server)) == 2
+
+
+def test_stale_listings_are_reconciled_in_the_background(server, monkeypatch):
+    monkeypatch.setattr(storage, "STORAGE_LIST_TTL", 0)
+    myStorage = storage.Storage("key", "shows-tnoradio", "show")
+    myStorage.GetStoragedObjectsList("logo")
+    server.files[ROOT + "logo/other.png"] = b"x"
+    assert myStorage.GetStoragedObjectsList("logo") == [{"File_Name": "logo.png"}]
+    for _ in range(100):
+        if len(myStorage.GetStoragedObjectsList("logo")) == 2:
+            break
+        asyncio.run(asyncio.sleep(0.01))
+    assert myStorage.GetStoragedObjectsList("logo") == [{"File_Name": "logo.png"}, {"File_Name": "other.png"}]
+
+
+def test_recursive_listing(server):
+    from app import app
+    response = app.test_client().get("/list_files?show_slug=show&recursive=true")
+    files = response.get_json()["files"]
+    assert [(entry["Path"], entry.get("File_Name"), entry["Length"]) for entry in files] == [
+        ("logo", None, 0), ("logo/logo.png", "logo.png", 3), ("video", None, 0),
+        ("video/ep1.mp4", "ep1.mp4", 10), ("video/extras", None, 0), ("video/extras/clip.mp4", "clip.mp4", 5),
+    ]
+    server.requests.clear()
+    tree = storage.Storage("key", "shows-tnoradio", "show").GetStoragedObjectsTree("video")
+    assert [entry["Path"] for entry in tree] == ["ep1.mp4", "extras", "extras/clip.mp4"]
+    assert server.requests == []
+
+
+def test_async_recursive_listing_and_write_through(server):
+    async def calls():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            myStorage = storage.AsyncStorage("key", "shows-tnoradio", "show")
+            tree = await myStorage.GetStoragedObjectsTree()
+
+            async def body():
+                yield b"new"
+
+            await myStorage.PutStream(body(), "video/extras/new.mp4")
+            await myStorage.DeleteFile("video/ep1.mp4")
+            return tree, await myStorage.GetStoragedObjectsTree("video")
+        finally:
+            await upstream.aclose_async_client()
+
+    tree, video = asyncio.run(calls())
+    assert len(tree) == 6
+    assert [(entry["Path"], entry["Length"]) for entry in video] == [("extras", 0), ("extras/clip.mp4", 5), ("extras/new.mp4", 3)]
+    # one listing per directory: the writes went through to the cache
+    assert len(_listings(server)) == 4
+
+
+def test_mirror_downloads_only_what_changed(server, tmp_path):
+    myStorage = storage.Storage("key", "shows-tnoradio", "show")
+    results = myStorage.MirrorTree(str(tmp_path))
+    assert {path: result["status"] for path, result in results.items()} == {
+        "logo/logo.png": "success", "video/ep1.mp4": "success", "video/extras/clip.mp4": "success",
+    }
+    assert (tmp_path / "video" / "extras" / "clip.mp4").read_bytes() == b"c" * 5
+    assert not list(tmp_path.rglob("*.part"))
+
+    # same size, different content: caught by the listed checksum
+    (tmp_path / "video" / "ep1.mp4").write_bytes(b"x" * 10)
+    server.requests.clear()
+    results = myStorage.MirrorTree(str(tmp_path / "video"), "video")
+    assert results["extras/clip.mp4"]["status"] == "skipped"
+    assert results["ep1.mp4"]["status"] == "success"
+    assert (tmp_path / "video" / "ep1.mp4").read_bytes() == b"1" * 10
+    assert server.requests == [("GET", "/shows-tnoradio/show/video/ep1.mp4")]
+
+
+def test_mirror_reports_failed_downloads(server, tmp_path):
+    def failing_get(handler):
+        return (500, {"HttpCode": 500}) if handler.path.endswith("ep1.mp4") else _get(handler)
+
+    server.routes[("GET", "*")] = failing_get
+    results = storage.Storage("key", "shows-tnoradio", "show").MirrorTree(str(tmp_path), "video")
+    assert results["ep1.mp4"]["status"] == "error"
+    assert results["extras/clip.mp4"]["status"] == "success"
+    assert not (tmp_path / "ep1.mp4").exists()
+
+
+def test_list_files_answers_conditional_requests(server):
+    from app import app
+    client = app.test_client()
+    first = client.get("/list_files?show_slug=show&image_type=video")
+    etag = first.headers["ETag"]
+    assert client.get("/list_files?show_slug=show&image_type=video", headers={"If-None-Match": etag}).status_code == 304
+    tree = client.get("/list_files?show_slug=show&recursive=true")
+    assert tree.headers["ETag"] not in (etag, None)
+
+    storage.Storage("key", "shows-tnoradio", "show").PutStream(iter([b"x"]), "video/extras/new.mp4")
+    # the upload went through to a listing inside the tree, not to the listing of video/
+    assert client.get("/list_files?show_slug=show&image_type=video", headers={"If-None-Match": etag}).status_code == 304
+    changed = client.get("/list_files?show_slug=show&recursive=true", headers={"If-None-Match": tree.headers["ETag"]})
+    assert changed.status_code == 200
+    assert "video/extras/new.mp4" in [entry["Path"] for entry in changed.get_json()["files"]]
+
+
+def _multipart(fields, files, boundary="bulk-boundary"):
+    body = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    )
+    for filename, data in files.items():
+        body += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+def _lines(data):
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+
+def test_bulk_upload_streams_one_line_per_file(server, monkeypatch):
+    import app
+    monkeypatch.setattr(app, "BULK_MAX_ITEMS", 3)
+    files = {f"{index}.png": bytes([index]) * (index + 1) for index in range(4)}
+    body, content_type = _multipart({"show_slug": "show", "image_type": "gallery"}, files)
+    response = app.app.test_client().post("/upload_files", data=body, content_type=content_type)
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = _lines(response.data)
+    assert sorted((line["path"], line["status"]) for line in lines[:-1]) == [
+        ("gallery/0.png", "success"), ("gallery/1.png", "success"), ("gallery/2.png", "success"), ("gallery/3.png", "error"),
+    ]
+    assert lines[-1] == {"status": "done", "succeeded": 3, "failed": 1}
+    assert server.files[ROOT + "gallery/2.png"] == b"\x02" * 3
+    assert ROOT + "gallery/3.png" not in server.files
+
+
+def test_bulk_upload_reports_file_parts_without_a_name(server):
+    from app import app
+    body, content_type = _multipart({"show_slug": "show", "image_type": "gallery"}, {"": b"", "a.png": b"a"})
+    lines = _lines(app.test_client().post("/upload_files", data=body, content_type=content_type).data)
+    assert sorted((line["path"], line["status"]) for line in lines[:-1]) == [("gallery/", "error"), ("gallery/a.png", "success")]
+    assert ROOT + "gallery/" not in server.files
+
+
+def test_bulk_upload_needs_the_fields_before_the_files(server):
+    from app import app
+    body, content_type = _multipart({}, {"a.png": b"a"})
+    response = app.test_client().post("/upload_files?show_slug=show", data=body, content_type=content_type)
+    assert response.status_code == 400
+    assert ROOT + "a.png" not in server.files
+
+
+def test_bulk_delete(server):
+    from app import app
+    response = app.test_client().post("/delete_files", json={
+        "show_slug": "show", "paths": ["logo/logo.png", "video/../logo", ""],
+        "image_type": "video", "filenames": ["ep1.mp4"],
+    })
+    lines = _lines(response.data)
+    assert sorted((line["path"], line["status"]) for line in lines[:-1]) == [
+        ("", "error"), ("logo/logo.png", "success"), ("video/../logo", "error"), ("video/ep1.mp4", "success"),
+    ]
+    assert lines[-1] == {"status": "done", "succeeded": 2, "failed": 2}
+    assert sorted(server.files) == [ROOT + "video/extras/clip.mp4"]
+    assert app.test_client().post("/delete_files", json={"show_slug": "show"}).status_code == 400
+
+
+def test_failed_deletes_are_reported(server):
+    from app import app
+    response = app.test_client().post("/delete_files", json={"show_slug": "show", "paths": ["logo/logo.png", "logo/missing.png"]})
+    lines = _lines(response.data)
+    results = {line["path"]: line for line in lines[:-1]}
+    assert results["logo/logo.png"]["status"] == "success"
+    assert results["logo/missing.png"]["status"] == "error"
+    assert "404" in results["logo/missing.png"]["message"]
+    assert lines[-1] == {"status": "done", "succeeded": 1, "failed": 1}
+    assert storage.Storage("key", "shows-tnoradio", "show").DeleteFile("logo/missing.png")["HTTP"] == 404
+
+
+def test_async_bulk_upload_and_delete(server):
+    from asgi import app
+    body, content_type = _multipart({"image_type": "gallery"}, {"a.png": b"a", "b.png": b"bb"})
+
+    async def calls():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            client = app.test_client()
+            uploaded = await client.post("/upload_files?show_slug=show", data=body, headers={"Content-Type": content_type})
+            deleted = await client.delete("/delete_files", json={"show_slug": "show", "paths": ["gallery/a.png"]})
+            return await uploaded.get_data(), await deleted.get_data()
+        finally:
+            await upstream.aclose_async_client()
+
+    uploaded, deleted = asyncio.run(calls())
+    assert _lines(uploaded)[-1] == {"status": "done", "succeeded": 2, "failed": 0}
+    first, summary = _lines(deleted)
+    assert (first["path"], first["status"]) == ("gallery/a.png", "success")
+    assert summary == {"status": "done", "succeeded": 1, "failed": 0}
+    assert server.files[ROOT + "gallery/b.png"] == b"bb"
+    assert ROOT + "gallery/a.png" not in server.files
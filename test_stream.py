@@ -0,0 +1,334 @@
+"""
+Tests for the Bunny Stream client, run against a local stand-in server
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import parse
+import pytest
+import stream
+import upstream
+from fake_upstream import FakeUpstream
+from stream import Stream
+
+
+def _videos(handler):
+    query = parse.parse_qs(parse.urlparse(handler.path).query)
+    page = int(query["page"][0])
+    size = int(query["itemsPerPage"][0])
+    total = handler.server.total
+    items = [
+        {"guid": f"v{i}", "title": handler.server.titles.get(i, f"Video {i}"), "collectionId": query.get("collection", [""])[0],
+         "availableResolutions": "360p,720p", "dateUploaded": f"2024-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}"}
+        for i in range(total)
+    ]
+    if "search" in query:
+        items = [item for item in items if query["search"][0].lower() in item["title"].lower()]
+    total = len(items)
+    items = items[(page - 1) * size:page * size]
+    return 200, {"totalItems": total, "currentPage": page, "itemsPerPage": size, "items": items}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeUpstream({("GET", "/library/286671/videos"): _videos}) as fake:
+        fake.total = 1050
+        fake.titles = {}
+        upstream.set_session(upstream.build_session(backoff_factor=0))
+        monkeypatch.setattr(stream, "BASE_URL", fake.url + "/library")
+        monkeypatch.setattr(stream, "VIDEOS_PAGE_SIZE", 100)
+        stream.cache.clear()
+        stream.video_index.clear()
+        stream.title_index.clear()
+        stream.projections.clear()
+        yield fake
+    stream.cache.clear()
+    stream.video_index.clear()
+    stream.title_index.clear()
+    stream.projections.clear()
+    upstream.set_session(None)
+
+
+def test_videos_list_fetches_every_page_in_order(server):
+    data = Stream().GetVideosList("abc")
+    assert data["totalItems"] == 1050
+    assert [item["guid"] for item in data["items"]] == [f"v{i}" for i in range(1050)]
+    assert all(item["collectionId"] == "abc" for item in data["items"])
+    assert len(server.requests) == 11
+
+
+def test_trailers_do_not_send_a_collection_filter(server):
+    server.total = 3
+    Stream().GetVideosList("trailers")
+    assert "collection=" not in server.requests[0][1]
+
+
+def test_streamed_listing_matches_and_fills_the_cache(server):
+    myStream = Stream()
+    body = b"".join(myStream.StreamVideosList("abc"))
+    data = json.loads(body)
+    assert [item["guid"] for item in data["items"]] == [f"v{i}" for i in range(1050)]
+    assert myStream.IsVideosListCached("abc")
+    requests_before = len(server.requests)
+    assert myStream.GetVideosList("abc")["items"] == data["items"]
+    assert len(server.requests) == requests_before
+
+
+def test_streamed_listing_is_the_load_concurrent_misses_wait_for(server):
+    myStream = Stream()
+    chunks = myStream.StreamVideosList("abc")
+    assert myStream.StreamVideosList("abc") is None
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        waiting = [pool.submit(Stream().GetVideosList, "abc") for _ in range(4)]
+        time.sleep(0.05)
+        assert not any(future.done() for future in waiting)
+        data = json.loads(b"".join(chunks))
+        listings = [future.result(timeout=5) for future in waiting]
+    assert all(listing["items"] == data["items"] for listing in listings)
+    assert data["itemsPerPage"] == listings[0]["itemsPerPage"] == 1050
+    assert len(server.requests) == 11
+
+
+def test_waiting_misses_load_the_listing_when_the_stream_is_dropped(server):
+    chunks = Stream().StreamVideosList("abc")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        waiting = pool.submit(Stream().GetVideosList, "abc")
+        time.sleep(0.05)
+        next(chunks)
+        # the client went away
+        chunks = None
+        assert len(waiting.result(timeout=5)["items"]) == 1050
+
+
+def test_closing_the_stream_ends_the_load(server):
+    chunks = Stream().StreamVideosList("abc")
+    next(chunks)
+    chunks.close()
+    # no load in flight: the next miss leads its own
+    again = Stream().StreamVideosList("abc")
+    assert again is not None
+    again.close()
+
+
+def test_get_videos_route_streams_then_serves_from_cache(server):
+    from app import app
+    client = app.test_client()
+    first = client.get("/get_videos?collection=abc")
+    assert first.status_code == 200
+    assert len(first.get_json()["items"]) == 1050
+    second = client.get("/get_videos?collection=abc")
+    assert second.get_json()["items"] == first.get_json()["items"]
+    assert len(server.requests) == 11
+
+
+def test_cached_listings_answer_conditional_requests(server):
+    from app import app
+    client = app.test_client()
+    server.total = 3
+    # streamed, then cached once read to the end
+    streamed = client.get("/get_videos?collection=abc")
+    assert "ETag" not in streamed.headers
+    assert len(streamed.get_json()["items"]) == 3
+    first = client.get("/get_videos?collection=abc")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+    assert client.get("/get_videos?collection=abc", headers={"If-None-Match": etag}).status_code == 304
+    not_modified = client.get("/get_videos?collection=abc", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert not_modified.status_code == 304
+    assert not_modified.data == b""
+    # another query is another representation
+    assert client.get("/get_videos?collection=abc&x=1", headers={"If-None-Match": etag}).status_code == 200
+
+    # a refresh with the same content keeps the validators, a change replaces them
+    Stream().GetVideosList("abc")
+    stream.cache.set(("videos", "abc"), Stream()._FetchVideosList("abc"), ttl=60)
+    assert client.get("/get_videos?collection=abc", headers={"If-None-Match": etag}).status_code == 304
+    server.total = 4
+    stream.cache.set(("videos", "abc"), Stream()._FetchVideosList("abc"), ttl=60)
+    changed = client.get("/get_videos?collection=abc", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert len(changed.get_json()["items"]) == 4
+
+
+def test_projected_listings(server, monkeypatch):
+    from app import app
+    client = app.test_client()
+    server.total = 250
+    projected = []
+    project = stream.project
+    monkeypatch.setattr(stream, "project", lambda data, fields: projected.append(fields) or project(data, fields))
+
+    full = client.get("/get_videos?collection=abc").get_json()
+    compact = client.get("/get_videos?collection=abc&view=compact").get_json()
+    assert compact["totalItems"] == 250
+    assert compact["items"][3] == {key: full["items"][3].get(key) for key in stream.VIDEO_VIEWS["compact"]}
+    picked = client.get("/get_videos?collection=abc&fields=title,guid,nope,title").get_json()
+    assert picked["items"][0] == {"title": "Video 0", "guid": "v0", "nope": None}
+    client.get("/get_videos?collection=abc&view=compact")
+    # once per listing content and field set: the views as the listing is stored, the rest on first use
+    assert projected == [*stream.VIDEO_VIEWS.values(), ("title", "guid", "nope")]
+
+    assert client.get("/get_videos?collection=abc&view=everything").status_code == 400
+    assert client.get("/get_videos?collection=abc&fields=" + ",".join(f"f{i}" for i in range(40))).status_code == 400
+
+
+def test_projections_follow_the_cached_listing(server):
+    server.total = 5
+    myStream = Stream()
+    data = myStream.GetVideosList("abc")
+    digest = myStream.VideosValidator("abc", data)[0]
+    assert sorted(key[2] for key in stream.projections._entries) == sorted(stream.VIDEO_VIEWS.values())
+    assert all(key[:2] == (("videos", "abc"), digest) for key in stream.projections._entries)
+
+    # new content replaces the projections of the old one
+    server.total = 6
+    data = myStream.RefreshVideosList("abc")
+    assert {key[1] for key in stream.projections._entries} == {myStream.VideosValidator("abc", data)[0]}
+    assert len(myStream.ProjectVideosList(data, "abc", stream.VIDEO_VIEWS["compact"])) == 6
+
+    stream.cache.invalidate(("videos", "abc"))
+    assert len(stream.projections) == 0
+
+
+def test_projection_shapes():
+    from projection import Rows, parse_fields
+    assert parse_fields() is None
+    assert parse_fields("a, b,,a") == ("a", "b")
+    assert parse_fields("extra", "compact", {"compact": ("guid", "title")}) == ("guid", "title", "extra")
+    items = [{"guid": f"v{i}", "title": "Same", "captions": [{"label": "es"}] * 5} for i in range(3)]
+    rows = Rows(items, ("guid", "title"), {"totalItems": 3})
+    assert rows.to_json() == {"totalItems": 3, "items": [{"guid": f"v{i}", "title": "Same"} for i in range(3)]}
+    assert rows.rows[0][1] is rows.rows[2][1]
+    assert rows.size < json.dumps(items).__len__() / 2
+
+
+def test_listing_warms_the_video_index(server, monkeypatch):
+    from app import app
+    monkeypatch.setenv("BUNNY_API_KEY", "key")
+    server.total = 3
+    Stream().GetVideosList()
+    requests_before = len(server.requests)
+    client = app.test_client()
+    found = client.get("/get_video_stream?guid=v1&resolution=360p")
+    assert found.status_code == 200
+    assert found.get_json()["url"].endswith("/v1/play_360p.mp4")
+    unavailable = client.get("/get_video_stream?guid=v2&resolution=1080p")
+    assert unavailable.status_code == 400
+    assert unavailable.get_json()["availableResolutions"] == ["360p", "720p"]
+    assert client.get("/get_video_thumbnail?guid=v0").status_code == 200
+    assert len(server.requests) == requests_before
+
+
+def test_unknown_guid_is_looked_up_once(server, monkeypatch):
+    from app import app
+    monkeypatch.setenv("BUNNY_API_KEY", "key")
+    client = app.test_client()
+    assert client.get("/get_video_stream?guid=nope").status_code == 500
+    assert client.get("/get_video_thumbnail?guid=nope").status_code == 500
+    assert server.requests == [("GET", "/library/286671/videos/nope")]
+
+
+def test_video_urls_are_resolved_in_one_batch(server, monkeypatch):
+    from app import app
+    monkeypatch.setenv("BUNNY_API_KEY", "key")
+    server.total = 3
+    Stream().GetVideosList()
+
+    def video(handler):
+        time.sleep(0.2)
+        return 200, {"guid": handler.path.rsplit("/", 1)[-1], "availableResolutions": "720p"}
+
+    server.routes[("GET", "*")] = video
+    guids = ["v0", "v1"] + [f"x{i}" for i in range(8)]
+    start = time.perf_counter()
+    response = app.test_client().post("/get_video_urls", json={"guids": guids + ["v0"], "resolution": "360p"})
+    elapsed = time.perf_counter() - start
+
+    videos = response.get_json()["videos"]
+    assert list(videos) == guids
+    assert videos["v0"] == {
+        "url": f"{stream.VIDEO_HOST}/stream/286671/v0/play_360p.mp4",
+        "thumbnail": f"{stream.VIDEO_HOST}/stream/286671/v0/thumbnail.jpg",
+    }
+    assert videos["x0"]["availableResolutions"] == ["720p"]
+    # eight lookups of 200 ms, run side by side
+    assert elapsed < 1
+    assert len([path for _, path in server.requests if "/videos/x" in path]) == 8
+
+
+def test_video_urls_batch_limits(server):
+    from app import app
+    client = app.test_client()
+    assert client.get("/get_video_urls").status_code == 400
+    too_many = ",".join(f"g{i}" for i in range(101))
+    assert client.get(f"/get_video_urls?guids={too_many}").status_code == 400
+
+
+def _search_paths(server):
+    return [path for _, path in server.requests if "search=" in path]
+
+
+def test_title_search_answers_from_the_local_index(server):
+    server.total = 250
+    server.titles = {3: "Noticias de la Mañana", 7: "Mañanera especial", 120: "El Café de las 7", 200: "Noticias Deportivas"}
+    myStream = Stream()
+    myStream.RefreshTitleIndex()
+    server.requests.clear()
+
+    found = myStream.GetVideoByTitle(286671, "manana")
+    assert [item["guid"] for item in found["items"]] == ["v3"]
+    # word prefixes, newest first on ties
+    assert [item["guid"] for item in myStream.GetVideoByTitle(286671, "notic")["items"]] == ["v200", "v3"]
+    # typo
+    assert [item["guid"] for item in myStream.GetVideoByTitle(286671, "cafe de las 7")["items"]] == ["v120"]
+    assert [item["guid"] for item in myStream.GetVideoByTitle(286671, "notisias")["items"]] == ["v200", "v3"]
+    # pages of matches
+    page = myStream.GetVideoByTitle(286671, "video", page=2, itemsPerPage=100)
+    assert page["totalItems"] == 246
+    assert page["currentPage"] == 2
+    assert len(page["items"]) == 100
+    assert server.requests == []
+
+
+def test_title_search_falls_back_to_bunny(server):
+    server.total = 5
+    server.titles = {1: "Café & más"}
+    myStream = Stream()
+    # the index is still being built: Bunny answers, with the title URL-encoded
+    found = myStream.GetVideoByTitle(286671, "Café & más")
+    assert [item["guid"] for item in found["items"]] == ["v1"]
+    assert parse.parse_qs(parse.urlparse(_search_paths(server)[0]).query)["search"] == ["Café & más"]
+
+    for _ in range(100):
+        if stream.title_index.search(286671, "video") is not None:
+            break
+        time.sleep(0.01)
+    server.requests.clear()
+    assert myStream.GetVideoByTitle(286671, "cafe")["items"][0]["guid"] == "v1"
+    assert server.requests == []
+    # no local match, or another library: Bunny is asked
+    assert myStream.GetVideoByTitle(286671, "zzz")["items"] == []
+    assert len(_search_paths(server)) == 1
+
+
+def test_title_index_drops_deleted_videos(server, monkeypatch):
+    server.total = 3
+    myStream = Stream()
+    myStream.RefreshTitleIndex()
+    assert stream.title_index.search(286671, "video 2")["totalItems"] == 1
+    server.total = 2
+    monkeypatch.setattr(stream.title_index, "ttl", 0)
+    myStream.RefreshTitleIndex()
+    assert stream.title_index.search(286671, "video 2") is None
+
+
+def test_title_search_route_pages(server):
+    from app import app
+    server.total = 30
+    Stream().RefreshTitleIndex()
+    server.requests.clear()
+    response = app.test_client().get("/get_video_by_title?libraryId=286671&title=video&page=3&itemsPerPage=12")
+    data = response.get_json()
+    assert (data["totalItems"], data["currentPage"], len(data["items"])) == (30, 3, 6)
+    assert server.requests == []
@@ -0,0 +1,185 @@
+"""
+Tests for streaming uploads, run against a local stand-in storage server
+"""
+import asyncio
+import hashlib
+import io
+import tracemalloc
+import pytest
+import storage
+import upstream
+from fake_upstream import FakeUpstream
+
+BOUNDARY = "----tnoradio-upload-boundary"
+PATTERN = bytes(range(256)) * 256  # 64 KiB
+
+
+class MultipartBody(io.RawIOBase):
+    """multipart/form-data body generated on the fly while it is read"""
+
+    def __init__(self, size, fields_before=None, fields_after=None, filename="episode.mp4"):
+        self.size = size
+        self.sha256 = hashlib.sha256()
+        head = b"".join(self._field(name, value) for name, value in (fields_before or {}).items())
+        head += (
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        tail = b"\r\n" + b"".join(self._field(name, value) for name, value in (fields_after or {}).items())
+        tail += f"--{BOUNDARY}--\r\n".encode()
+        self.length = len(head) + size + len(tail)
+        self._parts = iter([head, *self._file(), tail])
+        self._buffer = b""
+
+    @staticmethod
+    def _field(name, value):
+        return f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+
+    def _file(self):
+        remaining = self.size
+        while remaining:
+            chunk = PATTERN[:remaining]
+            self.sha256.update(chunk)
+            remaining -= len(chunk)
+            yield chunk
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            part = next(self._parts, None)
+            if part is None:
+                break
+            self._buffer += part
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    def put(handler):
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in handler.iter_body():
+            digest.update(chunk)
+            size += len(chunk)
+        handler.server.uploads[handler.path] = (size, digest.hexdigest())
+        return 201, {"HttpCode": 201, "Message": "File uploaded."}
+
+    with FakeUpstream({("PUT", "*"): put}) as fake:
+        fake.uploads = {}
+        monkeypatch.setattr(storage, "STORAGE_BASE_URL", fake.url)
+        upstream.set_session(None)
+        yield fake
+    upstream.set_session(None)
+
+
+def _post(body, query=""):
+    from app import app
+    # wsgi.input is handed over as is: the test client would read a seekable stream whole
+    return app.test_client().post(
+        "/upload_file" + query,
+        environ_overrides={
+            "wsgi.input": body,
+            "CONTENT_LENGTH": str(body.length),
+            "CONTENT_TYPE": f"multipart/form-data; boundary={BOUNDARY}",
+        },
+    )
+
+
+def test_large_upload_streams_with_bounded_memory(server):
+    size = 96 * 1024 * 1024
+    body = MultipartBody(size, {"show_slug": "show", "image_type": "video"})
+    # warm up imports and pools so they don't count as upload memory
+    _post(MultipartBody(1024, {"show_slug": "show", "image_type": "video"}))
+
+    tracemalloc.start()
+    response = _post(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert response.status_code == 200
+    assert response.get_json()["file_path"] == "video/episode.mp4"
+    assert server.uploads["/shows-tnoradio/show/video/episode.mp4"] == (size, body.sha256.hexdigest())
+    assert peak < 2 * 1024 * 1024
+
+
+def test_fields_after_the_file_still_upload(server):
+    body = MultipartBody(300 * 1024, fields_after={"show_slug": "show", "image_type": "logo"}, filename="logo.png")
+    response = _post(body)
+    assert response.status_code == 200
+    assert server.uploads["/shows-tnoradio/show/logo/logo.png"] == (300 * 1024, body.sha256.hexdigest())
+
+
+def test_missing_parameters_are_rejected(server):
+    response = _post(MultipartBody(1024, {"show_slug": "show"}))
+    assert response.status_code == 400
+    assert server.uploads == {}
+
+
+def test_file_part_without_a_name_is_rejected(server):
+    # what browsers send when the form goes without a file selected
+    response = _post(MultipartBody(0, {"show_slug": "show", "image_type": "logo"}, filename=""))
+    assert response.status_code == 400
+    assert server.uploads == {}
+
+
+def test_async_upload_streams_to_storage(server):
+    from asgi import app
+    size = 8 * 1024 * 1024
+    body = MultipartBody(size, {"image_type": "video"})
+
+    async def call():
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            return await app.test_client().post(
+                "/upload_file?show_slug=show",
+                data=body.read(),
+                headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"},
+            )
+        finally:
+            await upstream.aclose_async_client()
+
+    response = asyncio.run(call())
+    assert response.status_code == 200
+    assert server.uploads["/shows-tnoradio/show/video/episode.mp4"] == (size, body.sha256.hexdigest())
+
+
+def test_put_files_sends_checksums_and_resumes(server, tmp_path):
+    failing = {"/shows-tnoradio/show/media/b.bin"}
+
+    def put(handler):
+        body = b"".join(handler.iter_body())
+        if handler.path in failing:
+            return 400, {"HttpCode": 400, "Message": "Checksum mismatch"}
+        assert handler.headers["Checksum"] == hashlib.sha256(body).hexdigest().upper()
+        handler.server.uploads[handler.path] = len(body)
+        return 201, {"HttpCode": 201}
+
+    server.routes[("PUT", "*")] = put
+    files = []
+    for name in ("a.bin", "b.bin", "c.bin"):
+        (tmp_path / name).write_bytes(name.encode() * 10000)
+        files.append((str(tmp_path / name), f"media/{name}"))
+    manifest = str(tmp_path / "manifest.json")
+    myStorage = storage.Storage("key", "shows-tnoradio", "show")
+
+    results = myStorage.PutFiles(files, workers=3, manifest_path=manifest)
+    assert {path: result["status"] for path, result in results.items()} == {
+        "media/a.bin": "success", "media/b.bin": "error", "media/c.bin": "success",
+    }
+
+    failing.clear()
+    server.requests.clear()
+    results = myStorage.PutFiles(files, workers=3, manifest_path=manifest)
+    assert results["media/a.bin"]["status"] == "skipped"
+    assert results["media/b.bin"]["status"] == "success"
+    assert [path for method, path in server.requests] == ["/shows-tnoradio/show/media/b.bin"]
@@ -0,0 +1,156 @@
+"""
+Tests for the shared upstream HTTP client, run against a local stand-in server
+"""
+import os
+import time
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import upstream
+from fake_upstream import FakeUpstream
+from storage import Storage, listing_cache
+
+
+def _read_body(handler):
+    length = int(handler.headers.get("Content-Length", 0))
+    return handler.rfile.read(length)
+
+
+@pytest.fixture
+def server():
+    def put(handler):
+        handler.server.uploads[handler.path] = _read_body(handler)
+        return 201, {"HttpCode": 201, "Message": "File uploaded."}
+
+    routes = {
+        ("GET", "*"): lambda handler: (200, [{"ObjectName": "logo.png", "IsDirectory": False}]),
+        ("PUT", "*"): put,
+        ("DELETE", "*"): lambda handler: (200, {"HttpCode": 200}),
+    }
+    with FakeUpstream(routes) as fake:
+        fake.uploads = {}
+        upstream.set_session(upstream.build_session(backoff_factor=0))
+        yield fake
+    upstream.set_session(None)
+
+
+def _storage(server):
+    myStorage = Storage("key", "shows-tnoradio", "show")
+    myStorage.base_url = server.url + "/shows-tnoradio/show/"
+    return myStorage
+
+
+def test_requests_share_one_keep_alive_connection(server):
+    for _ in range(25):
+        response = upstream.get(server.url + "/library/1/videos")
+        assert response.status_code == 200
+    assert len(server.requests) == 25
+    assert server.connections == 1
+
+
+def test_storage_operations_reuse_the_pool(server, tmp_path):
+    (tmp_path / "logo.png").write_bytes(b"x" * 4096)
+    myStorage = _storage(server)
+
+    for _ in range(5):
+        # every listing goes upstream
+        listing_cache.clear()
+        assert myStorage.GetStoragedObjectsList("images") == [{"File_Name": "logo.png"}]
+        result = myStorage.PutFile("logo.png", "images/logo.png", str(tmp_path))
+        assert result["status"] == "success"
+        assert myStorage.DeleteFile("images/logo.png")["status"] == "success"
+
+    assert server.uploads["/shows-tnoradio/show/images/logo.png"] == b"x" * 4096
+    assert len(server.requests) == 15
+    assert server.connections == 1
+
+
+def test_retryable_statuses_are_retried(server):
+    server.fail_next("/library/1/videos", times=2)
+    response = upstream.get(server.url + "/library/1/videos")
+    assert response.status_code == 200
+    assert len(server.requests) == 3
+
+
+def test_retries_are_bounded(server):
+    upstream.set_session(upstream.build_session(max_retries=1, backoff_factor=0))
+    server.fail_next("/library/1/videos", times=5)
+    response = upstream.get(server.url + "/library/1/videos")
+    assert response.status_code == 503
+    assert len(server.requests) == 2
+
+
+def test_session_is_rebuilt_after_fork(server, monkeypatch):
+    session = upstream.get_session()
+    monkeypatch.setattr(os, "getpid", lambda: -1)
+    assert upstream.get_session() is not session
+
+
+def _slow(handler):
+    time.sleep(0.2)
+    return 200, {"guid": handler.path.rsplit("/", 1)[1]}
+
+
+def test_identical_requests_in_flight_share_one_call():
+    with FakeUpstream({("GET", "*"): _slow}) as fake:
+        upstream.set_session(upstream.build_session(backoff_factor=0))
+        before = upstream.coalescing_stats()
+        try:
+            with ThreadPoolExecutor(max_workers=20) as pool:
+                responses = list(pool.map(
+                    lambda i: upstream.get(f"{fake.url}/videos/v{i % 2}", headers={"AccessKey": "key"}), range(20),
+                ))
+            # a different key is a different request
+            upstream.get(f"{fake.url}/videos/v0", headers={"AccessKey": "other"})
+        finally:
+            upstream.set_session(None)
+    assert [response.json()["guid"] for response in responses] == [f"v{i % 2}" for i in range(20)]
+    assert sorted(path for _, path in fake.requests) == ["/videos/v0", "/videos/v0", "/videos/v1"]
+    after = upstream.coalescing_stats()
+    assert after["calls"] - before["calls"] == 3
+    assert after["coalesced"] - before["coalesced"] == 18
+
+
+def test_async_identical_requests_share_one_call():
+    async def call(url):
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            responses = await asyncio.gather(*(upstream.aget(url) for _ in range(10)))
+            return [await response.json(content_type=None) for response in responses]
+        finally:
+            await upstream.aclose_async_client()
+
+    with FakeUpstream({("GET", "*"): _slow}) as fake:
+        before = upstream.coalescing_stats()["coalesced"]
+        assert asyncio.run(call(fake.url + "/videos/v7")) == [{"guid": "v7"}] * 10
+    assert len(fake.requests) == 1
+    assert upstream.coalescing_stats()["coalesced"] - before == 9
+
+
+def test_requests_with_a_body_are_not_coalesced(server):
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        list(pool.map(lambda i: upstream.put(server.url + "/shows-tnoradio/show/a.txt", data=b"x"), range(5)))
+    assert len(server.requests) == 5
+
+
+def test_async_followers_survive_the_leader_being_cancelled():
+    async def main(url):
+        upstream.set_async_client(upstream.build_async_client())
+        try:
+            leader = asyncio.ensure_future(upstream.aget(url))
+            await asyncio.sleep(0.05)
+            followers = [asyncio.ensure_future(upstream.aget(url)) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            # the leader's client goes away mid-request
+            leader.cancel()
+            responses = await asyncio.gather(*followers)
+            return leader.cancelled(), [await response.json(content_type=None) for response in responses]
+        finally:
+            await upstream.aclose_async_client()
+
+    with FakeUpstream({("GET", "*"): _slow}) as fake:
+        cancelled, bodies = asyncio.run(main(fake.url + "/videos/v3"))
+    assert cancelled
+    assert bodies == [{"guid": "v3"}] * 5
+    # the cancelled call, and one follower's in its place
+    assert len(fake.requests) == 2
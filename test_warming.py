@@ -0,0 +1,122 @@
+"""
+Tests for the background warming of the listing caches, run against a local stand-in server
+"""
+import json
+import subprocess
+import sys
+import time
+import pytest
+import stream
+import upstream
+import warming
+from fake_upstream import FakeUpstream
+from test_stream import _videos
+
+HOLD_LOCK = """
+import fcntl, os, sys
+fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)
+fcntl.lockf(fd, fcntl.LOCK_EX)
+print("locked", flush=True)
+sys.stdin.read()
+"""
+
+
+def _collections(handler):
+    items = [{"guid": f"c{i}", "name": f"Colección {i}"} for i in range(3)]
+    return 200, {"totalItems": len(items), "items": items}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeUpstream({
+        ("GET", "/library/286671/collections"): _collections, ("GET", "/library/286671/videos"): _videos,
+    }) as fake:
+        fake.total = 150
+        fake.titles = {}
+        upstream.set_session(upstream.build_session(backoff_factor=0))
+        monkeypatch.setattr(stream, "BASE_URL", fake.url + "/library")
+        monkeypatch.setattr(stream, "VIDEOS_PAGE_SIZE", 100)
+        stream.cache.clear()
+        stream.video_index.clear()
+        yield fake
+    stream.cache.clear()
+    stream.video_index.clear()
+    upstream.set_session(None)
+
+
+def _warmer(tmp_path, **kwargs):
+    return warming.Warmer(snapshot_path=str(tmp_path / "warm.json"), **kwargs)
+
+
+def _listing(path):
+    return path.split("?")[0].rsplit("/", 1)[1]
+
+
+def test_tick_warms_the_listings_and_writes_the_snapshot(server, tmp_path):
+    warmer = _warmer(tmp_path, video_collections="all,*", collections_interval=300, videos_interval=100)
+    wait = warmer.tick()
+
+    # the collections listing, then the whole library and each collection, two pages each
+    assert [_listing(path) for _, path in server.requests].count("collections") == 1
+    assert sum("collection=c" in path for _, path in server.requests) == 6
+    assert len(server.requests) == 1 + 4 * 2
+    assert stream.Stream().IsVideosListCached("c2")
+    assert stream.get_video("v149", None) == {"guid": "v149", "availableResolutions": "360p,720p"}
+    # refreshed before the 120 s TTL, up to 10% early
+    assert 89 < wait <= 100
+
+    # nothing is due yet
+    warmer.tick()
+    assert len(server.requests) == 9
+    keys = {tuple(entry["key"]) for entry in json.loads((tmp_path / "warm.json").read_text())["entries"]}
+    assert keys == {("collections", 286671), ("videos", ""), ("videos", "c0"), ("videos", "c1"), ("videos", "c2")}
+
+
+def test_new_workers_start_from_the_snapshot(server, tmp_path):
+    _warmer(tmp_path, video_collections="all,*").tick()
+    validator = stream.Stream().VideosValidator("c1")
+    requests = len(server.requests)
+    stream.cache.clear()
+    stream.video_index.clear()
+
+    warmer = _warmer(tmp_path)
+    assert len(warmer.load_snapshot()) == 5
+    assert stream.Stream().VideosValidator("c1") == validator
+    assert stream.get_video("v3", None)["guid"] == "v3"
+    # restored listings are not refreshed again until they are due
+    warmer.tick()
+    assert len(server.requests) == requests
+
+
+def test_only_the_whole_library_is_warmed_unless_asked(server, tmp_path):
+    _warmer(tmp_path).tick()
+    assert not any("collection=" in path for _, path in server.requests)
+    assert stream.Stream().IsVideosListCached("")
+
+    # "*" warms the first collections of the listing, up to max_collections
+    server.requests.clear()
+    _warmer(tmp_path, video_collections="*", max_collections=2).tick()
+    assert {path.split("collection=")[1].split("&")[0] for _, path in server.requests if "collection=" in path} == {"c0", "c1"}
+
+
+def test_only_one_process_refreshes(server, tmp_path):
+    # lock files are per process: another process holds it
+    holder = subprocess.Popen(
+        [sys.executable, "-c", HOLD_LOCK, str(tmp_path / "warm.json.lock")], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    try:
+        assert holder.stdout.readline() == b"locked\n"
+        _warmer(tmp_path, video_collections="all").tick()
+    finally:
+        holder.communicate(b"")
+    assert server.requests == []
+
+
+def test_listings_are_refreshed_before_they_expire(server, tmp_path):
+    warmer = _warmer(tmp_path, video_collections="c1", videos_interval=0.2, jitter=0)
+    warmer.tick()
+    stored_at = stream.Stream().VideosStoredAt("c1")
+    time.sleep(0.25)
+    warmer.tick()
+    assert stream.Stream().VideosStoredAt("c1") > stored_at
+    assert sum("collection=c1" in path for _, path in server.requests) == 4
@@ -0,0 +1,221 @@
+"""
+Tests for the local YouTube playlist index, run against a local stand-in for the Data API
+"""
+import json
+from urllib import parse
+import pytest
+import youtube
+from fake_upstream import FakeUpstream
+from playlist_index import PlaylistIndex
+
+
+def _page(handler, items):
+    query = parse.parse_qs(parse.urlparse(handler.path).query)
+    start = int(query.get("pageToken", ["0"])[0])
+    size = int(query.get("maxResults", [handler.server.page_size])[0])
+    size = min(size, handler.server.page_size)
+    # each page has its own ETag
+    etag = "page-" + json.dumps(items[start:start + size])
+    if handler.headers.get("If-None-Match") == etag:
+        return 304, b""
+    data = {"etag": etag, "items": items[start:start + size]}
+    if start + size < len(items):
+        data["nextPageToken"] = str(start + size)
+    return 200, data
+
+
+def _playlists(handler):
+    query = parse.parse_qs(parse.urlparse(handler.path).query)
+    handler.server.keys.append(query["key"][0])
+    playlists = handler.server.playlists if query["channelId"][0] == "UC1" else handler.server.other_playlists
+    items = [
+        {"id": playlist_id, "etag": f"{playlist_id}-{len(videos)}", "snippet": {"title": title}}
+        for playlist_id, (title, videos) in playlists.items()
+    ]
+    return _page(handler, items)
+
+
+def _playlist_items(handler):
+    query = parse.parse_qs(parse.urlparse(handler.path).query)
+    handler.server.keys.append(query["key"][0])
+    _, videos = {**handler.server.playlists, **handler.server.other_playlists}[query["playlistId"][0]]
+    items = [
+        {"snippet": {"title": f"Episode {video}", "publishedAt": f"2024-01-{video:02d}T00:00:00Z",
+                     "resourceId": {"videoId": f"vid{video}"}}}
+        for video in videos
+    ]
+    return _page(handler, items)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    routes = {
+        ("GET", "/playlists"): _playlists, ("GET", "/playlistItems"): _playlist_items,
+        # paths of the discovery client
+        ("GET", "/youtube/v3/playlists"): _playlists, ("GET", "/youtube/v3/playlistItems"): _playlist_items,
+    }
+    with FakeUpstream(routes) as fake:
+        fake.keys = []
+        fake.page_size = 50
+        fake.playlists = {
+            "PL1": ("Noticias de la Mañana", list(range(1, 61))),
+            "PL2": ("Deportes", [1, 2]),
+        }
+        fake.other_playlists = {"PL9": ("Deportes Extra", [3, 1, 50])}
+        monkeypatch.setattr(youtube, "YOUTUBE_API_URL", fake.url)
+        monkeypatch.setattr(youtube, "TNO_API_KEY", "tno-key")
+        monkeypatch.setattr(youtube, "TNO_CHANNEL_ID", "UC1")
+        monkeypatch.setattr(youtube, "PROGRAMAS_API_KEY", "programas-key")
+        monkeypatch.setattr(youtube, "PROGRAMAS_CHANNEL_ID", "UC2")
+        yield fake
+
+
+@pytest.fixture
+def index(tmp_path):
+    return PlaylistIndex(str(tmp_path / "youtube.sqlite3"), interval=0)
+
+
+def _paths(server):
+    return [parse.urlparse(path).path for _, path in server.requests]
+
+
+def test_first_sync_fills_the_index(server, index):
+    assert index.sync("tnoradio") == 2
+    assert index.playlists("tnoradio") == [
+        {"title": "Noticias de la Mañana", "playlist_id": "PL1"},
+        {"title": "Deportes", "playlist_id": "PL2"},
+    ]
+    items = index.playlist_items("tnoradio", "noticias")
+    assert len(items) == 60
+    assert items[0] == {"title": "Episode 1", "video_id": "vid1", "published_at": "2024-01-01T00:00:00Z"}
+    assert index.playlist_items("tnoradio", "missing") == []
+    # 60 items take two pages
+    assert _paths(server) == ["/playlists", "/playlistItems", "/playlistItems", "/playlistItems"]
+
+
+def test_unchanged_channel_costs_one_conditional_request(server, index):
+    index.sync("tnoradio")
+    server.requests.clear()
+    assert index.sync("tnoradio") == 0
+    assert _paths(server) == ["/playlists"]
+
+
+def test_only_changed_playlists_are_read_again(server, index):
+    index.sync("tnoradio")
+    server.requests.clear()
+    server.playlists["PL2"] = ("Deportes", [1, 2, 3])
+    server.playlists["PL3"] = ("Cultura", [4])
+    del server.playlists["PL1"]
+    assert index.sync("tnoradio") == 2
+    assert [playlist["playlist_id"] for playlist in index.playlists("tnoradio")] == ["PL2", "PL3"]
+    assert len(index.items("PL2")) == 3
+    assert index.items("PL1") == []
+    assert _paths(server) == ["/playlists", "/playlistItems", "/playlistItems"]
+
+
+def test_changes_past_the_first_page_are_synced(server, index):
+    server.page_size = 2
+    server.playlists["PL3"] = ("Cultura", [4])
+    index.sync("tnoradio")
+    server.requests.clear()
+    assert index.sync("tnoradio") == 0
+    # one conditional request per page
+    assert _paths(server) == ["/playlists", "/playlists"]
+
+    server.playlists["PL3"] = ("Cultura y Arte", [4])
+    server.playlists["PL4"] = ("Entrevistas", [5])
+    # the new playlist's items are read, the renamed one's are not
+    assert index.sync("tnoradio") == 1
+    assert [playlist["title"] for playlist in index.playlists("tnoradio")][2:] == ["Cultura y Arte", "Entrevistas"]
+
+
+def test_episode_validators_follow_the_committed_content(server, index):
+    index.sync("tnoradio")
+    before = index.validators()
+    # listing pages with other ETags, same content
+    server.page_size = 2
+    index.sync("tnoradio", full=True)
+    assert index.validators() == before
+    server.playlists["PL1"] = ("Noticias de la Mañana", list(range(1, 62)))
+    index.sync("tnoradio")
+    assert index.validators()[0] != before[0]
+    assert index.validators()[1] == before[1]
+
+
+def test_index_persists_across_processes(server, index):
+    index.sync("tnoradio")
+    server.requests.clear()
+    reopened = PlaylistIndex(index.path)
+    reopened.ensure_synced("tnoradio")
+    assert len(reopened.playlist_items("tnoradio", "Deportes")) == 2
+    assert server.requests == []
+
+
+def test_routes_answer_from_the_index(server, index, monkeypatch):
+    import app as flask_app
+    monkeypatch.setattr(flask_app, "playlist_index", index)
+    monkeypatch.setattr(index, "start", lambda: None)
+    client = flask_app.app.test_client()
+    playlists = client.get("/get_youtube_playlists?channel=tnoradio").get_json()
+    assert [playlist["playlist_id"] for playlist in playlists] == ["PL1", "PL2"]
+    server.requests.clear()
+    items = client.get("/get_playlist_items?channel=tnoradio&playlist_name=deportes").get_json()
+    assert [item["video_id"] for item in items] == ["vid1", "vid2"]
+    assert server.requests == []
+
+
+def _expected_episodes():
+    return [
+        ("vid1", "tnoradio"), ("vid1", "programas"), ("vid2", "tnoradio"), ("vid3", "programas"), ("vid50", "programas"),
+    ]
+
+
+def test_episodes_of_both_channels_are_merged_by_date(server, index, monkeypatch):
+    import app as flask_app
+    monkeypatch.setattr(flask_app, "playlist_index", index)
+    monkeypatch.setattr(index, "start", lambda: None)
+    response = flask_app.app.test_client().get("/get_all_episodes_sorted?playlist_name=deportes")
+    episodes = response.get_json()
+    assert [(episode["video_id"], episode["channel"]) for episode in episodes] == _expected_episodes()
+    assert episodes[0]["video_url"] == "https://www.youtube.com/watch?v=vid1"
+    server.requests.clear()
+    again = flask_app.app.test_client().get(
+        "/get_all_episodes_sorted?playlist_name=deportes", headers={"If-None-Match": response.headers["ETag"]},
+    )
+    assert again.status_code == 304
+    assert server.requests == []
+
+
+def test_each_channel_is_synced_with_its_own_key(server, index):
+    for channel in youtube.CHANNELS:
+        index.sync(channel)
+    episodes = index.all_episodes_sorted("deportes")
+    assert [(episode["video_id"], episode["channel"]) for episode in episodes] == _expected_episodes()
+    assert set(server.keys) == {"tno-key", "programas-key"}
+    # playlists are listed once per channel
+    assert len([path for _, path in server.requests if "/playlists?" in path]) == 2
+
+
+def test_playlist_search_is_accent_insensitive_and_follows_syncs(server, index):
+    index.sync("tnoradio")
+    index.sync("programas")
+    assert index.find_playlist("tnoradio", "MANANA")["playlist_id"] == "PL1"
+    assert [playlist["playlist_id"] for playlist in index.search("depor")] == ["PL2", "PL9"]
+    assert index.search("depor", channels=("programas",)) == [
+        {"title": "Deportes Extra", "playlist_id": "PL9", "channel": "programas"},
+    ]
+    server.playlists["PL4"] = ("Deportivo Mañanero", [5])
+    index.sync("tnoradio")
+    assert [playlist["playlist_id"] for playlist in index.search("depor man")] == ["PL4"]
+
+
+def test_playlist_search_route(server, index, monkeypatch):
+    import app as flask_app
+    monkeypatch.setattr(flask_app, "playlist_index", index)
+    monkeypatch.setattr(index, "start", lambda: None)
+    client = flask_app.app.test_client()
+    response = client.get("/search_youtube_playlists?q=noticias%20man&channel=tnoradio")
+    assert response.get_json() == [{"title": "Noticias de la Mañana", "playlist_id": "PL1", "channel": "tnoradio"}]
+    response = client.get("/search_youtube_playlists?q=deportes&limit=1")
+    assert [playlist["playlist_id"] for playlist in response.get_json()] == ["PL2"]
+    assert client.get("/search_youtube_playlists").status_code == 400
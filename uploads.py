@@ -0,0 +1,196 @@
+"""Streaming multipart/form-data reader, so uploads go to Bunny storage without a temp file"""
+
+import tempfile
+from collections import deque
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class MultipartUpload:
+    """
+    Reads a multipart/form-data body incrementally, one chunk at a time.
+    Form fields sent before the file are collected in `fields`. The content of
+    the first file part is then handed out chunk by chunk, so no more than a
+    couple of chunks of the upload are held in memory whatever its size.
+    Other file parts are skipped.
+    Parameters
+    ----------
+    boundary   : String
+                 The multipart boundary of the request
+    chunk_size : Int
+                 Bytes read from the request body at a time
+    """
+
+    def __init__(self, boundary, chunk_size=CHUNK_SIZE):
+        self.decoder = MultipartDecoder(boundary.encode("latin-1"))
+        self.chunk_size = chunk_size
+        self.fields = {}
+        self.filename = None
+        self.done = False
+        self.file_done = False
+        self._state = None
+        self._name = None
+        self._value = bytearray()
+        self._pending = deque()
+
+    def feed(self, chunk):
+        """Feeds the next chunk of the body (b"" at the end of the body)"""
+        if not chunk:
+            self.decoder.receive_data(None)
+        else:
+            self.decoder.receive_data(chunk)
+        while True:
+            event = self.decoder.next_event()
+            if isinstance(event, NeedData):
+                break
+            if isinstance(event, Epilogue):
+                self.done = True
+                break
+            if isinstance(event, File):
+                self._on_file(event)
+            elif isinstance(event, Field):
+                self._state = "field"
+                self._name = event.name
+                self._value = bytearray()
+            elif isinstance(event, Data):
+                self._on_data(event)
+        if not chunk and not self.done:
+            raise ValueError("Incomplete multipart body")
+
+    def _on_file(self, event):
+        if self.filename is None:
+            self.filename = event.filename
+            self._state = "file"
+        else:
+            self._state = "skip"
+
+    def _on_data(self, event):
+        if self._state == "field":
+            self._value += event.data
+            if len(self._value) > MAX_FIELD_SIZE:
+                raise ValueError(f"Form field {self._name} is too large")
+            if not event.more_data:
+                self.fields[self._name] = self._value.decode("utf-8")
+                self._state = None
+        elif self._state == "file":
+            if event.data:
+                self._pending.append(event.data)
+            if not event.more_data:
+                self.file_done = True
+                self._state = None
+        elif not event.more_data:
+            self._state = None
+
+    def _next_file_chunk(self):
+        """Returns (has_chunk, chunk) from what has already been decoded"""
+        if self._pending:
+            return True, self._pending.popleft()
+        return False, None
+
+    # Sync readers (Flask: request.stream)
+
+    def read_until_file(self, stream):
+        """Reads the fields that come before the file (or the whole body if there is none)"""
+        while self.filename is None and not self.done:
+            self.feed(stream.read(self.chunk_size))
+        return self.fields
+
+    def iter_file(self, stream):
+        """Yields the content of the file part as it is read from the body"""
+        while True:
+            has_chunk, chunk = self._next_file_chunk()
+            if has_chunk:
+                yield chunk
+            elif self.file_done or self.done:
+                return
+            else:
+                self.feed(stream.read(self.chunk_size))
+
+    def read_to_end(self, stream):
+        """Reads what is left of the body (fields sent after the file)"""
+        while not self.done:
+            self.feed(stream.read(self.chunk_size))
+            self._pending.clear()
+        return self.fields
+
+    # Async readers (Quart: request.body)
+
+    async def _aread(self, chunks):
+        try:
+            return await chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+
+    async def aread_until_file(self, chunks):
+        while self.filename is None and not self.done:
+            self.feed(await self._aread(chunks))
+        return self.fields
+
+    async def aiter_file(self, chunks):
+        while True:
+            has_chunk, chunk = self._next_file_chunk()
+            if has_chunk:
+                yield chunk
+            elif self.file_done or self.done:
+                return
+            else:
+                self.feed(await self._aread(chunks))
+
+    async def aread_to_end(self, chunks):
+        while not self.done:
+            self.feed(await self._aread(chunks))
+            self._pending.clear()
+        return self.fields
+
+
+class MultipartFiles(MultipartUpload):
+    """
+    Reads a multipart/form-data body with any number of file parts. Each file
+    is spooled as it arrives (in memory up to spool_size bytes, then in a
+    temporary file) and handed out once complete by read_next_file(), so it
+    can be uploaded while the rest of the body is still being read. Form
+    fields are collected in `fields` on the way.
+    Parameters
+    ----------
+    boundary   : String
+                 The multipart boundary of the request
+    spool_size : Int
+                 Bytes of a file kept in memory before it is spooled to disk
+    chunk_size : Int
+                 Bytes read from the request body at a time
+    """
+
+    def __init__(self, boundary, spool_size, chunk_size=CHUNK_SIZE):
+        super().__init__(boundary, chunk_size)
+        self.spool_size = spool_size
+        self._spool = None
+        self._files = deque()
+
+    def _on_file(self, event):
+        self.filename = event.filename
+        self._spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        self._state = "file"
+
+    def _on_data(self, event):
+        if self._state != "file":
+            super()._on_data(event)
+            return
+        self._spool.write(event.data)
+        if not event.more_data:
+            self._spool.seek(0)
+            self._files.append((self.filename, self._spool))
+            self._spool = None
+            self._state = None
+
+    def read_next_file(self, stream):
+        """Returns (filename, spooled file) of the next complete file part, or None after the last one"""
+        while not self._files and not self.done:
+            self.feed(stream.read(self.chunk_size))
+        return self._files.popleft() if self._files else None
+
+    async def aread_next_file(self, chunks):
+        while not self._files and not self.done:
+            self.feed(await self._aread(chunks))
+        return self._files.popleft() if self._files else None
@@ -0,0 +1,285 @@
+"""Shared HTTP client for the upstream BunnyCDN APIs"""
+
+import os
+import asyncio
+import threading
+import weakref
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from cache import SingleFlight, leader_cancelled
+
+# Cargar variables de entorno desde .env
+load_dotenv()
+
+POOL_CONNECTIONS = int(os.getenv('UPSTREAM_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.getenv('UPSTREAM_POOL_MAXSIZE', 32))
+CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 30))
+MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', 3))
+BACKOFF_FACTOR = float(os.getenv('UPSTREAM_BACKOFF_FACTOR', 0.3))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+# Conexiones simultaneas del cliente async (modo ASGI)
+ASYNC_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_ASYNC_MAX_CONNECTIONS', 1000))
+# Peticiones identicas en curso (GET/HEAD sin cuerpo) comparten una sola llamada ("0" para desactivarlo)
+COALESCE = os.getenv('UPSTREAM_COALESCE', '1').lower() not in ('0', 'false', 'no')
+COALESCE_METHODS = frozenset(["GET", "HEAD"])
+
+# Sessions by pid and retry policy: {(pid, retry): Session}
+_sessions = {}
+_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+# In-flight requests shared by identical ones: threads, and futures by event loop
+_flight = SingleFlight()
+_aflights = weakref.WeakKeyDictionary()
+_astats = {"calls": 0, "shared": 0}
+
+
+def build_session(
+    pool_connections=POOL_CONNECTIONS,
+    pool_maxsize=POOL_MAXSIZE,
+    max_retries=MAX_RETRIES,
+    backoff_factor=BACKOFF_FACTOR,
+):
+    """
+    Builds a requests Session with keep-alive connection pools per host
+    Parameters
+    ----------
+    pool_connections : Int
+                       Number of per-host pools to keep around
+    pool_maxsize     : Int
+                       Maximum number of idle connections kept per host
+    max_retries      : Int
+                       Retries for connection errors and retryable statuses
+                       of idempotent methods (GET, PUT, DELETE, HEAD)
+    backoff_factor   : Float
+                       Exponential backoff between retries, in seconds
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=RETRY_METHODS,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+        pool_block=False,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(retry=True):
+    """
+    Returns the process-wide Session, building it on first use.
+    Pools are never shared across a fork: a gunicorn worker gets its own.
+    With retry=False the Session never retries, for bodies that cannot be
+    replayed (generators streaming an incoming upload).
+    """
+    key = (os.getpid(), retry)
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = build_session(max_retries=MAX_RETRIES if retry else 0)
+    return session
+
+
+def set_session(session, retry=True):
+    """Replaces the process-wide Session (used by tests and benchmarks). None resets both."""
+    with _lock:
+        if session is None:
+            _sessions.clear()
+        else:
+            _sessions[(os.getpid(), retry)] = session
+
+
+def _frozen(value):
+    if isinstance(value, dict):
+        return tuple(sorted((name, _frozen(item)) for name, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(item) for item in value)
+    return value
+
+
+def _coalesce_key(method, url, options, kwargs):
+    """
+    Key under which identical requests share one call, or None for those
+    that can't: other methods, requests with a body, and streamed responses
+    (each caller consumes its own).
+    """
+    if not COALESCE or method not in COALESCE_METHODS or any(kwargs.get(name) for name in ("data", "json", "files", "stream")):
+        return None
+    key = (method, url, options, _frozen(kwargs))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def coalescing_stats():
+    """
+    Upstream calls made by coalescable requests ("calls") and requests
+    answered by an identical one in flight instead ("coalesced": calls saved)
+    """
+    return {
+        "calls": _flight.stats["calls"] + _astats["calls"],
+        "coalesced": _flight.stats["shared"] + _astats["shared"],
+    }
+
+
+def _count(name):
+    with _lock:
+        _astats[name] += 1
+
+
+def request(method, url, retry=True, **kwargs):
+    """
+    Sends a request through the shared pools with the default timeouts.
+    Identical GET/HEAD requests (same URL, headers and options) in flight at
+    the same time share one call and its Response (read in full), or its
+    exception.
+    """
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    key = _coalesce_key(method, url, retry, kwargs)
+    if key is None:
+        return get_session(retry).request(method, url, **kwargs)
+    return _flight.do(key, lambda: get_session(retry).request(method, url, **kwargs))
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def put(url, data=None, **kwargs):
+    return request("PUT", url, data=data, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
+
+
+def build_async_client(
+    max_connections=ASYNC_MAX_CONNECTIONS,
+    max_keepalive=POOL_MAXSIZE,
+):
+    """
+    Builds an aiohttp ClientSession with keep-alive pools and the default
+    timeouts. Must be called with an event loop running.
+    Retries are handled by arequest.
+    """
+    connector = aiohttp.TCPConnector(limit=max_connections, limit_per_host=0, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def get_async_client():
+    """Returns the ClientSession of the running event loop, building it on first use"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.closed:
+        client = _async_clients[loop] = build_async_client()
+    return client
+
+
+def set_async_client(client):
+    """Replaces the ClientSession of the running event loop (used by tests and benchmarks)"""
+    _async_clients[asyncio.get_running_loop()] = client
+
+
+async def aclose_async_client():
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+async def arequest(method, url, stream=False, max_retries=MAX_RETRIES, **kwargs):
+    """
+    Async counterpart of request(). Idempotent methods are retried with backoff
+    on connection errors and RETRY_STATUSES. The body is read before returning
+    unless stream=True, in which case the caller must release() the response.
+    Identical GET/HEAD requests in flight on the event loop share one call.
+    """
+    key = None if stream else _coalesce_key(method, url, max_retries, kwargs)
+    if key is None:
+        return await _arequest(method, url, stream, max_retries, **kwargs)
+    flights = _aflights.setdefault(asyncio.get_running_loop(), {})
+    while True:
+        future = flights.get(key)
+        if future is None:
+            break
+        try:
+            response = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if leader_cancelled(future):
+                # the leader's request was cancelled (its client went away), not ours: a follower takes over
+                continue
+            raise
+        except Exception:
+            _count("shared")
+            raise
+        _count("shared")
+        return response
+    _count("calls")
+    future = flights[key] = asyncio.get_running_loop().create_future()
+    try:
+        response = await _arequest(method, url, stream, max_retries, **kwargs)
+        future.set_result(response)
+        return response
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as err:
+        future.set_exception(err)
+        # the exception is re-raised here; followers retrieve it from the future
+        future.exception()
+        raise
+    finally:
+        del flights[key]
+
+
+async def _arequest(method, url, stream, max_retries, **kwargs):
+    client = get_async_client()
+    retryable = method in RETRY_METHODS
+    attempt = 0
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if not retryable or attempt >= max_retries:
+                raise
+        else:
+            if response.status not in RETRY_STATUSES or not retryable or attempt >= max_retries:
+                if not stream:
+                    # reading to the end hands the connection back; release() would make later read() calls raise
+                    await response.read()
+                return response
+            response.release()
+        await asyncio.sleep(BACKOFF_FACTOR * (2 ** attempt))
+        attempt += 1
+
+
+async def aget(url, **kwargs):
+    return await arequest("GET", url, **kwargs)
+
+
+async def aput(url, data=None, **kwargs):
+    return await arequest("PUT", url, data=data, **kwargs)
+
+
+async def adelete(url, **kwargs):
+    return await arequest("DELETE", url, **kwargs)
@@ -0,0 +1,246 @@
+"""Background warming of the listing caches, shared between the workers of a host through a snapshot on disk"""
+
+import os
+import json
+import time
+import fcntl
+import random
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import stream
+from response_encoding import dumps
+from youtube import CHANNELS
+
+logger = logging.getLogger(__name__)
+
+# Precalentamiento de caches en segundo plano ("0" para desactivarlo)
+WARM_ENABLED = os.getenv('WARM_ENABLED', '1').lower() not in ('0', 'false', 'no')
+# Segundos entre renovaciones de cada listado (antes de que venza su TTL), y variacion aleatoria (fraccion)
+WARM_COLLECTIONS_INTERVAL = float(os.getenv('WARM_COLLECTIONS_INTERVAL', stream.COLLECTIONS_TTL * 0.8))
+WARM_VIDEOS_INTERVAL = float(os.getenv('WARM_VIDEOS_INTERVAL', stream.VIDEOS_TTL * 0.8))
+WARM_JITTER = float(os.getenv('WARM_JITTER', 0.1))
+# Listados renovados a la vez
+WARM_CONCURRENCY = int(os.getenv('WARM_CONCURRENCY', 2))
+# Videos a precalentar: "all" (listado completo), "*" (cada coleccion) o guids de colecciones, separados por coma
+WARM_VIDEO_COLLECTIONS = os.getenv('WARM_VIDEO_COLLECTIONS', 'all')
+# Colecciones que precalienta "*" como maximo (las primeras del listado)
+WARM_MAX_COLLECTIONS = int(os.getenv('WARM_MAX_COLLECTIONS', 8))
+# Copia en disco de los listados, leida por los workers nuevos
+WARM_SNAPSHOT_PATH = os.getenv('WARM_SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), 'tnoradio-warm-cache.json'))
+
+
+class Warmer:
+    """
+    Keeps the Bunny listings behind /get_stream_collections and /get_videos
+    in stream.cache, refreshing each one `interval` seconds after it was
+    stored (less a random fraction of up to `jitter`, so the refreshes of
+    many listings and workers spread out), before its TTL runs out. At most
+    `concurrency` listings are refreshed at once.
+    One process at a time refreshes, under a lock file next to the
+    snapshot, and then writes stream.cache to the snapshot; the other
+    processes restore the snapshot when it changes instead of going
+    upstream, and a new worker restores it as it starts. The YouTube index
+    behind /get_all_episodes_sorted is already on disk: starting the warmer
+    starts its sync and syncs the channels that never were.
+    Parameters
+    ----------
+    client               : Stream
+                           Client whose listings are kept warm
+    snapshot_path        : String
+                           JSON file shared by the workers
+    playlist_index       : PlaylistIndex
+                           YouTube index to sync at startup (optional)
+    collections_interval : Float
+    videos_interval      : Float
+    jitter               : Float, fraction of the interval
+    concurrency          : Int
+    video_collections    : String, see WARM_VIDEO_COLLECTIONS
+    max_collections      : Int, collections "*" expands to at most
+    """
+
+    def __init__(
+        self, client=None, snapshot_path=WARM_SNAPSHOT_PATH, playlist_index=None,
+        collections_interval=WARM_COLLECTIONS_INTERVAL, videos_interval=WARM_VIDEOS_INTERVAL,
+        jitter=WARM_JITTER, concurrency=WARM_CONCURRENCY, video_collections=WARM_VIDEO_COLLECTIONS,
+        max_collections=WARM_MAX_COLLECTIONS,
+    ):
+        self.client = client or stream.Stream()
+        self.snapshot_path = snapshot_path
+        self.playlist_index = playlist_index
+        self.collections_interval = collections_interval
+        self.videos_interval = videos_interval
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.video_collections = [name.strip() for name in video_collections.split(",") if name.strip()]
+        self.max_collections = max_collections
+        self._schedule = {}
+        self._snapshot_mtime = None
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+
+    # Jobs
+
+    def jobs(self):
+        """(name, interval, stored_at, refresh) of every listing to keep warm"""
+        client = self.client
+        jobs = [("collections", self.collections_interval, client.ColletcionsStoredAt, client.RefreshColletcionsList)]
+        for collection in self._collections():
+            jobs.append((
+                f"videos {collection or 'all'}", self.videos_interval,
+                partial(client.VideosStoredAt, collection), partial(client.RefreshVideosList, collection),
+            ))
+        return jobs
+
+    def _collections(self):
+        collections = []
+        for name in self.video_collections:
+            if name == "all":
+                collections.append("")
+            elif name != "*":
+                collections.append(name)
+            elif self.client.ColletcionsStoredAt() is not None:
+                # expanded once the collections listing is cached, each one refreshed every videos_interval
+                guids = [item.get("guid") for item in self.client.GetColletcionsList().get("items", []) if item.get("guid")]
+                collections.extend(guids[:max(0, self.max_collections)])
+        return list(dict.fromkeys(collections))
+
+    def _due_at(self, job):
+        """Wall-clock time at which a job is to run next"""
+        name, interval, stored_at, _ = job
+        stored_at = stored_at()
+        scheduled = self._schedule.get(name)
+        if scheduled is None or scheduled[0] != stored_at:
+            due = time.time() if stored_at is None else stored_at + interval * (1 - self.jitter * random.random())
+            scheduled = self._schedule[name] = (stored_at, due)
+        return scheduled[1]
+
+    def _run(self, jobs):
+        def refresh(job):
+            name, interval, stored_at, load = job
+            before = stored_at()
+            try:
+                load()
+            except Exception as e:
+                logger.warning(f"Warming of {name} failed: {e}")
+            if stored_at() == before:
+                # failed, or not cacheable: retried after a whole interval
+                self._schedule[name] = (before, time.time() + interval)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as pool:
+            list(pool.map(refresh, jobs))
+
+    def tick(self):
+        """
+        Restores a newer snapshot, then runs the jobs that are due unless
+        another process is at it. Returns the seconds until the next job is due.
+        """
+        self.load_snapshot()
+        if any(self._due_at(job) <= time.time() for job in self.jobs()):
+            fd = self._lock()
+            if fd is not None:
+                try:
+                    # another process may have refreshed them while we looked
+                    self.load_snapshot()
+                    ran = set()
+                    while True:
+                        due = [job for job in self.jobs() if job[0] not in ran and self._due_at(job) <= time.time()]
+                        if not due:
+                            break
+                        self._run(due)
+                        ran.update(job[0] for job in due)
+                    if ran:
+                        self.save_snapshot()
+                finally:
+                    self._unlock(fd)
+        return min((self._due_at(job) for job in self.jobs()), default=time.time() + 60) - time.time()
+
+    # Snapshot
+
+    def save_snapshot(self):
+        """Writes the listings of stream.cache to the snapshot (atomically)"""
+        data = {"written_at": time.time(), "entries": stream.cache.snapshot()}
+        partial_path = f"{self.snapshot_path}.{os.getpid()}.part"
+        with open(partial_path, "wb") as file:
+            file.write(dumps(data))
+        os.replace(partial_path, self.snapshot_path)
+        self._snapshot_mtime = os.stat(self.snapshot_path).st_mtime_ns
+
+    def load_snapshot(self):
+        """Restores the snapshot into stream.cache if it changed since it was last read; returns the keys restored"""
+        try:
+            mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if mtime == self._snapshot_mtime:
+            return []
+        try:
+            with open(self.snapshot_path, "rb") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable cache snapshot {self.snapshot_path}: {e}")
+            return []
+        self._snapshot_mtime = mtime
+        restored = stream.cache.restore(data.get("entries", []), time.time() - data.get("written_at", 0))
+        for key in restored:
+            if key[0] == "videos":
+                # the guid index is filled by listings fetched here, not by restored ones
+                stream.index_videos((stream.cache.peek(key) or {}).get("items", []))
+        return restored
+
+    def _lock(self):
+        fd = os.open(self.snapshot_path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _unlock(self, fd):
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    # Background thread
+
+    def start(self):
+        """
+        Restores the snapshot and starts the background warming thread of
+        this process (once per process).
+        """
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        self._schedule.clear()
+        self._snapshot_mtime = None
+        self.load_snapshot()
+
+        def run():
+            synced = self.playlist_index is None
+            while not self._stop.is_set():
+                try:
+                    wait = self.tick()
+                except Exception as e:
+                    logger.warning(f"Cache warming failed: {e}")
+                    wait = 60
+                if not synced:
+                    synced = True
+                    self._sync_youtube()
+                self._stop.wait(min(max(wait, 1.0), 60))
+
+        self._thread = threading.Thread(target=run, name="cache-warming", daemon=True)
+        self._thread.start()
+
+    def _sync_youtube(self):
+        self.playlist_index.start()
+        for channel in CHANNELS:
+            try:
+                self.playlist_index.ensure_synced(channel)
+            except Exception as e:
+                logger.warning(f"YouTube sync of {channel} failed: {e}")
+
+    def stop(self):
+        self._stop.set()
@@ -1,6 +1,7 @@
-from flask import jsonify
-from googleapiclient.discovery import build
 import os
+import heapq
+import upstream
+from search import best_match
 from dotenv import load_dotenv
 
 # Load the .env file
@@ -11,109 +12,85 @@ PROGRAMAS_API_KEY = os.getenv('YOUTUBE_API_KEY')
 TNO_CHANNEL_ID = os.getenv('YOUTUBE_TNORADIO_CHANNEL_ID')
 PROGRAMAS_CHANNEL_ID = os.getenv('YOUTUBE_CHANNEL_ID')
 
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+CHANNELS = ('tnoradio', 'programas')
+
+
+def channel_key(channel):
+    """Name of one of CHANNELS: anything but 'tnoradio' is the programas channel"""
+    return 'tnoradio' if channel == 'tnoradio' else 'programas'
+
+
+def channel_credentials(channel):
+    """(api_key, channel_id) of one of our channels"""
+    if channel_key(channel) == 'tnoradio':
+        return TNO_API_KEY, TNO_CHANNEL_ID
+    return PROGRAMAS_API_KEY, PROGRAMAS_CHANNEL_ID
+
+
+def find_playlist_by_name(playlists, playlist_name):
+    """Best ranked playlist whose title contains playlist_name, ignoring case and accents (see search.rank)"""
+    return best_match(playlists, playlist_name, lambda playlist: playlist['title'])
+
+
+def published_at(episode):
+    return episode.get('published_at') or ''  # Default to empty string if 'published_at' is missing
+
+
+def as_episodes(items, channel):
+    """Adds the video URL and the channel to playlist items, sorted by 'published_at'"""
+    for item in items:
+        item['video_url'] = f"https://www.youtube.com/watch?v={item['video_id']}"
+        item['channel'] = channel
+    return sorted(items, key=published_at)
+
+
+def merge_episodes(channel_episodes):
+    """Merges per-channel episode lists already sorted by 'published_at' (earlier channels first on ties)"""
+    return list(heapq.merge(*channel_episodes, key=published_at))
 
-class Youtube:
-    def __init__(self, channel):
-        self.channel = channel
-        self.api_key = TNO_API_KEY if channel == 'tnoradio' else PROGRAMAS_API_KEY
-        self.channel_id = TNO_CHANNEL_ID if channel == 'tnoradio' else PROGRAMAS_CHANNEL_ID
-        self.youtube = build('youtube', 'v3', developerKey=self.api_key)
-
-    def get_playlist_items(self, playlist_name):
-        playlists = self.get_playlists()
-        playlist = self.find_playlist_by_name(playlists, playlist_name)
-
-        if not playlist:
-            return []  # Return an empty list if no playlist found
-
-        playlist_items = []
-        next_page_token = None
-
-        while True:
-            # Request to fetch playlist items (videos)
-            request = self.youtube.playlistItems().list(
-                part="snippet",
-                playlistId=playlist['playlist_id'],
-                maxResults=50,
-                pageToken=next_page_token
-            )
-            response = request.execute()
-
-            # Loop through the items and add them to the list
-            for item in response['items']:
-                title = item['snippet']['title']
-                video_id = item['snippet']['resourceId']['videoId']
-                playlist_items.append({
-                    'title': title, 
-                    'video_id': video_id,
-                    'published_at': item['snippet']['publishedAt']  # Add published date
-                })
-
-            # Check if there's another page of results
-            next_page_token = response.get('nextPageToken')
-            if not next_page_token:
-                break
 
-        return playlist_items
-
-    def get_playlists(self):
-        playlists = []
-        next_page_token = None
-
-        while True:
-            request = self.youtube.playlists().list(
-                part="snippet",
-                channelId=self.channel_id,
-                maxResults=50,
-                pageToken=next_page_token
-            )
-            response = request.execute()
-
-            # Loop through the playlists and add them to the list
-            for item in response['items']:
-                title = item['snippet']['title']
-                playlist_id = item['id']
-                playlists.append({'title': title, 'playlist_id': playlist_id})
-
-            # Check if there's another page of results
-            next_page_token = response.get('nextPageToken')
-            if not next_page_token:
+def list_all(api_key, resource, pages=None, **params):
+    """
+    Pages through a Data API list call over the shared HTTP client.
+    Returns (pages, items), where pages is the [page_token, etag] of every
+    page read. When the pages of an earlier call are given, each one is
+    first revalidated with its ETag; if none changed, returns (pages, None)
+    without reading them.
+    """
+    params = {"part": "snippet", "maxResults": 50, "key": api_key, **params}
+    response = None
+    if pages:
+        for position, (page_token, etag) in enumerate(pages):
+            response = _get_page(resource, params, page_token, etag)
+            if response.status_code != 304:
                 break
+        else:
+            return pages, None
+        if position:
+            # the pages before it were only revalidated: the whole listing is read again
+            response = None
+    read = []
+    items = []
+    page_token = None
+    while True:
+        if response is None:
+            response = _get_page(resource, params, page_token)
+        response.raise_for_status()
+        data = response.json()
+        response = None
+        read.append([page_token, data.get('etag')])
+        items.extend(data['items'])
+
+        # Check if there's another page of results
+        page_token = data.get('nextPageToken')
+        if not page_token:
+            return read, items
+
+
+def _get_page(resource, params, page_token=None, etag=None):
+    if page_token:
+        params = {**params, "pageToken": page_token}
+    headers = {"If-None-Match": etag} if etag else {}
+    return upstream.get(f"{YOUTUBE_API_URL}/{resource}", params=params, headers=headers)
 
-        return playlists
-
-    def find_playlist_by_name(self, playlists, playlist_name):
-        for playlist in playlists:
-            if playlist_name.lower() in playlist['title'].lower():
-                return playlist
-        return None
-    
-
-    def get_all_episodes_sorted(self, playlist_name):
-        all_episodes = []
-
-        # Process episodes for both channels
-        for channel in ['tnoradio', 'programas']:
-            self.channel = channel
-            self.youtube = build('youtube', 'v3', developerKey=self.api_key)  # Ensure correct client for the channel
-
-            playlists = self.get_playlists()
-            playlist = self.find_playlist_by_name(playlists, playlist_name)
-
-            if playlist:
-                # Fetch playlist items
-                episodes = self.get_playlist_items(playlist_name)
-                print(f"Fetched {len(episodes)} episodes for {playlist_name} playlist")
-                # Add video URLs and other channel-specific metadata
-                for episode in episodes:
-                    episode['video_url'] = f"https://www.youtube.com/watch?v={episode['video_id']}"
-                    episode['channel'] = channel
-                all_episodes.extend(episodes)
-
-        # Sort all episodes by 'published_at'
-        sorted_episodes = sorted(
-            all_episodes,
-            key=lambda x: x.get('published_at') or '',  # Default to empty string if 'published_at' is missing
-        )
-
-        return sorted_episodes